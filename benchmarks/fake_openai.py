@@ -0,0 +1,315 @@
+"""
+Local stand-in for the OpenAI chat completions, Files and Batch endpoints, answering translation requests
+with canned output. Chat completions can be given latency, per-minute rate limits and random 5xx errors
+for load tests (see benchmarks.openai_load).
+
+Start it in-process with FakeOpenAIServer().start() and point a client at its base_url, or from the
+repository root run a batch job against it:
+
+    python -m benchmarks.fake_openai [job name] [path/to/telegram_messages.json]
+"""
+import re
+import json
+import time
+import random
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_NUMBERED_LINE = re.compile(r'^(\d+)\. ?(.*)$')
+
+
+def fake_translation(user_message: str, drop_every: int = 0) -> dict:
+    """
+    Build a BatchTranslationResponse-shaped answer to a numbered user message.
+    With drop_every=n, every n-th item is left out, as the model sometimes does.
+    """
+    translations = []
+    for line in user_message.split("\n"):
+        match = _NUMBERED_LINE.match(line)
+        if not match:
+            continue
+        number = int(match.group(1))
+        if drop_every and number % drop_every == 0:
+            continue
+        text = match.group(2)
+        translations.append({"number": number, "translation": {"hebrew": f"he: {text}", "english": f"en: {text}"}})
+    return {"translations": translations}
+
+
+def _text(content) -> str:
+    """The text of a message content, which may be a multimodal list of parts."""
+    if isinstance(content, str):
+        return content
+    return "\n".join(part.get("text", "") for part in content or [] if part.get("type") == "text")
+
+
+def _usage(body: dict, content: str) -> dict:
+    # Rough token counts are enough to exercise the cost tracking; images count as 765 tokens each
+    prompt_tokens = sum(len(_text(message["content"])) for message in body["messages"]) // 3
+    prompt_tokens += 765 * sum(1 for message in body["messages"] if isinstance(message["content"], list)
+                               for part in message["content"] if part.get("type") == "image_url")
+    completion_tokens = len(content) // 3
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+def chat_completion(body: dict, drop_every: int = 0) -> dict:
+    """Answer a chat completion request body the way the API does."""
+    user_message = _text(body["messages"][-1]["content"])
+    content = json.dumps(fake_translation(user_message, drop_every), ensure_ascii=False)
+    return {
+        "id": f"chatcmpl-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body["model"],
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": content, "refusal": None}}],
+        "usage": _usage(body, content),
+    }
+
+
+class FakeOpenAIServer:
+    """
+    Serves /v1/chat/completions, /v1/files and /v1/batches from memory.
+
+    Chat completions take `latency` seconds, fail with a 500 at `error_rate`, and are answered with a 429
+    once the per-minute request or token limit is used up, with x-ratelimit-* headers as the API sends them. A batch moves from 'validating' to 'in_progress' to 'completed' over
+    processing_seconds, and its output file is built when it completes.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, processing_seconds: float = 0.5,
+                 drop_every: int = 0, fail_custom_ids: tuple = (), latency: float = 0.0,
+                 requests_per_minute: int = None, tokens_per_minute: int = None, burst_seconds: float = 60.0,
+                 error_rate: float = 0.0, seed: int = 0):
+        """
+        :param port: Port to listen on; 0 picks a free one.
+        :param processing_seconds: Time a batch takes to complete.
+        :param drop_every: Leave every n-th item out of each translation response.
+        :param fail_custom_ids: Requests answered with a 500 error in the output file.
+        :param latency: Seconds each chat completion takes.
+        :param requests_per_minute: Chat completion request limit; None for no limit.
+        :param tokens_per_minute: Chat completion token limit (prompt plus max_completion_tokens); None for no limit.
+        :param burst_seconds: Seconds' worth of the per-minute limits that can be used at once.
+        :param error_rate: Share of chat completions answered with a 500.
+        """
+        self.processing_seconds = processing_seconds
+        self.drop_every = drop_every
+        self.fail_custom_ids = set(fail_custom_ids)
+        self.latency = latency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.burst_seconds = burst_seconds
+        self.error_rate = error_rate
+        self.files = {}
+        self.batches = {}
+        self.uploads = 0
+        self.batches_created = 0
+        self.completions = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self._remaining = {"requests": self._capacity(requests_per_minute), "tokens": self._capacity(tokens_per_minute)}
+        self._refilled_at = time.time()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _capacity(self, limit):
+        return limit * self.burst_seconds / 60 if limit is not None else 0
+
+    def _admit(self, body: dict):
+        """
+        Count a chat completion against the per-minute limits, which replenish continuously as the API's do.
+
+        :return: The HTTP status (200, 429 or 500) and the x-ratelimit-* headers to answer with
+        """
+        tokens = _usage(body, "")["prompt_tokens"] + (body.get("max_completion_tokens") or 0)
+        with self._lock:
+            now = time.time()
+            elapsed = now - self._refilled_at
+            self._refilled_at = now
+            for kind, limit in (("requests", self.requests_per_minute), ("tokens", self.tokens_per_minute)):
+                if limit is not None:
+                    self._remaining[kind] = min(self._capacity(limit), self._remaining[kind] + elapsed * limit / 60)
+
+            over_requests = self.requests_per_minute is not None and self._remaining["requests"] < 1
+            over_tokens = self.tokens_per_minute is not None and self._remaining["tokens"] < tokens
+            if over_requests or over_tokens:
+                self.rate_limited += 1
+                status = 429
+            elif self._random.random() < self.error_rate:
+                self.errors += 1
+                status = 500
+            else:
+                self._remaining["requests"] -= 1
+                self._remaining["tokens"] -= tokens
+                self.completions += 1
+                status = 200
+
+            headers = {}
+            for kind, limit in (("requests", self.requests_per_minute), ("tokens", self.tokens_per_minute)):
+                if limit is not None:
+                    remaining = max(0, int(self._remaining[kind]))
+                    headers[f"x-ratelimit-limit-{kind}"] = str(limit)
+                    headers[f"x-ratelimit-remaining-{kind}"] = str(remaining)
+                    headers[f"x-ratelimit-reset-{kind}"] = f"{(self._capacity(limit) - remaining) * 60 / limit:.3f}s"
+        return status, headers
+
+    def _add_file(self, content: bytes, filename: str, purpose: str) -> dict:
+        with self._lock:
+            file_id = f"file-{len(self.files) + 1}"
+            self.files[file_id] = {"content": content, "meta": {
+                "id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}}
+        return self.files[file_id]["meta"]
+
+    def _create_batch(self, request: dict) -> dict:
+        with self._lock:
+            self.batches_created += 1
+            batch_id = f"batch_{len(self.batches) + 1}"
+            self.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": request["endpoint"], "errors": None,
+                "input_file_id": request["input_file_id"], "completion_window": request["completion_window"],
+                "status": "validating", "output_file_id": None, "error_file_id": None,
+                "created_at": time.time(), "metadata": request.get("metadata"),
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+        return self._batch_json(batch_id)
+
+    def _batch_json(self, batch_id: str) -> dict:
+        batch = self.batches[batch_id]
+        elapsed = time.time() - batch["created_at"]
+        if batch["status"] == "validating" and elapsed >= self.processing_seconds / 2:
+            batch["status"] = "in_progress"
+        if batch["status"] == "in_progress" and elapsed >= self.processing_seconds:
+            self._complete(batch)
+        return dict(batch, created_at=int(batch["created_at"]))
+
+    def _complete(self, batch: dict) -> None:
+        lines = self.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+        outputs, errors = [], []
+        for number, line in enumerate(lines):
+            request = json.loads(line)
+            custom_id = request["custom_id"]
+            if custom_id in self.fail_custom_ids:
+                response = {"status_code": 500, "request_id": f"req_{number}",
+                            "body": {"error": {"message": "The server had an error", "type": "server_error"}}}
+                errors.append({"id": f"batch_req_{number}", "custom_id": custom_id, "response": response, "error": None})
+                continue
+            response = {"status_code": 200, "request_id": f"req_{number}",
+                        "body": chat_completion(request["body"], self.drop_every)}
+            outputs.append({"id": f"batch_req_{number}", "custom_id": custom_id, "response": response, "error": None})
+
+        def to_jsonl(items):
+            return "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items).encode("utf-8")
+
+        batch["output_file_id"] = self._add_file(to_jsonl(outputs), "output.jsonl", "batch_output")["id"]
+        if errors:
+            batch["error_file_id"] = self._add_file(to_jsonl(errors), "errors.jsonl", "batch_output")["id"]
+        batch["request_counts"] = {"total": len(lines), "completed": len(outputs), "failed": len(errors)}
+        batch["status"] = "completed"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, payload=None, raw: bytes = None, headers: dict = None):
+                body = raw if raw is not None else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/octet-stream" if raw is not None else "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_POST(self):
+                if self.path == "/v1/files":
+                    message = BytesParser(policy=HTTP).parsebytes(
+                        f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + self._body())
+                    fields = {part.get_param("name", header="content-disposition"): part
+                              for part in message.iter_parts()}
+                    upload = fields["file"]
+                    with server._lock:
+                        server.uploads += 1
+                    self._send(200, server._add_file(upload.get_payload(decode=True), upload.get_filename(),
+                                                     fields["purpose"].get_content().strip()))
+                elif self.path == "/v1/batches":
+                    self._send(200, server._create_batch(json.loads(self._body())))
+                elif self.path == "/v1/chat/completions":
+                    body = json.loads(self._body())
+                    status, headers = server._admit(body)
+                    if status == 429:
+                        self._send(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                                   "code": "rate_limit_exceeded"}}, headers=headers)
+                        return
+                    time.sleep(server.latency)
+                    if status == 500:
+                        self._send(500, {"error": {"message": "The server had an error", "type": "server_error"}},
+                                   headers=headers)
+                        return
+                    self._send(200, chat_completion(body, server.drop_every), headers=headers)
+                else:
+                    self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+            def do_GET(self):
+                parts = self.path.strip("/").split("/")
+                if parts[:2] == ["v1", "batches"] and len(parts) == 3 and parts[2] in server.batches:
+                    self._send(200, server._batch_json(parts[2]))
+                elif parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content" \
+                        and parts[2] in server.files:
+                    self._send(200, raw=server.files[parts[2]]["content"])
+                else:
+                    self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import logging
+    import sys
+
+    import openai
+
+    from message_record import MessageRecord
+    from openai_batch import BatchTranslationJob
+
+    logging.basicConfig(level=logging.INFO)
+    job_name = sys.argv[1] if len(sys.argv) > 1 else "fake-backfill"
+    input_file = sys.argv[2] if len(sys.argv) > 2 else "telegram_messages.json"
+
+    with open(input_file, "r", encoding="utf-8") as f:
+        records = [MessageRecord.from_json(message) for message in json.load(f)]
+
+    server = FakeOpenAIServer(drop_every=13).start()
+    try:
+        client = openai.OpenAI(api_key="fake", base_url=server.base_url)
+        job = BatchTranslationJob(job_name, client=client, poll_interval=0.2)
+        translations, missing = job.run(records)
+        print(f"{len(translations)} messages translated, {len(missing)} missing "
+              f"({server.uploads} uploads, {server.batches_created} batches created)")
+        job.print_total_costs()
+    finally:
+        server.stop()
@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytz
+from telethon.errors import FloodWaitError
+
+
+class FakeMedia:
+    pass
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, date: datetime, text: str, sender_id: int, media=None):
+        self.id = message_id
+        self.date = date
+        self.message = text
+        self.sender_id = sender_id
+        self.media = media
+
+
+class FakeTelegramClient:
+    """
+    Stand-in for TelegramClient that serves canned message history with injected latency.
+
+    Each channel holds `messages_per_channel` messages spaced `spacing_seconds` apart, newest first,
+    ending at the time the client was created.
+    """
+
+    def __init__(self, channels: list, messages_per_channel: int = 1000, spacing_seconds: int = 60,
+                 latency: float = 0.05, flood_on_call: int = None, flood_seconds: int = 1, drop_on_call: int = None):
+        """
+        :param flood_on_call: Raise a FloodWaitError of flood_seconds on this call number.
+        :param drop_on_call: Disconnect for good on this call number; it and later calls raise ConnectionError.
+        """
+        self.latency = latency
+        self.flood_on_call = flood_on_call
+        self.flood_seconds = flood_seconds
+        self.drop_on_call = drop_on_call
+        self.connected = True
+        self.calls = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+
+        now = datetime.utcnow().replace(tzinfo=pytz.UTC)
+        self.history = {}
+        for channel_index, channel in enumerate(channels):
+            self.history[channel] = [
+                FakeMessage(
+                    message_id=messages_per_channel - i,
+                    date=now - timedelta(seconds=i * spacing_seconds),
+                    text=f"{channel} message {messages_per_channel - i}",
+                    sender_id=-1000000000000 - channel_index,
+                    media=FakeMedia() if i % 5 == 0 else None
+                )
+                for i in range(messages_per_channel)
+            ]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+    async def is_user_authorized(self):
+        return True
+
+    def is_connected(self):
+        return self.connected
+
+    async def _simulate_call(self):
+        self.calls += 1
+        if self.calls == self.drop_on_call:
+            self.connected = False
+        if not self.connected:
+            raise ConnectionError("Fake client disconnected")
+        if self.calls == self.flood_on_call:
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+
+        self._in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self._in_flight -= 1
+
+    async def get_entity(self, channel_username):
+        await self._simulate_call()
+        return channel_username
+
+    async def get_messages(self, channel, limit=100, offset_id=0, offset_date=None, min_id=0, max_id=0):
+        await self._simulate_call()
+        messages = self.history[channel]
+        if offset_id:
+            messages = [m for m in messages if m.id < offset_id]
+        if offset_date:
+            messages = [m for m in messages if m.date < offset_date]
+        if min_id:
+            messages = [m for m in messages if m.id > min_id]
+        if max_id:
+            messages = [m for m in messages if m.id < max_id]
+        return messages[:limit]
@@ -0,0 +1,42 @@
+"""
+Measure how long a multi-channel sweep takes with sequential vs. concurrent fetching.
+
+Runs offline against FakeTelegramClient. From the repository root:
+
+    python -m benchmarks.fetch_concurrency
+"""
+import asyncio
+import logging
+import time
+
+from telegram_service import TelegramScraper
+from benchmarks.fake_telegram import FakeTelegramClient
+
+CHANNELS = [f"channel_{i}" for i in range(40)]
+MESSAGES_PER_CHANNEL = 1000
+LATENCY = 0.05
+TIME_WINDOW_MINUTES = 600
+
+
+async def run_sweep(max_concurrent_requests: int):
+    client = FakeTelegramClient(CHANNELS, messages_per_channel=MESSAGES_PER_CHANNEL, latency=LATENCY)
+    scraper = TelegramScraper(client=client, max_concurrent_requests=max_concurrent_requests)
+
+    start_time = time.perf_counter()
+    messages = await scraper.fetch_messages(CHANNELS, TIME_WINDOW_MINUTES)
+    elapsed_time = time.perf_counter() - start_time
+
+    return elapsed_time, len(messages), client
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"{len(CHANNELS)} channels, {MESSAGES_PER_CHANNEL} messages each, {LATENCY * 1000:.0f}ms per call")
+    baseline = None
+    for max_concurrent_requests in [1, 4, 16, 64]:
+        elapsed_time, count, client = asyncio.run(run_sweep(max_concurrent_requests))
+        baseline = baseline or elapsed_time
+        print(f"max_concurrent_requests={max_concurrent_requests:<3} {elapsed_time:7.3f}s  "
+              f"messages={count}  calls={client.calls}  peak in-flight={client.max_in_flight}  "
+              f"speedup={baseline / elapsed_time:.1f}x")
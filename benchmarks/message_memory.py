@@ -0,0 +1,45 @@
+"""
+Compare the memory held by scraped messages as JSON-schema dicts vs. MessageRecords.
+
+From the repository root:
+
+    python -m benchmarks.message_memory [path/to/telegram_messages.json]
+"""
+import gc
+import json
+import sys
+import tracemalloc
+
+from message_record import MessageRecord
+
+DEFAULT_INPUT_FILE = "telegram_messages.json"
+
+
+def measure(build):
+    """Return the object built by build() and the bytes it still holds once built."""
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size
+
+
+if __name__ == "__main__":
+    input_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_INPUT_FILE
+    with open(input_file, "r", encoding="utf-8") as f:
+        raw = f.read()
+
+    messages, dict_size = measure(lambda: json.loads(raw))
+    # Parse again so the records don't share the message strings already counted for the dicts
+    records, record_size = measure(lambda: [MessageRecord.from_json(message) for message in json.loads(raw)])
+
+    # The round trip must be lossless for notebook consumers using pd.json_normalize
+    mismatches = sum(record.to_json() != message for record, message in zip(records, messages))
+
+    print(f"{len(messages)} messages from {input_file}")
+    print(f"dicts:   {dict_size / 1024:10.1f} KiB  ({dict_size / len(messages):6.0f} B/message)")
+    print(f"records: {record_size / 1024:10.1f} KiB  ({record_size / len(messages):6.0f} B/message)")
+    print(f"saving:  {(1 - record_size / dict_size) * 100:.1f}%")
+    print(f"round-trip mismatches: {mismatches}")
@@ -0,0 +1,46 @@
+"""
+Measure how many scraped messages are near-duplicates, and how fast the index checks them.
+
+From the repository root:
+
+    python -m benchmarks.near_duplicates [path/to/telegram_messages.json]
+"""
+import json
+import sys
+import time
+
+from message_record import MessageRecord
+from near_duplicates import NearDuplicateIndex, normalize_arabic
+
+DEFAULT_INPUT_FILE = "telegram_messages.json"
+
+
+if __name__ == "__main__":
+    input_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_INPUT_FILE
+    with open(input_file, "r", encoding="utf-8") as f:
+        records = [MessageRecord.from_json(message) for message in json.load(f)]
+
+    index = NearDuplicateIndex()
+    started = time.perf_counter()
+    index.mark_duplicates(records)
+    elapsed = time.perf_counter() - started
+
+    by_key = {(record.channel, record.message_id): record for record in records}
+    exact = sum(normalize_arabic(record.message) == normalize_arabic(by_key[record.duplicate_of].message)
+                for record in records if record.duplicate_of)
+
+    print(f"{len(records)} messages from {input_file}, {index.checked} with text")
+    print(f"duplicates:  {index.duplicates} ({index.duplicate_ratio:.1%}), {exact} exact after normalization")
+    print(f"index size:  {len(index)} originals")
+    print(f"throughput:  {index.checked / elapsed:,.0f} messages/s ({elapsed / index.checked * 1e6:.0f} us/message)")
+
+    # Show a few near (not exact) duplicates to eyeball the threshold
+    shown = 0
+    for record in records:
+        if record.duplicate_of and shown < 3:
+            original = by_key[record.duplicate_of]
+            if normalize_arabic(record.message) != normalize_arabic(original.message):
+                print(f"\n{record.channel}/{record.message_id} ~ {original.channel}/{original.message_id}")
+                print(f"  {original.message[:120]!r}")
+                print(f"  {record.message[:120]!r}")
+                shown += 1
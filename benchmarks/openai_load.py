@@ -0,0 +1,67 @@
+"""
+Load-test AsyncOpenAIClient against the local fake OpenAI server: a backfill floods the queue, then live
+requests arrive and should overtake it, while the client stays under the server's rate limit and retries
+its 5xx errors.
+
+From the repository root:
+
+    python -m benchmarks.openai_load [backfill requests] [live requests]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from benchmarks.fake_openai import FakeOpenAIServer
+from openai_client import BACKFILL_PRIORITY, LIVE_PRIORITY, AsyncOpenAIClient
+
+REQUESTS_PER_MINUTE = 1200
+TOKENS_PER_MINUTE = 300_000
+BURST_SECONDS = 5
+LATENCY = 0.1
+ERROR_RATE = 0.05
+LIVE_DELAY = 2.0
+
+
+async def timed_chat(client: AsyncOpenAIClient, number: int, priority: int) -> tuple:
+    started = time.perf_counter()
+    response = await client.chat("Translate.", f"1. message {number}", max_completion_tokens=50, priority=priority)
+    return time.perf_counter() - started, response is not None
+
+
+async def run(backfill_requests: int, live_requests: int, base_url: str) -> AsyncOpenAIClient:
+    client = AsyncOpenAIClient(model="gpt-4o-mini-2024-07-18", base_url=base_url)
+
+    backfill = [asyncio.create_task(timed_chat(client, number, BACKFILL_PRIORITY))
+                for number in range(backfill_requests)]
+    await asyncio.sleep(LIVE_DELAY)
+    live = await asyncio.gather(*(timed_chat(client, number, LIVE_PRIORITY) for number in range(live_requests)))
+    backfill = await asyncio.gather(*backfill)
+    await client.close()
+
+    for name, results in (("live", live), ("backfill", backfill)):
+        latencies = sorted(latency for latency, _ in results)
+        failed = sum(not ok for _, ok in results)
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0.0
+        print(f"{name:9s} {len(results):5d} requests  p50 {statistics.median(latencies):6.2f}s  "
+              f"p95 {p95:6.2f}s  failed {failed}")
+    return client
+
+
+if __name__ == "__main__":
+    backfill_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    live_requests = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    server = FakeOpenAIServer(latency=LATENCY, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                              burst_seconds=BURST_SECONDS, error_rate=ERROR_RATE).start()
+    try:
+        started = time.perf_counter()
+        client = asyncio.run(run(backfill_requests, live_requests, server.base_url))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.stop()
+
+    total = backfill_requests + live_requests
+    print(f"{total} requests in {elapsed:.1f}s ({total / elapsed:.1f}/s, server limit {REQUESTS_PER_MINUTE / 60:.0f}/s)")
+    print(f"server: {server.completions} completions, {server.rate_limited} rate limited, {server.errors} errors")
+    print(f"client: {client.retries} retries, {client.rate_limited} rate limited, {client.failed} failed")
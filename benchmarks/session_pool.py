@@ -0,0 +1,76 @@
+"""
+Check the SessionPool scheduling offline against fake clients: throughput as sessions are added,
+routing around a session under FloodWait, and rebalancing after a session drops.
+
+From the repository root:
+
+    python -m benchmarks.session_pool
+"""
+import asyncio
+import logging
+import time
+
+from telegram_service import TelegramScraper
+from session_pool import SessionPool
+from benchmarks.fake_telegram import FakeTelegramClient
+
+CHANNELS = [f"channel_{i}" for i in range(24)]
+MESSAGES_PER_CHANNEL = 1000
+LATENCY = 0.05
+TIME_WINDOW_MINUTES = 600
+
+# Per-account in-flight limit, standing in for each account's own flood limits
+REQUESTS_PER_ACCOUNT = 2
+
+
+def make_pool(sessions: int, fake_options_by_index: dict = None):
+    scrapers = []
+    clients = []
+    for index in range(sessions):
+        client = FakeTelegramClient(CHANNELS, messages_per_channel=MESSAGES_PER_CHANNEL, latency=LATENCY,
+                                    **(fake_options_by_index or {}).get(index, {}))
+        clients.append(client)
+        scrapers.append(TelegramScraper(client=client, max_concurrent_requests=REQUESTS_PER_ACCOUNT))
+    return SessionPool(scrapers, channels_per_session=REQUESTS_PER_ACCOUNT), clients
+
+
+async def run(pool: SessionPool):
+    start_time = time.perf_counter()
+    messages = await pool.fetch_messages(CHANNELS, TIME_WINDOW_MINUTES)
+    return messages, time.perf_counter() - start_time
+
+
+def check_complete(messages, label):
+    fetched_channels = {record.channel for record in messages}
+    assert fetched_channels == set(CHANNELS), f"{label}: missing {set(CHANNELS) - fetched_channels}"
+    assert len(messages) == len(CHANNELS) * TIME_WINDOW_MINUTES, f"{label}: got {len(messages)} messages"
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.ERROR)
+
+    print(f"{len(CHANNELS)} channels, {REQUESTS_PER_ACCOUNT} requests in flight per account, {LATENCY * 1000:.0f}ms per call")
+    baseline = None
+    for sessions in [1, 2, 4]:
+        pool, clients = make_pool(sessions)
+        messages, elapsed_time = asyncio.run(run(pool))
+        check_complete(messages, f"{sessions} sessions")
+        baseline = baseline or elapsed_time
+        print(f"sessions={sessions}  {elapsed_time:6.3f}s  speedup={baseline / elapsed_time:.1f}x  "
+              f"calls per session={[client.calls for client in clients]}")
+
+    # Session 0 hits a 2s FloodWait on its third call: the other sessions should take over its share
+    pool, clients = make_pool(3, {0: {'flood_on_call': 3, 'flood_seconds': 2}})
+    messages, elapsed_time = asyncio.run(run(pool))
+    check_complete(messages, "flood")
+    assert clients[0].calls < min(clients[1].calls, clients[2].calls)
+    print(f"flood:  {elapsed_time:6.3f}s  calls per session={[client.calls for client in clients]}")
+
+    # Session 1 drops on its fifth call: its channels should be refetched by the others
+    pool, clients = make_pool(3, {1: {'drop_on_call': 5}})
+    messages, elapsed_time = asyncio.run(run(pool))
+    check_complete(messages, "drop")
+    assert pool.dropped == {1}
+    print(f"drop:   {elapsed_time:6.3f}s  calls per session={[client.calls for client in clients]}  dropped={pool.dropped}")
+
+    print("All scheduling checks passed.")
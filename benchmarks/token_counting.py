@@ -0,0 +1,85 @@
+"""
+Compare the per-string cost of counting message tokens before and after memoizing the model->encoding
+resolution, and with count_batch.
+
+From the repository root:
+
+    python -m benchmarks.token_counting [path/to/telegram_messages.json] [model]
+"""
+import contextlib
+import io
+import json
+import sys
+import time
+
+import tiktoken
+
+from token_counter import TokenCounter
+
+DEFAULT_INPUT_FILE = "telegram_messages.json"
+# A dated model name, as OpenAIClient uses, which the encoding map only matches by substring
+DEFAULT_MODEL = "gpt-4o-2024-08-06"
+ROUNDS = 5
+
+
+def legacy_num_tokens(counter: TokenCounter, string: str, model_name: str) -> int:
+    """num_tokens_from_string as it was: resolve the model, print, and look up the encoding on every call."""
+    encoding_name = counter.model_encoding_map.get(model_name)
+    if not encoding_name:
+        matching_model = counter._find_closest_model(model_name)
+        if matching_model:
+            encoding_name = counter.model_encoding_map[matching_model]
+            print(f"Using closest match for encoding: '{matching_model}' for input model '{model_name}'")
+        else:
+            encoding_name = counter.default_encoding
+            print(f"No close match found. Using default encoding: '{counter.default_encoding}' for input model '{model_name}'")
+    return len(tiktoken.get_encoding(encoding_name).encode(string))
+
+
+def best_of(run) -> float:
+    """Best wall time of a few rounds, in seconds."""
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    input_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_INPUT_FILE
+    model = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_MODEL
+    with open(input_file, "r", encoding="utf-8") as f:
+        texts = [message["message"] for message in json.load(f)]
+
+    counter = TokenCounter()
+    encoding = counter.encoding_for_model(model)  # Load the encoding up front, outside the timings
+
+    def legacy():
+        # Printed lines go to a buffer; in a notebook, rendering them costs far more
+        with contextlib.redirect_stdout(io.StringIO()):
+            return [legacy_num_tokens(counter, text, model) for text in texts]
+
+    timings = {
+        "encode only": best_of(lambda: [len(encoding.encode(text)) for text in texts]),
+        "before": best_of(legacy),
+        "after": best_of(lambda: [counter.num_tokens_from_string(text, model) for text in texts]),
+        "count_batch": best_of(lambda: counter.count_batch(texts, model)),
+    }
+
+    assert legacy() == counter.count_batch(texts, model), "token counts differ"
+
+    floor = timings["encode only"]
+    print(f"{len(texts)} messages from {input_file}, model '{model}'")
+    for name, elapsed in timings.items():
+        per_string = elapsed / len(texts) * 1e6
+        overhead = (elapsed - floor) / len(texts) * 1e6
+        print(f"{name:12s} {elapsed * 1000:8.1f} ms  {per_string:7.2f} us/string  overhead {overhead:+7.2f} us/string")
+
+    # The same calls on empty strings, where the cost is nearly all per-call overhead
+    empty = [""] * len(texts)
+    with contextlib.redirect_stdout(io.StringIO()):
+        before = best_of(lambda: [legacy_num_tokens(counter, text, model) for text in empty])
+    after = best_of(lambda: [counter.num_tokens_from_string(text, model) for text in empty])
+    print(f"per-call overhead on empty strings: before {before / len(empty) * 1e6:.2f} us, "
+          f"after {after / len(empty) * 1e6:.2f} us")
@@ -0,0 +1,49 @@
+import os
+import json
+import logging
+from typing import Optional
+
+# Default location of the checkpoint file, next to the session directory
+CHECKPOINT_FILE = os.path.join(os.getcwd(), 'telegram_checkpoints.json')
+
+class CheckpointStore:
+    """Persists the highest message_id seen per channel so a run can fetch only newer messages."""
+
+    def __init__(self, path: str = CHECKPOINT_FILE):
+        """
+        Load existing checkpoints from disk, if any.
+
+        :param path: Path of the JSON file holding the checkpoints.
+        """
+        self.path = path
+        self._checkpoints = {}
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._checkpoints = {channel: int(message_id) for channel, message_id in json.load(f).items()}
+            except (ValueError, OSError) as e:
+                logging.error(f"Error loading checkpoints from {self.path}: {e}")
+                raise
+
+    def get(self, channel: str) -> Optional[int]:
+        """
+        Return the last seen message_id for a channel, or None if the channel was never fetched.
+        """
+        return self._checkpoints.get(channel)
+
+    def update(self, channel: str, message_id: int) -> None:
+        """
+        Advance the high-water mark of a channel. Older ids never move the mark backwards.
+        """
+        if message_id > self._checkpoints.get(channel, 0):
+            self._checkpoints[channel] = message_id
+
+    def save(self) -> None:
+        """
+        Write the checkpoints to disk atomically, so an interrupted run never leaves a truncated file.
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._checkpoints, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
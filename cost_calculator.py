@@ -1,29 +1,41 @@
-import requests
 from token_counter import TokenCounter
+from cost_metrics import CostRecord
+from pricing_table import get_pricing_table
+
+# Batch API requests cost half the synchronous price when the pricing data has no batch prices
+BATCH_DISCOUNT = 0.5
+
+# Cached input tokens cost half the input price when the pricing data has no cached-input price
+CACHED_INPUT_DISCOUNT = 0.5
+
+# Prompt tokens of an image, as (base, per 512px tile), for estimates when the API reports no usage.
+# Estimates assume a 1024x1024 high-detail image, i.e. 4 tiles.
+IMAGE_TOKENS = {
+    "gpt-4o-mini": (2833, 5667),
+    "gpt-4o": (85, 170),
+}
+DEFAULT_IMAGE_TILES = 4
+
+def _usage_field(usage, name: str, default=0):
+    """Read a field of an API usage object or of its JSON dict (as in Batch API output)."""
+    value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+    return default if value is None else value
 
 class CostCalculator:
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str, batch: bool = False):
         """
-        Initialize the cost calculator by fetching pricing data from the URL, setting up the token counter, 
-        and resolving the closest match for encoding, if needed. Pricing is resolved directly if available.
+        Initialize the cost calculator with the pricing table shared by the process (see pricing_table), setting up
+        the token counter, and resolving the closest match for encoding, if needed. Pricing is resolved directly if available.
 
         :param model_name: The name of the model to use for both encoding and pricing.
-        :param pricing_url: URL to fetch the pricing information.
+        :param batch: Price requests made through the Batch API.
         """
         self.token_counter = TokenCounter()
-        
-        # Fixed cost per image model used (gpt-4o)
-        self.IMAGE_COST_PER_MODEL = 0.0021  
-
-        # URL to the updated model pricing and context window data
-        pricing_url = "https://raw.githubusercontent.com/BerriAI/litellm/refs/heads/main/model_prices_and_context_window.json"
+        self.batch = batch
 
-        # Fetch the pricing data from the URL
-        response = requests.get(pricing_url)
-        if response.status_code == 200:
-            self.pricing_data = response.json()
-        else:
-            raise ValueError(f"Failed to fetch pricing data. Status code: {response.status_code}")
+        # Loaded from the local cache, the network or the vendored snapshot on first use, then kept for the process
+        self.pricing_table = get_pricing_table()
+        self.pricing_data = self.pricing_table.data
 
         # Resolve and store the closest match for the encoding if necessary
         self.model_name = model_name
@@ -68,28 +80,66 @@ class CostCalculator:
             else:
                 raise ValueError(f"No pricing found for model '{model_name}'.")
 
-    def calculate_prompt_cost(self, text_prompt: str, has_image: bool = False) -> float:
+    def calculate_prompt_cost(self, text_prompt: str, has_image: bool = False, image_count: int = None) -> float:
         """
-        Calculate the cost for the given text prompt and optionally add the cost of using an image model.
+        Calculate the cost for the given text prompt and optionally add the cost of the images sent with it.
+        Prefer cost_from_usage() when the API reported the usage; this counts the tokens locally.
         
         :param text_prompt: The text prompt to be tokenized and have its cost calculated.
-        :param has_image: A boolean indicating if an image model is used (True if used, False otherwise).
+        :param has_image: A boolean indicating if an image was sent (True if used, False otherwise).
+        :param image_count: The number of images sent; overrides has_image.
         :return: The total calculated cost for the text prompt including image cost if applicable.
         """
         # Get the number of tokens in the text prompt using the resolved encoding model
         num_tokens = self.token_counter.num_tokens_from_string(text_prompt, self.encoding_model_name)
-        
-        # Get the cost per token for the text input
-        input_cost_per_token = self.pricing_data[self.pricing_model_name]['input_cost_per_token']
 
-        # Calculate the total cost for the text prompt
-        text_prompt_cost = num_tokens * input_cost_per_token
+        # Images are billed as input tokens too
+        if image_count is None:
+            image_count = 1 if has_image else 0
+        num_tokens += image_count * self.estimate_image_tokens()
 
-        # Add image cost if an image model is used
-        image_cost = self.IMAGE_COST_PER_MODEL if has_image else 0.0
+        # Get the cost per token for the text input
+        input_cost_per_token = self._cost_per_token('input')
 
         # Return the total cost (text prompt cost + image cost if applicable)
-        return text_prompt_cost + image_cost
+        return num_tokens * input_cost_per_token
+
+    def estimate_image_tokens(self, tiles: int = DEFAULT_IMAGE_TILES) -> int:
+        """
+        Estimate the prompt tokens of one high-detail image of the given number of 512px tiles.
+        """
+        # Longest name first, so 'gpt-4o-mini' isn't priced as 'gpt-4o'
+        for model in sorted(IMAGE_TOKENS, key=len, reverse=True):
+            if model in self.model_name:
+                base, per_tile = IMAGE_TOKENS[model]
+                return base + per_tile * tiles
+        base, per_tile = IMAGE_TOKENS["gpt-4o"]
+        return base + per_tile * tiles
+
+    def cost_from_usage(self, usage, image_count: int = 0) -> CostRecord:
+        """
+        Price the token usage reported by the API. Image tokens are already part of prompt_tokens,
+        and cached prompt tokens (prompt_tokens_details.cached_tokens) are billed at the cached-input price.
+
+        :param usage: The usage of a response, as an object or as its JSON dict.
+        :param image_count: The number of images sent, recorded for reference.
+        :return: The cost record of the call.
+        """
+        prompt_tokens = _usage_field(usage, 'prompt_tokens')
+        completion_tokens = _usage_field(usage, 'completion_tokens')
+        details = _usage_field(usage, 'prompt_tokens_details', None)
+        cached_tokens = _usage_field(details, 'cached_tokens') if details is not None else 0
+
+        return CostRecord(
+            model=self.model_name,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            prompt_cost=self.calculate_token_cost(prompt_tokens, 0, cached_tokens),
+            completion_cost=self.calculate_token_cost(0, completion_tokens),
+            cached_tokens=cached_tokens,
+            image_count=image_count,
+            batch=self.batch
+        )
 
     def calculate_completion_cost(self, text_completion: str) -> float:
         """
@@ -102,20 +152,45 @@ class CostCalculator:
         num_tokens = self.token_counter.num_tokens_from_string(text_completion, self.encoding_model_name)
         
         # Get the cost per token for the completion (output)
-        output_cost_per_token = self.pricing_data[self.pricing_model_name]['output_cost_per_token']
+        output_cost_per_token = self._cost_per_token('output')
 
         # Calculate total cost based on the number of tokens
         completion_cost = num_tokens * output_cost_per_token
         return completion_cost
 
+    def calculate_token_cost(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+        """
+        Calculate the cost of already counted tokens, e.g. the usage reported by the API.
+
+        :param prompt_tokens: The number of input tokens, including the cached ones.
+        :param completion_tokens: The number of output tokens.
+        :param cached_tokens: How many of the input tokens were cached.
+        :return: The cost of the input and output tokens.
+        """
+        return ((prompt_tokens - cached_tokens) * self._cost_per_token('input')
+                + cached_tokens * self._cost_per_token('cached_input')
+                + completion_tokens * self._cost_per_token('output'))
+
+    def _cost_per_token(self, kind: str) -> float:
+        """
+        Return the 'input', 'cached_input' or 'output' cost per token, at batch prices when self.batch is set.
+        """
+        pricing = self.pricing_data[self.pricing_model_name]
+        if kind == 'cached_input':
+            cost_per_token = (pricing.get('cache_read_input_token_cost')
+                              or pricing['input_cost_per_token'] * CACHED_INPUT_DISCOUNT)
+            return cost_per_token * BATCH_DISCOUNT if self.batch else cost_per_token
+
+        cost_per_token = pricing[f'{kind}_cost_per_token']
+        if self.batch:
+            return pricing.get(f'{kind}_cost_per_token_batches') or cost_per_token * BATCH_DISCOUNT
+        return cost_per_token
+
     def _find_closest_pricing_model(self, input_model: str) -> str:
         """
         Find the closest matching model name in the pricing data using substring matching.
         
         :param input_model: The input model name.
-        :return: The closest matching pricing model name or None if no match is found.
+        :return: The longest pricing model name contained in input_model, or None if no match is found.
         """
-        for model in self.pricing_data:
-            if model in input_model:
-                return model
-        return None
\ No newline at end of file
+        return self.pricing_table.closest(input_model)
@@ -0,0 +1,82 @@
+import json
+import time
+import threading
+from dataclasses import dataclass, field, asdict
+
+@dataclass(slots=True)
+class CostRecord:
+    """Cost of one API call."""
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    prompt_cost: float
+    completion_cost: float
+    cached_tokens: int = 0  # Prompt tokens billed at the cached-input price
+    image_count: int = 0
+    source: str = 'usage'  # 'usage' when the API reported the tokens, 'estimate' when they were counted locally
+    batch: bool = False
+    timestamp: float = field(default_factory=time.time)
+
+    @property
+    def total_cost(self) -> float:
+        return self.prompt_cost + self.completion_cost
+
+class CostMetrics:
+    """
+    In-memory metrics sink: keeps running totals of the cost records it receives, overall and per model.
+    Chain another sink (e.g. a CostRecordSink) to also keep the individual records.
+    """
+
+    def __init__(self, sink=None):
+        """
+        :param sink: Optional sink also receiving every record, anything with record()
+        """
+        self.sink = sink
+        self.calls = 0
+        self.estimated_calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.prompt_cost = 0.0
+        self.completion_cost = 0.0
+        self.cost_by_model = {}
+        self._lock = threading.Lock()
+
+    def record(self, cost: CostRecord) -> None:
+        with self._lock:
+            self.calls += 1
+            self.estimated_calls += cost.source != 'usage'
+            self.prompt_tokens += cost.prompt_tokens
+            self.cached_tokens += cost.cached_tokens
+            self.completion_tokens += cost.completion_tokens
+            self.prompt_cost += cost.prompt_cost
+            self.completion_cost += cost.completion_cost
+            self.cost_by_model[cost.model] = self.cost_by_model.get(cost.model, 0.0) + cost.total_cost
+        if self.sink is not None:
+            self.sink.record(cost)
+
+    @property
+    def total_cost(self) -> float:
+        return self.prompt_cost + self.completion_cost
+
+class CostRecordSink:
+    """Appends every cost record to a JSONL file, for later analysis."""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def record(self, cost: CostRecord) -> None:
+        line = json.dumps(asdict(cost)) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,33 +1,111 @@
 import os
 import json
+import asyncio
 from dotenv import load_dotenv
+from google.api_core.exceptions import InvalidArgument
 from google.cloud import translate_v3 as translate
 from typing import Optional
 
+from rate_limiter import TokenBucket
+from translation_cache import TranslationCache
+
+# Per-request limits of the v3 translateText API
+MAX_ITEMS_PER_REQUEST = 1024
+MAX_CHARS_PER_REQUEST = 30_000
+
+# Default budget shared by all requests of an AsyncTranslationService
+REQUESTS_PER_SECOND = 50
+CHARACTERS_PER_MINUTE = 6_000_000
+
+# Pricing: $20 per 1 million characters
+COST_PER_MILLION_CHARACTERS = 20.0
+
+# Engine name of Google translations in the TranslationCache
+GOOGLE_ENGINE = "google-translate-v3"
+
+def _load_project_id() -> str:
+    """Read the project ID from the JSON credentials file named by GOOGLE_APPLICATION_CREDENTIALS."""
+    load_dotenv()
+    credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+    try:
+        with open(credentials_path, 'r') as f:
+            return json.load(f).get('project_id')
+    except Exception as e:
+        print(f"Error loading credentials file: {e}")
+        raise
+
+def _pack_requests(texts: list[str], indexes: list[int]) -> list[list[int]]:
+    """
+    Group the given indexes of texts into requests under the per-request item and character limits.
+    """
+    batches = []
+    current = []
+    current_chars = 0
+    for index in indexes:
+        text = texts[index]
+        if current and (len(current) >= MAX_ITEMS_PER_REQUEST or current_chars + len(text) > MAX_CHARS_PER_REQUEST):
+            batches.append(current)
+            current = []
+            current_chars = 0
+        current.append(index)
+        current_chars += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+def _plan_batch(texts: list[str], cache: Optional[TranslationCache], source_lang: str, target_lang: str):
+    """
+    Serve what the cache already holds and group the remaining texts so that each distinct text
+    (after cache normalization) is translated once.
+
+    :return: The results prefilled with cache hits, the cost those hits saved, and the groups of
+             indexes sharing a text, keyed by that text's cache key.
+    """
+    results = [None] * len(texts)
+    saved_cost = 0.0
+    groups = {}
+    for index, text in enumerate(texts):
+        if not text:
+            continue
+        if cache:
+            cached = cache.get(text, source_lang, target_lang, GOOGLE_ENGINE)
+            if cached is not None:
+                results[index] = cached.translation
+                saved_cost += cached.cost
+                continue
+            key = cache.key(text, source_lang, target_lang, GOOGLE_ENGINE)
+        else:
+            key = text
+        groups.setdefault(key, []).append(index)
+    return results, saved_cost, groups
+
+def _finish_batch(texts: list[str], cache: Optional[TranslationCache], source_lang: str, target_lang: str,
+                  groups: dict, results: list, errors: dict) -> None:
+    """
+    Copy each translated text to its duplicates and store the new translations in the cache.
+    """
+    for indexes in groups.values():
+        first = indexes[0]
+        for index in indexes[1:]:
+            results[index] = results[first]
+            if first in errors:
+                errors[index] = errors[first]
+        if cache and results[first] is not None:
+            cost = (len(texts[first]) / 1_000_000) * COST_PER_MILLION_CHARACTERS
+            cache.put(texts[first], source_lang, target_lang, GOOGLE_ENGINE, results[first], cost)
+
 class TranslationService:
-    def __init__(self, source_lang: str, target_lang: str):
+    def __init__(self, source_lang: str, target_lang: str, cache: Optional[TranslationCache] = None):
         """
         Initialize the TranslationService.
 
         :param source_lang: The source language code (e.g., 'en' for English)
         :param target_lang: The target language code (e.g., 'es' for Spanish)
+        :param cache: Optional translation cache; hits are free and counted in saved_cost
         """
-        print("Loading environment variables...")
-        load_dotenv()
-
-        # Set up Google Cloud credentials
-        credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-        print(f"Using credentials from: {credentials_path}")
-
-        # Load the project ID from the JSON credentials file
-        try:
-            with open(credentials_path, 'r') as f:
-                credentials_data = json.load(f)
-                self.project_id = credentials_data.get('project_id')
-                print(f"Loaded project ID: {self.project_id}")
-        except Exception as e:
-            print(f"Error loading credentials file: {e}")
-            raise
+        # Load the project ID from the JSON credentials file named by GOOGLE_APPLICATION_CREDENTIALS
+        self.project_id = _load_project_id()
+        print(f"Loaded project ID: {self.project_id}")
 
         # Initialize TranslationServiceClient for v3 API
         try:
@@ -46,13 +124,19 @@ class TranslationService:
         self.total_characters = 0
         self.total_cost = 0.0
 
+        # Errors of the last translate_batch call, by input index
+        self.last_errors = {}
+
+        # Cost avoided thanks to cache hits
+        self.cache = cache
+        self.saved_cost = 0.0
+
     def _calculate_cost(self, characters: int):
         """
         Calculate the cost based on the number of input characters.
         Pricing: $20 per 1 million characters.
         """
-        cost_per_million = 20.0
-        cost = (characters / 1_000_000) * cost_per_million
+        cost = (characters / 1_000_000) * COST_PER_MILLION_CHARACTERS
         self.total_cost += cost
         self.total_characters += characters
         return cost
@@ -68,6 +152,12 @@ class TranslationService:
             print("No text provided for translation.")
             return None
 
+        if self.cache:
+            cached = self.cache.get(text, self.source_lang, self.target_lang, GOOGLE_ENGINE)
+            if cached is not None:
+                self.saved_cost += cached.cost
+                return cached.translation
+
         parent = f"projects/{self.project_id}/locations/global"
 
         try:
@@ -81,21 +171,85 @@ class TranslationService:
             
             # Calculate cost based on input characters (not output)
             characters = len(text)
-            self._calculate_cost(characters)
+            cost = self._calculate_cost(characters)
 
             # Return the translated text from the response
             translated_text = response.translations[0].translated_text
+            if self.cache:
+                self.cache.put(text, self.source_lang, self.target_lang, GOOGLE_ENGINE, translated_text, cost)
             return translated_text
         except Exception as e:
             print(f"Translation error: {e}")
             return None
 
+    def _translate_contents(self, contents: list[str]) -> list[str]:
+        parent = f"projects/{self.project_id}/locations/global"
+        response = self.client.translate_text(
+            parent=parent,
+            contents=contents,
+            source_language_code=self.source_lang,
+            target_language_code=self.target_lang
+        )
+        # Cost is based on input characters (not output), and only for requests that succeeded
+        self._calculate_cost(sum(len(text) for text in contents))
+        return [translation.translated_text for translation in response.translations]
+
+    def _translate_indexes(self, texts: list[str], indexes: list[int], results: list) -> None:
+        try:
+            translations = self._translate_contents([texts[index] for index in indexes])
+        except InvalidArgument as e:
+            if len(indexes) == 1:
+                self.last_errors[indexes[0]] = str(e)
+                return
+            # Bisect to isolate the rejected texts in a logarithmic number of extra requests
+            middle = len(indexes) // 2
+            self._translate_indexes(texts, indexes[:middle], results)
+            self._translate_indexes(texts, indexes[middle:], results)
+            return
+        except Exception as e:
+            # Quota, network and auth errors would fail the halves as well, so the whole request fails
+            for index in indexes:
+                self.last_errors[index] = str(e)
+            return
+
+        for index, translated_text in zip(indexes, translations):
+            results[index] = translated_text
+
+    def translate_batch(self, texts: list[str]) -> list[Optional[str]]:
+        """
+        Translate many texts with as few requests as the API limits allow, keeping the input order.
+
+        Cached texts are not sent, and repeated texts within the batch are sent once.
+        If a request is rejected as invalid, it is split in halves and retried, so a single bad text doesn't
+        fail the others; any other error fails the texts of that request.
+        Texts that still fail (or are empty) come back as None, with the reason in self.last_errors.
+
+        :param texts: The texts to translate
+        :return: The translated texts, aligned with texts
+        """
+        results, saved_cost, groups = _plan_batch(texts, self.cache, self.source_lang, self.target_lang)
+        self.saved_cost += saved_cost
+        self.last_errors = {index: "No text provided" for index, text in enumerate(texts) if not text}
+
+        unique_indexes = [indexes[0] for indexes in groups.values()]
+        for indexes in _pack_requests(texts, unique_indexes):
+            self._translate_indexes(texts, indexes, results)
+
+        _finish_batch(texts, self.cache, self.source_lang, self.target_lang, groups, results, self.last_errors)
+
+        if self.last_errors:
+            print(f"{len(self.last_errors)} of {len(texts)} texts could not be translated.")
+
+        return results
+
     def print_total_costs(self):
         """
         Print the total characters translated and the total accumulated cost.
         """
         print(f"Total characters translated: {self.total_characters}")
         print(f"Total accumulated cost: ${self.total_cost:.6f}")
+        if self.cache:
+            print(f"Saved by the translation cache: ${self.saved_cost:.6f} ({self.cache.hit_rate:.1%} hit rate)")
 
     def change_source_language(self, new_source_lang: str) -> None:
         """
@@ -115,6 +269,148 @@ class TranslationService:
         self.target_lang = new_target_lang
         print(f"Target language changed to: {self.target_lang}")
 
+class AsyncTranslationService:
+    """
+    asyncio translator that sends one source text to several target languages concurrently over a single
+    shared async client, under a global requests-per-second and characters-per-minute budget.
+    """
+
+    def __init__(self, source_lang: str, target_langs: list[str], requests_per_second: float = REQUESTS_PER_SECOND,
+                 characters_per_minute: float = CHARACTERS_PER_MINUTE, cache: Optional[TranslationCache] = None):
+        """
+        :param source_lang: The source language code (e.g., 'ar')
+        :param target_langs: The target language codes (e.g., ['he', 'en'])
+        :param requests_per_second: Maximum request rate across all languages
+        :param characters_per_minute: Maximum characters sent per minute across all languages
+        :param cache: Optional translation cache; hits are free and counted in saved_cost
+        """
+        self.project_id = _load_project_id()
+        self.parent = f"projects/{self.project_id}/locations/global"
+        self.source_lang = source_lang
+        self.target_langs = list(target_langs)
+
+        self._request_bucket = TokenBucket(rate=requests_per_second, capacity=requests_per_second)
+        self._character_bucket = TokenBucket(rate=characters_per_minute / 60, capacity=characters_per_minute)
+
+        # The async client binds to the running event loop, so it is created for each loop (see _get_client)
+        self._client = None
+        self._client_loop = None
+
+        self.total_characters = 0
+        self.total_cost = 0.0
+        self.cost_by_language = {lang: 0.0 for lang in self.target_langs}
+
+        # Errors of the last translate_batch call, by target language and input index
+        self.last_errors = {}
+
+        # Cost avoided thanks to cache hits
+        self.cache = cache
+        self.saved_cost = 0.0
+
+        print(f"Async translation service ready: {self.source_lang} -> {', '.join(self.target_langs)}")
+
+    def _get_client(self):
+        loop = asyncio.get_running_loop()
+        if self._client_loop is not loop:
+            # A new loop (e.g. another asyncio.run) can't reuse the channel of the old one
+            self._client = translate.TranslationServiceAsyncClient()
+            self._client_loop = loop
+        return self._client
+
+    def _calculate_cost(self, characters: int, target_lang: str) -> float:
+        cost = (characters / 1_000_000) * COST_PER_MILLION_CHARACTERS
+        self.total_cost += cost
+        self.total_characters += characters
+        self.cost_by_language[target_lang] = self.cost_by_language.get(target_lang, 0.0) + cost
+        return cost
+
+    async def _translate_contents(self, contents: list[str], target_lang: str) -> list[str]:
+        characters = sum(len(text) for text in contents)
+        await self._request_bucket.acquire()
+        await self._character_bucket.acquire(characters)
+
+        response = await self._get_client().translate_text(
+            parent=self.parent,
+            contents=contents,
+            source_language_code=self.source_lang,
+            target_language_code=target_lang
+        )
+        self._calculate_cost(characters, target_lang)
+        return [translation.translated_text for translation in response.translations]
+
+    async def _translate_indexes(self, texts: list[str], indexes: list[int], target_lang: str, results: list) -> None:
+        try:
+            translations = await self._translate_contents([texts[index] for index in indexes], target_lang)
+        except InvalidArgument as e:
+            if len(indexes) == 1:
+                self.last_errors[target_lang][indexes[0]] = str(e)
+                return
+            # One half after the other, so isolating a bad text doesn't burst requests
+            middle = len(indexes) // 2
+            await self._translate_indexes(texts, indexes[:middle], target_lang, results)
+            await self._translate_indexes(texts, indexes[middle:], target_lang, results)
+            return
+        except Exception as e:
+            # Quota, network and auth errors would fail the halves as well, so the whole request fails
+            for index in indexes:
+                self.last_errors[target_lang][index] = str(e)
+            return
+
+        for index, translated_text in zip(indexes, translations):
+            results[index] = translated_text
+
+    async def translate(self, text: str) -> dict[str, Optional[str]]:
+        """
+        Translate one text into every target language concurrently.
+
+        :param text: The text to translate
+        :return: The translation per target language, None where it failed
+        """
+        results = await self.translate_batch([text])
+        return {lang: translations[0] for lang, translations in results.items()}
+
+    async def translate_batch(self, texts: list[str]) -> dict[str, list[Optional[str]]]:
+        """
+        Translate many texts into every target language, packing them into as few requests as the API limits
+        allow. All requests for all languages run concurrently within the rate budget.
+
+        Cached texts are not sent, and repeated texts within the batch are sent once per language.
+
+        :param texts: The texts to translate
+        :return: Per target language, the translations aligned with texts (None where they failed,
+                 with the reason in self.last_errors[lang])
+        """
+        results = {}
+        groups = {}
+        empty = {index: "No text provided" for index, text in enumerate(texts) if not text}
+        self.last_errors = {lang: dict(empty) for lang in self.target_langs}
+
+        requests = []
+        for lang in self.target_langs:
+            results[lang], saved_cost, groups[lang] = _plan_batch(texts, self.cache, self.source_lang, lang)
+            self.saved_cost += saved_cost
+            unique_indexes = [indexes[0] for indexes in groups[lang].values()]
+            requests.extend(self._translate_indexes(texts, indexes, lang, results[lang])
+                            for indexes in _pack_requests(texts, unique_indexes))
+
+        await asyncio.gather(*requests)
+
+        for lang in self.target_langs:
+            _finish_batch(texts, self.cache, self.source_lang, lang, groups[lang], results[lang], self.last_errors[lang])
+
+        return results
+
+    def print_total_costs(self):
+        """
+        Print the total characters translated and the total accumulated cost, per language and overall.
+        """
+        for lang, cost in self.cost_by_language.items():
+            print(f"{self.source_lang} -> {lang}: ${cost:.6f}")
+        print(f"Total characters translated: {self.total_characters}")
+        print(f"Total accumulated cost: ${self.total_cost:.6f}")
+        if self.cache:
+            print(f"Saved by the translation cache: ${self.saved_cost:.6f} ({self.cache.hit_rate:.1%} hit rate)")
+
 # Example usage
 if __name__ == "__main__":
     try:
@@ -0,0 +1,289 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+import pandas as pd
+from pydantic import BaseModel
+
+from openai_client import LIVE_PRIORITY, AsyncOpenAIClient
+from translation_cache import TranslationCache
+
+MAX_CONCURRENT_BATCHES = 16
+
+# Batches are filled up to this many message tokens, and never hold more than MAX_ITEMS_PER_BATCH messages
+BATCH_TOKEN_BUDGET = 1500
+MAX_ITEMS_PER_BATCH = 25
+
+# Items missing from a response are sent again, up to this many times in total
+MAX_ATTEMPTS = 3
+
+# Hebrew and English output per input token, plus the JSON structure around each item
+COMPLETION_TOKENS_PER_INPUT_TOKEN = 3
+COMPLETION_TOKENS_PER_ITEM = 30
+MAX_COMPLETION_TOKENS = 16_000
+
+# Source and target of the translations in the TranslationCache
+SOURCE_LANG = 'ar'
+TARGET_LANGS = ('he', 'en')
+
+SYSTEM_MESSAGE = """
+Act as a highly accurate translator. Your task is to take a batch of Arabic messages from a Telegram group and translate each into both
+Hebrew and English. Each message is numbered, starting from 1.
+
+Ensure that for each message:
+- All emojis and decorative symbols are removed before translation.
+- Translations are precise and maintain the original meaning, tone, and nuance.
+- Military, organizational, or specific terminology is translated consistently.
+- Clarity and natural phrasing are prioritized in both Hebrew and English.
+- Punctuation and formatting are retained accurately.
+- Urgency and emotional tone are maintained naturally and fluently.
+
+Respond with one translation per message, each with the number of the message it translates.
+"""
+
+class TranslationResponse(BaseModel):
+    """Response model for individual translations."""
+    hebrew: str
+    english: str
+
+class NumberedTranslation(BaseModel):
+    """Model associating a number with a translation."""
+    number: int  # Explicit field for the number
+    translation: TranslationResponse  # Translation details
+
+class BatchTranslationResponse(BaseModel):
+    """Response model for batch translations."""
+    translations: List[NumberedTranslation]
+
+class MessageTranslator:
+    """
+    Translates Arabic messages into Hebrew and English with numbered batches sent concurrently.
+
+    Batches are sized by a token budget; the client paces the requests to the account's RPM/TPM limits.
+    Every numbered item of a response is checked, and only missing or empty items are sent again.
+    """
+
+    def __init__(self, client: AsyncOpenAIClient, max_concurrent_batches: int = MAX_CONCURRENT_BATCHES,
+                 batch_token_budget: int = BATCH_TOKEN_BUDGET, max_items_per_batch: int = MAX_ITEMS_PER_BATCH,
+                 max_attempts: int = MAX_ATTEMPTS, cache: Optional[TranslationCache] = None,
+                 priority: int = LIVE_PRIORITY):
+        """
+        :param client: The async OpenAI client; its model, cost counters and rate limits are used
+        :param max_concurrent_batches: Maximum batches in flight at once
+        :param batch_token_budget: Message tokens per batch
+        :param max_items_per_batch: Maximum messages per batch
+        :param max_attempts: Times a message is sent before it is given up on
+        :param cache: Optional translation cache, shared with the other translation engines
+        :param priority: Queue priority of the requests in the client; use BACKFILL_PRIORITY for backfills
+        """
+        self.client = client
+        self.batch_token_budget = batch_token_budget
+        self.max_items_per_batch = max_items_per_batch
+        self.max_attempts = max_attempts
+        self.cache = cache
+        self.priority = priority
+        self.max_concurrent_batches = max_concurrent_batches
+
+        # Bound to the event loop it is used in, so it is created per loop (see _batch_semaphore)
+        self._semaphore = None
+        self._semaphore_loop = None
+
+        # Errors of the last translate_messages call, by input index
+        self.last_errors = {}
+
+        # Cost avoided thanks to cache hits
+        self.saved_cost = 0.0
+
+    def _batch_semaphore(self) -> asyncio.Semaphore:
+        """The semaphore limiting the batches in flight, for the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            # A new loop (e.g. another process_dataframe call) can't wait on the semaphore of the old one
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_batches)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    def _count_tokens(self, text: str) -> int:
+        cost_calculator = self.client.cost_calculator
+        return cost_calculator.token_counter.num_tokens_from_string(text, cost_calculator.encoding_model_name)
+
+    def _plan_batches(self, tokens: dict) -> list[list[int]]:
+        """
+        Group message indexes into batches under the token budget and item limit.
+        A message above the budget on its own gets a batch of its own.
+        """
+        batches = []
+        current = []
+        current_tokens = 0
+        for index, count in tokens.items():
+            if current and (current_tokens + count > self.batch_token_budget
+                            or len(current) >= self.max_items_per_batch):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(index)
+            current_tokens += count
+        if current:
+            batches.append(current)
+        return batches
+
+    async def translate_batch(self, messages: List[str]) -> BatchTranslationResponse:
+        """Translate one batch of messages in a single request, numbered from 1."""
+        response, _ = await self._request_batch(messages, sum(self._count_tokens(message) for message in messages))
+        if not isinstance(response, BatchTranslationResponse):
+            raise ValueError("Received an empty response from the API.")
+        return response
+
+    async def _request_batch(self, messages: List[str], message_tokens: int):
+        user_message = "\n".join([f"{i+1}. {msg}" for i, msg in enumerate(messages)])
+        max_completion_tokens = min(MAX_COMPLETION_TOKENS, message_tokens * COMPLETION_TOKENS_PER_INPUT_TOKEN
+                                    + COMPLETION_TOKENS_PER_ITEM * len(messages))
+
+        return await self.client.complete(
+            system_message=SYSTEM_MESSAGE,
+            user_message=user_message,
+            response_format=BatchTranslationResponse,
+            max_completion_tokens=max_completion_tokens,
+            priority=self.priority
+        )
+
+    async def _translate_indexes(self, messages: List[str], indexes: list[int], tokens: dict,
+                                 results: list) -> list[int]:
+        """
+        Translate the messages at indexes in one request and store what came back in results.
+
+        :return: The indexes that are still missing a translation
+        """
+        batch_tokens = sum(tokens[index] for index in indexes)
+        async with self._batch_semaphore():
+            response, cost = await self._request_batch([messages[index] for index in indexes], batch_tokens)
+
+        if not isinstance(response, BatchTranslationResponse):
+            for index in indexes:
+                self.last_errors[index] = "Request failed"
+            return indexes
+
+        for item in response.translations:
+            if not 1 <= item.number <= len(indexes):
+                continue
+            index = indexes[item.number - 1]
+            translation = item.translation
+            if results[index] is not None or not translation.hebrew.strip() or not translation.english.strip():
+                continue
+            results[index] = translation
+            self.last_errors.pop(index, None)
+
+            if self.cache:
+                # Each message is charged its share of the batch, split between the two languages
+                item_cost = cost * tokens[index] / batch_tokens / len(TARGET_LANGS) if batch_tokens else 0.0
+                for lang, text in zip(TARGET_LANGS, (translation.hebrew, translation.english)):
+                    self.cache.put(messages[index], SOURCE_LANG, lang, self.client.model, text, item_cost)
+
+        missing = [index for index in indexes if results[index] is None]
+        for index in missing:
+            self.last_errors[index] = "Missing from the response"
+        return missing
+
+    def _from_cache(self, message: str) -> Optional[TranslationResponse]:
+        cached = [self.cache.get(message, SOURCE_LANG, lang, self.client.model) for lang in TARGET_LANGS]
+        if any(entry is None for entry in cached):
+            return None
+        self.saved_cost += sum(entry.cost for entry in cached)
+        hebrew, english = (entry.translation for entry in cached)
+        return TranslationResponse(hebrew=hebrew, english=english)
+
+    async def translate_messages(self, messages: List[str]) -> List[Optional[TranslationResponse]]:
+        """
+        Translate any number of messages, sending their batches concurrently.
+
+        Cached messages are not sent, and repeated messages are sent once.
+
+        :param messages: The Arabic messages
+        :return: The translations aligned with messages; None where a message is empty or still failed
+                 after max_attempts, with the reason in self.last_errors
+        """
+        results = [None] * len(messages)
+        self.last_errors = {index: "No text provided" for index, message in enumerate(messages) if not message}
+
+        # First index of each distinct message still to translate
+        first_index = {}
+        for index, message in enumerate(messages):
+            if not message or message in first_index:
+                continue
+            if self.cache:
+                results[index] = self._from_cache(message)
+                if results[index] is not None:
+                    continue
+            first_index[message] = index
+
+        pending = list(first_index.values())
+        tokens = {index: self._count_tokens(messages[index]) for index in pending}
+        for attempt in range(1, self.max_attempts + 1):
+            if not pending:
+                break
+            if attempt > 1:
+                logging.info(f"Retrying {len(pending)} messages missing from their responses (attempt {attempt})")
+
+            batches = self._plan_batches({index: tokens[index] for index in pending})
+            missing = await asyncio.gather(*(self._translate_indexes(messages, batch, tokens, results)
+                                             for batch in batches))
+            pending = [index for batch_missing in missing for index in batch_missing]
+
+        # Repeated messages share the translation of their first occurrence
+        for index, message in enumerate(messages):
+            if message and results[index] is None and message in first_index:
+                first = first_index[message]
+                results[index] = results[first]
+                if first in self.last_errors:
+                    self.last_errors[index] = self.last_errors[first]
+
+        if self.last_errors:
+            logging.warning(f"{len(self.last_errors)} of {len(messages)} messages could not be translated.")
+        return results
+
+class DataFrameProcessor:
+    def __init__(self, translator: MessageTranslator, batch_size: Optional[int] = None):
+        """
+        Initialize with a translator.
+
+        :param translator: The translator to use
+        :param batch_size: Optional cap on the messages per batch; batches are otherwise sized by tokens
+        """
+        self.translator = translator
+        if batch_size:
+            self.translator.max_items_per_batch = batch_size
+
+    async def process_dataframe_async(self, df: pd.DataFrame, column_name: str) -> pd.DataFrame:
+        """
+        Translate a DataFrame column and add 'hebrew_translation' and 'english_translation' columns.
+        Use this one from notebooks, where an event loop is already running.
+        """
+        messages = df[column_name].fillna('').astype(str).tolist()
+        translations = await self.translator.translate_messages(messages)
+
+        df['hebrew_translation'] = [translation.hebrew if translation else "" for translation in translations]
+        df['english_translation'] = [translation.english if translation else "" for translation in translations]
+        return df
+
+    def process_dataframe(self, df: pd.DataFrame, column_name: str) -> pd.DataFrame:
+        """Same as process_dataframe_async(), for scripts without a running event loop."""
+        return asyncio.run(self.process_dataframe_async(df, column_name))
+
+# Usage example
+if __name__ == "__main__":
+    import json
+
+    with open("telegram_messages.json", "r", encoding="utf-8") as f:
+        messages_df = pd.DataFrame(json.load(f))
+
+    openai_client = AsyncOpenAIClient(model="gpt-4o-mini-2024-07-18")
+    translator = MessageTranslator(openai_client, cache=TranslationCache())
+    processor = DataFrameProcessor(translator)
+
+    messages_df = processor.process_dataframe(messages_df, 'message')
+
+    # Print the total costs of OpenAI calls
+    openai_client.print_total_costs()
+    print(f"Saved by the translation cache: ${translator.saved_cost:.6f}")
+
+    print(messages_df[['message', 'hebrew_translation', 'english_translation']].head(5))
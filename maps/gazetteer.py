@@ -0,0 +1,384 @@
+import os
+import re
+import sys
+import json
+import time
+import unicodedata
+from dataclasses import dataclass, field, asdict
+from typing import Optional
+from geocode_cache import POSITIVE_TTL_SECONDS, normalize_place
+
+# Default location of the gazetteer built by this module
+GAZETTEER_FILE = 'gazetteer.json'
+
+# Same region as GeoDataFilter.israel_bounds: places outside it are not loaded
+DEFAULT_BOUNDS = {"min_lat": 29.3, "max_lat": 33.5, "min_lon": 34.0, "max_lon": 36.0}
+
+# GeoNames feature classes loaded: administrative divisions, populated places and areas
+FEATURE_CLASSES = ('A', 'P', 'L')
+
+# Places of the same name closer than this (in degrees, about 5 km) are merged into one
+MERGE_DISTANCE_DEGREES = 0.05
+
+# Words naming the kind of place around a name ("مدينة الخليل", "the city of Hebron"), in normalized form
+PLACE_TYPE_WORDS = {
+    'مدينه', 'بلده', 'قريه', 'محافظه', 'منطقه', 'ضاحيه',
+    'עיר', 'העיר', 'כפר', 'הכפר', 'יישוב', 'היישוב',
+    'city', 'town', 'village', 'of', 'the'
+}
+
+# Arabic conjunctions and prepositions written attached to the next word ("بالخليل", "وجنين")
+_PROCLITICS = ('و', 'ب', 'ل', 'ف', 'ك')
+
+# Importance given to gazetteer matches in pipeline results: the name matched a known place
+GAZETTEER_IMPORTANCE = 1.0
+
+# Places learned from the pipeline's results expire like the geocoding answers they came from,
+# so a wrong geocode isn't served offline for good
+LEARNED_TTL_SECONDS = POSITIVE_TTL_SECONDS
+
+_SEPARATORS = re.compile(r'[\-\u2010-\u2015_.,;:()/]')
+_MARKS = re.compile(r'[\'"`\u2018\u2019\u05F3\u05F4]')  # Apostrophes and quotes, incl. Hebrew geresh and gershayim
+_LETTER_VARIANTS = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+                                  'ى': 'ي', 'ة': 'ه'})
+
+def normalize_name(name: str) -> str:
+    """
+    Normalize a place name for the index: normalize_place, after dropping apostrophes and punctuation,
+    then unify the Arabic alef, yeh and teh marbuta spellings.
+    """
+    name = _SEPARATORS.sub(' ', _MARKS.sub('', name))
+    return normalize_place(name).translate(_LETTER_VARIANTS)
+
+def name_language(name: str) -> Optional[str]:
+    """
+    Guess the language of a place name from its script: 'ar', 'he' or 'en'; None for other scripts.
+    """
+    for char in name:
+        if '\u0600' <= char <= '\u06ff':
+            return 'ar'
+        if '\u0590' <= char <= '\u05ff':
+            return 'he'
+        if char.isalpha():
+            return 'en' if unicodedata.name(char, '').startswith('LATIN') else None
+    return None
+
+def aliases_by_language(wikidata_aliases) -> dict:
+    """
+    Read aliases by language from either shape of wikidata_aliases: lists of aliases (as in compiled_maps.json),
+    or the labels and aliases of GeocodeDataExtractor.fetch_wikidata_aliases.
+    """
+    aliases = {}
+    for lang, value in (wikidata_aliases or {}).items():
+        if isinstance(value, dict):
+            names = ([value['label']] if value.get('label') else []) + list(value.get('aliases') or [])
+        else:
+            names = list(value or [])
+        if names:
+            aliases[lang] = names
+    return aliases
+
+@dataclass(slots=True)
+class GazetteerPlace:
+    name: str
+    lat: float
+    lon: float
+    aliases: dict = field(default_factory=dict)  # Language -> alternative names, as in wikidata_aliases
+    wikidata: Optional[str] = None
+    population: int = 0
+    source: str = 'geonames'
+    expires_at: Optional[float] = None  # Epoch time a learned place is dropped at; None for places that don't expire
+
+    def names(self) -> list[str]:
+        return [self.name] + [alias for aliases in self.aliases.values() for alias in aliases]
+
+    def to_result(self) -> dict:
+        """
+        Return the place in the shape of GeoDataFilter.get_coordinates_with_names.
+        """
+        return {
+            "service": "Gazetteer",
+            "name": self.name,
+            "lat": self.lat,
+            "lon": self.lon,
+            "wikidata_aliases": self.aliases,
+            "importance": GAZETTEER_IMPORTANCE
+        }
+
+class Gazetteer:
+    """
+    Offline index of the places of a region, by their Arabic, Hebrew and English names and aliases.
+
+    Names are looked up in a hash index of their normalized form. A trie over the words of the names
+    finds known names inside longer strings, so "مدينة الخليل" or "بالخليل" resolve like "الخليل".
+    """
+
+    def __init__(self, bounds: dict = DEFAULT_BOUNDS):
+        """
+        :param bounds: Places outside these bounds are not added
+        """
+        self.bounds = bounds
+        self.places = []
+        self._index = {}  # Normalized name -> place positions, most populated first
+        self._trie = {}  # Word -> child node; the None key holds the place positions of the name ending there
+        self._wikidata = {}  # Wikidata id -> place position
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.places)
+
+    def in_bounds(self, lat, lon) -> bool:
+        return (lat is not None and lon is not None and
+                self.bounds["min_lat"] <= lat <= self.bounds["max_lat"] and
+                self.bounds["min_lon"] <= lon <= self.bounds["max_lon"])
+
+    def _is_expired(self, position: int) -> bool:
+        expires_at = self.places[position].expires_at
+        return expires_at is not None and expires_at < time.time()
+
+    def _same_place(self, place: GazetteerPlace) -> Optional[int]:
+        """
+        Position of the known place with the same Wikidata id, or of the same name nearby. Learned places are
+        only merged with learned places, so their names never outlive them in a place that doesn't expire.
+        """
+        learned = place.expires_at is not None
+        if place.wikidata and place.wikidata in self._wikidata and not learned:
+            return self._wikidata[place.wikidata]
+        for position in self._index.get(normalize_name(place.name), []):
+            known = self.places[position]
+            if (abs(known.lat - place.lat) < MERGE_DISTANCE_DEGREES and abs(known.lon - place.lon) < MERGE_DISTANCE_DEGREES
+                    and not (known.wikidata and place.wikidata) and (known.expires_at is not None) == learned):
+                return position
+        return None
+
+    def add(self, place: GazetteerPlace) -> bool:
+        """
+        Add a place, or merge its names into the known place it is the same as.
+
+        :return: False if the place is outside the bounds or has expired
+        """
+        if not self.in_bounds(place.lat, place.lon):
+            return False
+        if place.expires_at is not None and place.expires_at < time.time():
+            return False
+
+        position = self._same_place(place)
+        if position is None:
+            position = len(self.places)
+            self.places.append(GazetteerPlace(place.name, place.lat, place.lon, {}, source=place.source,
+                                              expires_at=place.expires_at))
+
+        known = self.places[position]
+        known_names = set(known.names())
+        for lang, aliases in place.aliases.items():
+            for alias in aliases:
+                if alias not in known_names:
+                    known.aliases.setdefault(lang, []).append(alias)
+                    known_names.add(alias)
+        if place.name not in known_names:
+            known.aliases.setdefault(name_language(place.name) or 'en', []).append(place.name)
+        known.wikidata = known.wikidata or place.wikidata
+        known.population = max(known.population, place.population)
+        if known.expires_at is not None:
+            known.expires_at = max(known.expires_at, place.expires_at)  # Learned again: keep it longer
+
+        if self.places[position].wikidata and known.expires_at is None:
+            self._wikidata[self.places[position].wikidata] = position
+        for name in self.places[position].names():
+            self._index_name(normalize_name(name), position)
+        return True
+
+    def _index_name(self, key: str, position: int) -> None:
+        if not key:
+            return
+        positions = self._index.get(key)
+        if positions is None:
+            positions = self._index[key] = []
+            node = self._trie
+            for word in key.split(' '):
+                node = node.setdefault(word, {})
+            node[None] = positions  # The same list as in the index
+        if position not in positions:
+            positions.append(position)
+        positions.sort(key=lambda index: -self.places[index].population)
+
+    def add_geonames(self, path: str, feature_classes: tuple = FEATURE_CLASSES) -> int:
+        """
+        Add the places of a GeoNames dump (tab-separated, e.g. IL.txt or PS.txt), with their alternate
+        names in Arabic, Hebrew and Latin script.
+
+        :return: The number of places added or merged into known ones
+        """
+        added = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                columns = line.rstrip('\n').split('\t')
+                if len(columns) < 15 or columns[6] not in feature_classes:
+                    continue
+                name = columns[1]
+                aliases = {}
+                for alias in sorted({columns[2], *columns[3].split(',')}):
+                    lang = name_language(alias)
+                    if alias and alias != name and lang:
+                        aliases.setdefault(lang, []).append(alias)
+                place = GazetteerPlace(name, float(columns[4]), float(columns[5]), aliases,
+                                       population=int(columns[14] or 0))
+                added += self.add(place)
+        return added
+
+    def add_extracted(self, data: dict) -> int:
+        """
+        Add the places of GeocodeDataExtractor.extract_all_data output, e.g. json_maps/compiled_maps.json,
+        with the Wikidata aliases of the OpenCage results.
+
+        :return: The number of places added or merged into known ones
+        """
+        added = 0
+        for result in data.get("OpenCage", []):
+            components = result.get("components") or {}
+            name = components.get("city") or components.get("_normalized_city") or components.get("state")
+            if name and result.get("lat") is not None:
+                added += self.add(GazetteerPlace(name, float(result["lat"]), float(result["lon"]),
+                                                 aliases_by_language(result.get("wikidata_aliases")),
+                                                 wikidata=result.get("wikidata"), source='opencage'))
+        for service in ("Nominatim", "LocationIQ"):
+            for result in data.get(service, []):
+                name = result.get("name") or (result.get("display_name") or '').split(',')[0].strip()
+                if name and result.get("lat") is not None:
+                    added += self.add(GazetteerPlace(name, float(result["lat"]), float(result["lon"]),
+                                                     source=service.lower()))
+        return added
+
+    def add_result(self, result: dict, ner_word: Optional[str] = None, ttl_seconds: float = LEARNED_TTL_SECONDS) -> bool:
+        """
+        Add a place the pipeline resolved (GeoDataFilter.get_coordinates_with_names), under the name NER found too,
+        so it resolves offline for the next ttl_seconds. Learned places are kept apart from the places of
+        GeoNames and extracted results, and dropped once they expire.
+        """
+        if result.get("lat") is None or result.get("service") == "Gazetteer":
+            return False
+        aliases = aliases_by_language(result.get("wikidata_aliases"))
+        if ner_word and ner_word != result.get("name"):
+            aliases.setdefault(name_language(ner_word) or 'en', []).append(ner_word)
+        return self.add(GazetteerPlace(result["name"], result["lat"], result["lon"], aliases, source='pipeline',
+                                       expires_at=time.time() + ttl_seconds))
+
+    def lookup(self, name: str) -> Optional[GazetteerPlace]:
+        """
+        Find the place a name refers to: by its normalized form, else by the one known name it contains
+        when its other words only say what kind of place it is.
+
+        :param name: A place name, e.g. a location found by NER.
+        :return: The most populated place of that name, or None.
+        """
+        key = normalize_name(name)
+        positions = self._index.get(key)
+        if positions is None:
+            matches = self.find(key)
+            if len(matches) == 1:
+                start, end, name_key = matches[0]
+                words = key.split(' ')
+                if all(word in PLACE_TYPE_WORDS for word in words[:start] + words[end:]):
+                    positions = self._index[name_key]
+
+        positions = [position for position in positions or [] if not self._is_expired(position)]
+        if not positions:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.places[positions[0]]
+
+    def find(self, text: str) -> list[tuple]:
+        """
+        Find the longest known names in a text, word by word.
+
+        :param text: Any text, e.g. a message.
+        :return: (start word, end word, normalized name) of each name found, in order.
+        """
+        words = normalize_name(text).split(' ')
+        matches = []
+        start = 0
+        while start < len(words):
+            match = self._longest_match(words, start)
+            if match:
+                end, name_key = match
+                matches.append((start, end, name_key))
+                start = end
+            else:
+                start += 1
+        return matches
+
+    def _longest_match(self, words: list[str], start: int) -> Optional[tuple]:
+        longest = None
+        for first in _word_variants(words[start]):
+            node = self._trie.get(first)
+            matched = [first]
+            end = start + 1
+            while node is not None:
+                if None in node and (longest is None or end > longest[0]):
+                    longest = (end, ' '.join(matched))
+                if end == len(words):
+                    break
+                node = node.get(words[end])
+                matched.append(words[end])
+                end += 1
+        return longest
+
+    def save(self, path: str = GAZETTEER_FILE) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"bounds": self.bounds, "places": [asdict(place) for position, place in enumerate(self.places)
+                                                         if not self._is_expired(position)]},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def print_stats(self):
+        """
+        Print how many lookups the gazetteer answered.
+        """
+        print(f"Gazetteer: {len(self.places)} places, {self.hits} hits, {self.misses} misses "
+              f"({self.hit_rate:.1%} hit rate)")
+
+def _word_variants(word: str) -> list[str]:
+    """The word, and the word without an attached Arabic conjunction or preposition."""
+    variants = [word]
+    if word.startswith('لل') and len(word) > 4:
+        variants.append('ا' + word[1:])  # ل + ال: "للخليل" -> "الخليل"
+    elif word.startswith(_PROCLITICS) and len(word) > 3:
+        variants.append(word[1:])
+    return variants
+
+def load_gazetteer(path: str = GAZETTEER_FILE) -> Gazetteer:
+    """
+    Load a gazetteer saved by Gazetteer.save; an empty one if the file doesn't exist yet.
+    """
+    if not os.path.exists(path):
+        return Gazetteer()
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    gazetteer = Gazetteer(data["bounds"])
+    for place in data["places"]:
+        gazetteer.add(GazetteerPlace(**place))
+    return gazetteer
+
+# Build the gazetteer from GeoNames dumps (e.g. IL.txt and PS.txt of https://download.geonames.org/export/dump/)
+# and extracted geocoding results:
+#     python gazetteer.py IL.txt PS.txt json_maps/compiled_maps.json
+if __name__ == "__main__":
+    gazetteer = Gazetteer()
+    for path in sys.argv[1:]:
+        if path.endswith('.json'):
+            with open(path, 'r', encoding='utf-8') as f:
+                added = gazetteer.add_extracted(json.load(f))
+        else:
+            added = gazetteer.add_geonames(path)
+        print(f"{path}: {added} places")
+    gazetteer.save()
+    print(f"Saved {len(gazetteer)} places to {GAZETTEER_FILE}")
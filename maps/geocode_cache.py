@@ -0,0 +1,176 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+# Default location of the cache database
+GEOCODE_CACHE_DB = os.path.join(os.getcwd(), 'geocode_cache.db')
+
+MAX_MEMORY_ITEMS = 10_000
+
+# How long a provider's answer is served: places rarely move, but a place a provider didn't know may be added
+POSITIVE_TTL_SECONDS = 30 * 24 * 3600
+NEGATIVE_TTL_SECONDS = 24 * 3600
+
+# After its TTL, an entry is still served for this long while it is refreshed in the background
+STALE_SECONDS = 7 * 24 * 3600
+
+# Disk cleanup runs once every this many writes
+EVICT_EVERY_PUTS = 1000
+
+_WHITESPACE = re.compile(r'\s+')
+
+# Arabic diacritics and tatweel, and Hebrew points, which NER output has or lacks inconsistently
+_DIACRITICS = re.compile(r'[\u0591-\u05C7\u0610-\u061A\u0640\u064B-\u065F\u0670]')
+
+def normalize_place(place: str) -> str:
+    """
+    Normalize a place name for cache lookups: drop diacritics, fold case and collapse whitespace.
+    """
+    place = unicodedata.normalize('NFC', place)
+    place = _DIACRITICS.sub('', place).casefold()
+    return _WHITESPACE.sub(' ', place).strip()
+
+class CachedGeocode(NamedTuple):
+    response: object  # The provider's response, as returned by MultiGeocoder
+    found: bool  # False for a cached "no such place"
+    stale: bool  # Past its TTL: serve it, but refresh it
+
+class GeocodeCache:
+    """
+    Cache of geocoding responses, keyed on (provider, normalized place name), so each provider is cached
+    separately and a failed provider is simply asked again next time.
+
+    A SQLite file keeps entries across runs, with an in-memory LRU in front of it. Places that were found and
+    places a provider didn't know have their own TTLs, and expired entries stay servable as stale for
+    stale_seconds, so the caller can answer at once and refresh in the background. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = GEOCODE_CACHE_DB, max_memory_items: int = MAX_MEMORY_ITEMS,
+                 positive_ttl_seconds: float = POSITIVE_TTL_SECONDS, negative_ttl_seconds: float = NEGATIVE_TTL_SECONDS,
+                 stale_seconds: float = STALE_SECONDS):
+        """
+        :param path: The SQLite database file.
+        :param max_memory_items: Size of the in-memory LRU.
+        :param positive_ttl_seconds: Age after which a found place is refreshed.
+        :param negative_ttl_seconds: Age after which a place the provider didn't find is asked again.
+        :param stale_seconds: How long past its TTL an entry is still served while being refreshed.
+        """
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self.positive_ttl_seconds = positive_ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.stale_seconds = stale_seconds
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # (provider, place) -> (response, found, created_at)
+        self._puts = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS geocodes (
+                provider TEXT NOT NULL,
+                place TEXT NOT NULL,
+                response TEXT NOT NULL,
+                found INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (provider, place)
+            )
+        """)
+        self._conn.commit()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def _ttl(self, found: bool) -> float:
+        return self.positive_ttl_seconds if found else self.negative_ttl_seconds
+
+    def _remember(self, key: tuple, response, found: bool, created_at: float) -> None:
+        self._memory[key] = (response, found, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, place: str, provider: str) -> Optional[CachedGeocode]:
+        """
+        Look up a provider's response for a place; None when it isn't cached or is too old even to serve stale.
+        """
+        key = (provider, normalize_place(place))
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                self._memory.move_to_end(key)
+            else:
+                row = self._conn.execute(
+                    "SELECT response, found, created_at FROM geocodes WHERE provider = ? AND place = ?", key
+                ).fetchone()
+                if row is not None:
+                    cached = (json.loads(row[0]), bool(row[1]), row[2])
+                    self._remember(key, *cached)
+
+            if cached is None:
+                self.misses += 1
+                return None
+
+            response, found, created_at = cached
+            age = time.time() - created_at
+            ttl = self._ttl(found)
+            if age > ttl + self.stale_seconds:
+                self._memory.pop(key, None)
+                self.misses += 1
+                return None
+
+            stale = age > ttl
+            if stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return CachedGeocode(response, found, stale)
+
+    def put(self, place: str, provider: str, response, found: bool) -> None:
+        """
+        Store a provider's answer for a place. Only store real answers, found or not, never request failures.
+        """
+        key = (provider, normalize_place(place))
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, found, now)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocodes (provider, place, response, found, created_at) VALUES (?, ?, ?, ?, ?)",
+                (*key, json.dumps(response, ensure_ascii=False), int(found), now)
+            )
+            self._conn.commit()
+
+            self._puts += 1
+            if self._puts % EVICT_EVERY_PUTS == 0:
+                self._evict()
+
+    def _evict(self) -> None:
+        now = time.time()
+        self._conn.execute("DELETE FROM geocodes WHERE found = 1 AND created_at < ?",
+                           (now - self.positive_ttl_seconds - self.stale_seconds,))
+        self._conn.execute("DELETE FROM geocodes WHERE found = 0 AND created_at < ?",
+                           (now - self.negative_ttl_seconds - self.stale_seconds,))
+        self._conn.commit()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.stale_hits + self.misses
+        return (self.hits + self.stale_hits) / lookups if lookups else 0.0
+
+    def print_stats(self):
+        """
+        Print the hit rate of the cache.
+        """
+        print(f"Geocode cache: {self.hits} hits, {self.stale_hits} stale hits, {self.misses} misses "
+              f"({self.hit_rate:.1%} hit rate)")
+
+    def close(self) -> None:
+        self._conn.close()
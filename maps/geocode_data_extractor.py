@@ -4,14 +4,24 @@ import logging
 import aiohttp
 import asyncio
 from timer_meta import TimerMeta
+from pipeline_context import session_or_new
+from wikidata_client import WikidataAliasFetcher, entity_aliases
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class GeocodeDataExtractor(metaclass=TimerMeta):
-    def __init__(self, data):
+    def __init__(self, data, session: aiohttp.ClientSession = None, wikidata: WikidataAliasFetcher = None):
+        """
+        :param data: The combined results of MultiGeocoder.get_all_coordinates
+        :param session: Shared session of a PipelineContext; without one, each Wikidata request opens its own session
+        :param wikidata: Shared fetcher batching and caching the Wikidata requests; without one, each id is
+                         requested on its own
+        """
         self.data = data
+        self.session = session
+        self.wikidata = wikidata
 
     async def fetch_wikidata_aliases(self, wikidata_id):
         """
@@ -19,6 +29,8 @@ class GeocodeDataExtractor(metaclass=TimerMeta):
         """
         if not wikidata_id:
             return None
+        if self.wikidata is not None:
+            return await self.wikidata.get(wikidata_id)
 
         url = (
             f"https://www.wikidata.org/w/api.php?"
@@ -26,25 +38,11 @@ class GeocodeDataExtractor(metaclass=TimerMeta):
             f"&props=labels|descriptions|aliases&languages=en|ar|he&format=json"
         )
         try:
-            async with aiohttp.ClientSession() as session:
+            async with session_or_new(self.session) as session:
                 async with session.get(url) as response:
                     response.raise_for_status()
                     result = await response.json()
-                    entity_data = result.get("entities", {}).get(wikidata_id, {})
-
-                    labels_data = entity_data.get("labels", {})
-                    descriptions_data = entity_data.get("descriptions", {})
-                    aliases_data = entity_data.get("aliases", {})
-
-                    data = {}
-                    for lang in ['en', 'ar', 'he']:
-                        data[lang] = {
-                            'label': labels_data.get(lang, {}).get('value'),
-                            'description': descriptions_data.get(lang, {}).get('value'),
-                            'aliases': [alias['value'] for alias in aliases_data.get(lang, [])]
-                        }
-
-                    return data
+                    return entity_aliases(result.get("entities", {}).get(wikidata_id, {}))
         except aiohttp.ClientError as e:
             logger.error(f"Error fetching data for Wikidata ID {wikidata_id}: {e}")
             return None
@@ -204,6 +202,7 @@ class GeocodeDataExtractor(metaclass=TimerMeta):
         return json.dumps(extracted_data, indent=4, ensure_ascii=False)
 
 # # Example usage
-# def run_geocode_extractor(data):
-#     extractor = GeocodeDataExtractor(data)
-#     return asyncio.run(extractor.extract_all_data())
+# async def run_geocode_extractor(data):
+#     async with PipelineContext() as context:
+#         extractor = GeocodeDataExtractor(data, session=context.session)
+#         return await extractor.extract_all_data()
@@ -4,9 +4,20 @@ import asyncio
 from geo_data_filter import GeoDataFilter
 from geocode_data_extractor import GeocodeDataExtractor
 from multi_geocoder import MultiGeocoder
+from pipeline_context import PipelineContext
+from geocode_cache import GeocodeCache
+from gazetteer import load_gazetteer
+from wikidata_client import WikidataAliasFetcher, wikidata_ids
 
 from arabic_ner_client_hf import ArabicNERClientHF
 
+# Stop asking the geocoding providers about a place once one of them found it confidently inside the region
+FIRST_GOOD_ANSWER = True
+
+# Add the places the providers resolved to the gazetteer, so they resolve offline until they expire
+# (gazetteer.LEARNED_TTL_SECONDS). Off by default: a wrong geocode would be served offline until then.
+LEARN_RESOLVED_PLACES = False
+
 sentence = """
     إسحق رابين، ولد في تل أبيب عام 1922، وكان رئيس وزراء دولة إسرائيل بين عامي 1974 و1977 ومرة ​​أخرى بين عامي 1992 و1995.
     درس في جامعة القدس وكان ضابطا كبيرا في جيش الدفاع الإسرائيلي، الذي قاد النصر الإسرائيلي في حرب الأيام الستة عام 1967.
@@ -21,19 +32,29 @@ response = client.get_locations_above_threshold(
 )
 print(f"Places mentioned in the message: {response}")
 
-# Initialize the geocoder
-geocoder = MultiGeocoder()
-
-# Processing function for a single place
-async def process_place(place):
+# Geocoding of a single place: its gazetteer result if it is known, else the providers' answers
+async def geocode_place(place, geocoder):
     print(f"\nProcessing place: {place}", flush=True)  # Debug: indicate current place being processed
 
-    # Get geocoding data for the place
-    all_results = await geocoder.get_all_coordinates(place)        
-    parsed_json_data = json.loads(all_results)
-    
+    # Known places resolve offline; the geocoding APIs are only asked about the others
+    known_place = gazetteer.lookup(place)
+    if known_place:
+        result = known_place.to_result()
+        result["ner_word"] = place
+        print(f"Resolved from the gazetteer: {result}", flush=True)
+        return result, None
+
+    # Get geocoding data for the place, from every provider or only until one is confident
+    if FIRST_GOOD_ANSWER:
+        all_results = await geocoder.get_first_good_coordinates(place)
+    else:
+        all_results = await geocoder.get_all_coordinates(place)
+    return None, json.loads(all_results)
+
+# Processing function for a single place
+async def process_place(place, parsed_json_data, wikidata, context):
     # Extract all relevant geocoding data
-    extractor = GeocodeDataExtractor(parsed_json_data)
+    extractor = GeocodeDataExtractor(parsed_json_data, session=context.session, wikidata=wikidata)
     all_data = await extractor.extract_all_data()
     all_data = json.loads(all_data)
     
@@ -45,6 +66,8 @@ async def process_place(place):
     if filtered_results:
         # Add the NER word (place) to the result dictionary
         filtered_results["ner_word"] = place  # Attach the NER word to each result
+        if LEARN_RESOLVED_PLACES:
+            gazetteer.add_result(filtered_results, place)  # Resolve it offline next time
         print(f"Appending filtered results with NER word: {filtered_results}", flush=True)
         return filtered_results
     else:
@@ -53,15 +76,41 @@ async def process_place(place):
 
 # Main function to process all places concurrently
 async def process_places_concurrently(response):
-    # Use asyncio.gather to run all tasks concurrently
-    tasks = [process_place(place) for place in response]
-    results = await asyncio.gather(*tasks)
+    # All places share one connection pool, so connections to each API host are reused rather than opened per request
+    async with PipelineContext() as context:
+        geocoder = MultiGeocoder(session=context.session, cache=geocode_cache)
+        wikidata = WikidataAliasFetcher(session=context.session, cache=geocode_cache)
+
+        # Geocode every place first, so the Wikidata ids of all their results are fetched together
+        geocoded = await asyncio.gather(*(geocode_place(place, geocoder) for place in response))
+        await wikidata.prefetch([wikidata_id for _, data in geocoded if data is not None for wikidata_id in wikidata_ids(data)])
+
+        # Use asyncio.gather to run all tasks concurrently
+        tasks = [process_place(place, data, wikidata, context) if data is not None else asyncio.sleep(0, known)
+                 for place, (known, data) in zip(response, geocoded)]
+        results = await asyncio.gather(*tasks)
+
+        # Let stale cache entries finish refreshing before the session closes
+        await geocoder.wait_for_refreshes()
+        await wikidata.wait_for_requests()
+        geocoder.print_stats()
+        wikidata.print_stats()
     
     # Filter out None results and return
     return [result for result in results if result]
 
+# Places recur across messages, so the providers' answers are kept between runs
+geocode_cache = GeocodeCache()
+
+# Offline index of the region's places, built with gazetteer.py (and extended with the places resolved here
+# with LEARN_RESOLVED_PLACES)
+gazetteer = load_gazetteer()
+
 # Example usage:
 filtered_results = asyncio.run(process_places_concurrently(response))
+geocode_cache.print_stats()
+gazetteer.print_stats()
+gazetteer.save()
 
 # Final check and output: Ensure proper printing of the full dictionaries
 if filtered_results:
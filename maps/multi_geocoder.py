@@ -4,9 +4,28 @@ import json
 import aiohttp
 import asyncio
 from timer_meta import TimerMeta
+from pipeline_context import session_or_new
+from geocode_cache import GeocodeCache, normalize_place
+from geo_data_filter import GeoDataFilter
+from provider_guard import create_guards
+
+# In first-good-answer mode, a result inside the region with at least this importance ends the lookup
+CONFIDENT_IMPORTANCE = 0.6
 
 class MultiGeocoder(metaclass=TimerMeta):
-    def __init__(self):
+    def __init__(self, session: aiohttp.ClientSession = None, cache: GeocodeCache = None):
+        """
+        :param session: Shared session of a PipelineContext; without one, each call opens its own session
+        :param cache: Optional cache of the providers' answers
+        """
+        self.session = session
+        self.cache = cache
+
+        # Requests in flight by (provider, normalized place), so concurrent lookups of a place share them
+        self._in_flight = {}
+        self._waiters = {}  # Lookups awaiting each request in flight
+        self._sent = set()  # Requests in flight past their rate limit, i.e. already sent to the provider
+
         # Load environment variables from .env file
         load_dotenv()
 
@@ -17,6 +36,18 @@ class MultiGeocoder(metaclass=TimerMeta):
         # No keys needed for Nominatim
         self.nominatim_url = 'https://nominatim.openstreetmap.org/search'
 
+        self.providers = {
+            'OpenCage': self.get_opencage_coordinates,
+            'Nominatim': self.get_nominatim_coordinates,
+            'LocationIQ': self.get_locationiq_coordinates
+        }
+
+        # Rate limit, timeout and circuit breaker of each provider
+        self.guards = create_guards(self.providers)
+
+        # Region and importance threshold of a confident answer
+        self._region = GeoDataFilter({}, importance_threshold=CONFIDENT_IMPORTANCE)
+
     async def get_opencage_coordinates(self, session, place):
         url = f'https://api.opencagedata.com/geocode/v1/json?q={place}&key={self.opencage_api_key}'
         print(f"Fetching OpenCage coordinates for: {place}")
@@ -60,14 +91,143 @@ class MultiGeocoder(metaclass=TimerMeta):
             print(f"LocationIQ response parsing error: {e}")
             return {'error': 'Failed to parse LocationIQ response'}
 
+    def is_found(self, provider, response):
+        """
+        Classify a provider's response: True if it found the place, False if it answered that there is
+        no such place, None if the request failed, in which case it must not be cached.
+        """
+        if provider == 'OpenCage':
+            if not isinstance(response, dict) or response.get('status', {}).get('code') != 200:
+                return None
+            return response.get('total_results', 0) > 0
+        if isinstance(response, list):
+            return bool(response)
+        # LocationIQ answers a place it doesn't know with an error
+        if provider == 'LocationIQ' and isinstance(response, dict) and response.get('error') == 'Unable to geocode':
+            return False
+        return None
+
+    def is_confident(self, provider, response):
+        """
+        Whether a provider's response has a result inside the region with at least CONFIDENT_IMPORTANCE.
+        """
+        if provider == 'OpenCage':
+            results = response.get('results', []) if isinstance(response, dict) else []
+            candidates = [(result.get('geometry', {}).get('lat'), result.get('geometry', {}).get('lng'),
+                           (result.get('confidence') or 0) / 10) for result in results]
+        else:
+            results = response if isinstance(response, list) else []
+            candidates = [(result.get('lat'), result.get('lon'), result.get('importance') or 0) for result in results]
+
+        for lat, lon, importance in candidates:
+            try:
+                lat, lon, importance = float(lat), float(lon), float(importance)
+            except (TypeError, ValueError):
+                continue
+            if self._region.is_within_israel(lat, lon) and importance >= self._region.importance_threshold:
+                return True
+        return False
+
+    async def _call_provider(self, provider, session, place, key=None):
+        """
+        Send one request to a provider, within its rate limit, timeout and circuit breaker.
+        Without a session, the request opens its own. A key of _in_flight is marked as sent once the
+        rate limit let the request through.
+        """
+        guard = self.guards[provider]
+        if not guard.breaker.allow():
+            guard.skipped += 1
+            return {'error': f'{provider} is skipped after repeated failures'}
+
+        await guard.bucket.acquire()
+        if key is not None:
+            self._sent.add(key)
+        guard.requests += 1
+        try:
+            async with session_or_new(session or self.session) as session:
+                response = await asyncio.wait_for(self.providers[provider](session, place), guard.timeout)
+        except asyncio.TimeoutError:
+            guard.timeouts += 1
+            print(f"{provider} timed out after {guard.timeout}s for: {place}")
+            response = {'error': f'{provider} timed out'}
+
+        if self.is_found(provider, response) is None:
+            guard.breaker.record_failure()
+            if guard.breaker.is_open:
+                print(f"{provider} failed {guard.breaker.failures} times in a row, skipping it for {guard.breaker.reset_seconds}s")
+        else:
+            guard.breaker.record_success()
+        return response
+
+    async def _fetch(self, provider, place, session=None, key=None):
+        """
+        Ask one provider, and cache its answer unless the request failed.
+        """
+        response = await self._call_provider(provider, session, place, key)
+        if self.cache is not None:
+            found = self.is_found(provider, response)
+            if found is not None:
+                self.cache.put(place, provider, response, found)
+        return response
+
+    def _start_fetch(self, provider, place, session=None):
+        key = (provider, normalize_place(place))
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(self._fetch(provider, place, session, key))
+            task.add_done_callback(lambda _: self._forget_fetch(key))
+        return task
+
+    def _forget_fetch(self, key):
+        self._in_flight.pop(key, None)
+        self._waiters.pop(key, None)
+        self._sent.discard(key)
+
+    async def _await_fetch(self, provider, place, session=None):
+        """
+        Wait for the shared request of a place. When the last lookup waiting for it is cancelled, the request
+        is cancelled too if it is still waiting for its rate limit; once sent, it finishes and fills the cache.
+        """
+        task = self._start_fetch(provider, place, session)
+        key = (provider, normalize_place(place))
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if key not in self._sent and self._waiters.get(key) == 1:
+                task.cancel()
+            raise
+        finally:
+            if key in self._waiters:
+                self._waiters[key] -= 1
+
+    async def get_coordinates(self, session, provider, place):
+        """
+        Get one provider's response for a place, from the cache when it has it.
+        A stale cache entry is returned at once and refreshed in the background.
+        """
+        if self.cache is None:
+            return await self._call_provider(provider, session, place)
+
+        cached = self.cache.get(place, provider)
+        if cached is not None:
+            if cached.stale:
+                # Not tied to this call's session, which may close before the refresh is done
+                self._start_fetch(provider, place)
+            return cached.response
+        return await self._await_fetch(provider, place, session)
+
+    async def wait_for_refreshes(self):
+        """
+        Wait for the background refreshes of stale cache entries; call it before closing the shared session.
+        """
+        while self._in_flight:
+            await asyncio.gather(*list(self._in_flight.values()), return_exceptions=True)
+
     async def get_all_coordinates(self, place):
-        async with aiohttp.ClientSession() as session:
+        async with session_or_new(self.session) as session:
             # Create tasks for fetching coordinates concurrently
-            tasks = [
-                self.get_opencage_coordinates(session, place),
-                self.get_nominatim_coordinates(session, place),
-                self.get_locationiq_coordinates(session, place)
-            ]
+            tasks = [self.get_coordinates(session, provider, place) for provider in self.providers]
             
             # Run the tasks concurrently and gather results
             opencage_result, nominatim_result, locationiq_result = await asyncio.gather(*tasks)
@@ -80,8 +240,45 @@ class MultiGeocoder(metaclass=TimerMeta):
             }
             
             return json.dumps(result, indent=4)
+
+    async def get_first_good_coordinates(self, place):
+        """
+        Ask the providers concurrently, but return as soon as one has a confident answer inside the region
+        (see is_confident), or once all of them answered. The providers still pending are left out of the result:
+        their requests are cancelled, except, with a cache, those already sent, which finish in the background
+        and fill it.
+        Requests use the shared session, or open their own, so none depends on a session closed on return.
+        """
+        tasks = {asyncio.ensure_future(self.get_coordinates(self.session, provider, place)): provider
+                 for provider in self.providers}
+        result = {}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result[tasks[task]] = task.result()
+                if any(self.is_confident(provider, response) for provider, response in result.items()):
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        # Keep the providers' order, as in get_all_coordinates
+        return json.dumps({provider: result[provider] for provider in self.providers if provider in result}, indent=4)
+
+    def print_stats(self):
+        """
+        Print the requests sent to each provider, and those that timed out or were skipped.
+        """
+        for provider, guard in self.guards.items():
+            state = "open" if guard.breaker.is_open else "closed"
+            print(f"{provider}: {guard.requests} requests, {guard.timeouts} timeouts, {guard.skipped} skipped "
+                  f"(circuit {state})")
         
 # # Example usage: Wrapping the async function to be run synchronously
-# def run_geocoder(place):
-#     geocoder = MultiGeocoder()
-#     return asyncio.run(geocoder.get_all_coordinates(place))
\ No newline at end of file
+# async def run_geocoder(places):
+#     async with PipelineContext() as context:
+#         geocoder = MultiGeocoder(session=context.session)
+#         return await asyncio.gather(*(geocoder.get_all_coordinates(place) for place in places))
\ No newline at end of file
@@ -0,0 +1,58 @@
+from contextlib import asynccontextmanager
+import aiohttp
+
+# Connection pool of the geocoding pipeline: total connections, and connections to any single API host
+MAX_CONNECTIONS = 100
+MAX_CONNECTIONS_PER_HOST = 10
+
+# Seconds a resolved host name, and an idle keep-alive connection, are reused
+DNS_CACHE_SECONDS = 300
+KEEPALIVE_SECONDS = 30
+
+# Total time allowed for one request, connection included
+REQUEST_TIMEOUT_SECONDS = 15
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    Create a client session over a pooled connector: connections are kept alive between requests,
+    limited per host, and host names are resolved once per DNS_CACHE_SECONDS.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=MAX_CONNECTIONS,
+        limit_per_host=MAX_CONNECTIONS_PER_HOST,
+        ttl_dns_cache=DNS_CACHE_SECONDS,
+        keepalive_timeout=KEEPALIVE_SECONDS
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT_SECONDS))
+
+@asynccontextmanager
+async def session_or_new(session: aiohttp.ClientSession = None):
+    """
+    Yield the given session, or a new one closed on exit when none was given,
+    for classes that can run with or without a pipeline context.
+    """
+    if session is not None:
+        yield session
+    else:
+        async with create_session() as new_session:
+            yield new_session
+
+class PipelineContext:
+    """
+    Resources shared by every place the geocoding pipeline processes, for as long as the pipeline runs.
+    Pass its session to MultiGeocoder and GeocodeDataExtractor, so all their requests share one connection pool.
+
+        async with PipelineContext() as context:
+            geocoder = MultiGeocoder(session=context.session)
+    """
+
+    def __init__(self):
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = create_session()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
@@ -0,0 +1,119 @@
+import time
+import asyncio
+
+# Requests per second, burst and timeout (seconds) of each geocoding provider.
+# Nominatim's usage policy allows at most 1 request per second; OpenCage's free tier 1/s and LocationIQ's 2/s.
+PROVIDER_LIMITS = {
+    'OpenCage': {'rate': 1.0, 'burst': 1, 'timeout': 10.0},
+    'Nominatim': {'rate': 1.0, 'burst': 1, 'timeout': 10.0},
+    'LocationIQ': {'rate': 2.0, 'burst': 2, 'timeout': 10.0},
+}
+DEFAULT_LIMITS = {'rate': 1.0, 'burst': 1, 'timeout': 10.0}
+
+# A provider failing this many requests in a row is skipped for RESET_SECONDS, then tried with one request
+FAILURE_THRESHOLD = 5
+RESET_SECONDS = 60
+
+class TokenBucket:
+    """
+    Async token bucket: holds up to `capacity` tokens and refills at `rate` tokens per second.
+    Waiters are served in arrival order. The repository root's rate_limiter.TokenBucket does the same, but
+    the maps scripts run from this directory, where the root modules can't be imported.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = None
+        self._lock_loop = None
+
+    def _loop_lock(self) -> asyncio.Lock:
+        # An asyncio.Lock is bound to the loop it is used in, so each event loop gets its own
+        loop = asyncio.get_running_loop()
+        if self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available and take it.
+        """
+        async with self._loop_lock():
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class CircuitBreaker:
+    """
+    Stops calling a provider after failure_threshold failures in a row. Every reset_seconds after that,
+    one trial request is let through: a success closes the circuit again, a failure keeps it open.
+    """
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_seconds: float = RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        """
+        Whether a request may be sent now.
+        """
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_seconds:
+            return False
+        self.opened_at = now  # Let this trial through, and the next one only after another reset_seconds
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+class ProviderGuard:
+    """
+    Rate limit, timeout and circuit breaker of one geocoding provider.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, timeout: float,
+                 failure_threshold: int = FAILURE_THRESHOLD, reset_seconds: float = RESET_SECONDS):
+        """
+        :param name: The provider's name
+        :param rate: Requests per second
+        :param burst: Requests that may be sent at once after a quiet period
+        :param timeout: Seconds a request may take, not counting the wait for the rate limit
+        :param failure_threshold: Failures in a row after which the provider is skipped
+        :param reset_seconds: How long the provider is skipped before it is tried again
+        """
+        self.name = name
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+
+        self.requests = 0
+        self.timeouts = 0
+        self.skipped = 0
+
+def create_guards(providers) -> dict:
+    """
+    Create the guard of each provider, with its limits from PROVIDER_LIMITS.
+    """
+    return {provider: ProviderGuard(provider, **PROVIDER_LIMITS.get(provider, DEFAULT_LIMITS)) for provider in providers}
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import aiohttp
+from pipeline_context import session_or_new
+from geocode_cache import GeocodeCache
+
+logger = logging.getLogger(__name__)
+
+WIKIDATA_API_URL = 'https://www.wikidata.org/w/api.php'
+WIKIDATA_LANGUAGES = ('en', 'ar', 'he')
+
+# Name of the entries in the GeocodeCache, next to the geocoding providers'
+WIKIDATA_PROVIDER = 'Wikidata'
+
+# wbgetentities accepts up to 50 ids per request
+MAX_IDS_PER_REQUEST = 50
+
+# Ids asked for within this many seconds of each other are sent in the same request
+BATCH_WINDOW_SECONDS = 0.05
+
+def entity_aliases(entity: dict) -> dict:
+    """
+    Read the labels, descriptions and aliases of a wbgetentities entity, by language.
+    """
+    labels_data = entity.get("labels", {})
+    descriptions_data = entity.get("descriptions", {})
+    aliases_data = entity.get("aliases", {})
+
+    data = {}
+    for lang in WIKIDATA_LANGUAGES:
+        data[lang] = {
+            'label': labels_data.get(lang, {}).get('value'),
+            'description': descriptions_data.get(lang, {}).get('value'),
+            'aliases': [alias['value'] for alias in aliases_data.get(lang, [])]
+        }
+    return data
+
+def wikidata_ids(geocoded: dict) -> list[str]:
+    """
+    List the Wikidata ids of the OpenCage results in MultiGeocoder output.
+    """
+    opencage = geocoded.get("OpenCage")
+    results = opencage.get("results", []) if isinstance(opencage, dict) else []
+    return [result["annotations"]["wikidata"] for result in results
+            if isinstance(result, dict) and result.get("annotations", {}).get("wikidata")]
+
+class WikidataAliasFetcher:
+    """
+    Fetches the labels, descriptions and aliases of Wikidata entities, up to 50 ids per wbgetentities request.
+
+    Ids asked for within BATCH_WINDOW_SECONDS of each other go in the same request, and prefetch() sends
+    a whole list at once, e.g. the ids of every place in a message. Answers are kept in a GeocodeCache,
+    so an id is only fetched again once its entry expires. Failed requests are not cached.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession = None, cache: GeocodeCache = None,
+                 batch_window: float = BATCH_WINDOW_SECONDS):
+        """
+        :param session: Shared session of a PipelineContext; without one, each request opens its own session
+        :param cache: Optional persistent cache of the entities' aliases
+        :param batch_window: Seconds to wait for more ids before sending a request
+        """
+        self.session = session
+        self.cache = cache
+        self.batch_window = batch_window
+
+        self._futures = {}  # Id -> future of its aliases, while queued or being fetched
+        self._queued = []  # Ids not sent yet
+        self._flush_handle = None
+        self._requests_in_flight = set()
+
+        self.requests = 0
+        self.fetched_ids = 0
+        self.cached_ids = 0
+
+    async def get(self, wikidata_id: str):
+        """
+        Get the aliases of one entity, batched with the other ids asked for meanwhile.
+
+        :return: The labels, descriptions and aliases by language, or None if the entity doesn't exist
+                 or couldn't be fetched
+        """
+        if self.cache is not None:
+            cached = self.cache.get(wikidata_id, WIKIDATA_PROVIDER)
+            if cached is not None:
+                self.cached_ids += 1
+                if cached.stale:
+                    self._queue(wikidata_id)  # Refresh it with the next request
+                return cached.response if cached.found else None
+        return await asyncio.shield(self._queue(wikidata_id))
+
+    async def prefetch(self, wikidata_ids) -> dict:
+        """
+        Fetch the aliases of many entities at once, without waiting for the batch window, e.g. those of every
+        place in a message. With a cache, the get() calls that follow are answered from it.
+
+        :return: The aliases by id, None for those that don't exist or couldn't be fetched
+        """
+        unique_ids = list(dict.fromkeys(wikidata_ids))
+        lookups = [asyncio.ensure_future(self.get(wikidata_id)) for wikidata_id in unique_ids]
+        await asyncio.sleep(0)  # Let every lookup queue its id
+        self._send_queued()
+        return dict(zip(unique_ids, await asyncio.gather(*lookups)))
+
+    def _queue(self, wikidata_id: str) -> asyncio.Future:
+        future = self._futures.get(wikidata_id)
+        if future is None:
+            future = self._futures[wikidata_id] = asyncio.get_running_loop().create_future()
+            self._queued.append(wikidata_id)
+            if len(self._queued) >= MAX_IDS_PER_REQUEST:
+                self._send_queued()
+            elif self._flush_handle is None:
+                self._flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self._send_queued)
+        return future
+
+    def _send_queued(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._queued:
+            ids, self._queued = self._queued[:MAX_IDS_PER_REQUEST], self._queued[MAX_IDS_PER_REQUEST:]
+            task = asyncio.ensure_future(self._fetch_batch(ids))
+            self._requests_in_flight.add(task)
+            task.add_done_callback(self._requests_in_flight.discard)
+
+    async def _fetch_batch(self, ids: list[str]) -> None:
+        params = {
+            'action': 'wbgetentities',
+            'ids': '|'.join(ids),
+            'props': 'labels|descriptions|aliases',
+            'languages': '|'.join(WIKIDATA_LANGUAGES),
+            'format': 'json'
+        }
+        answers = None  # Aliases by id, once a valid response was read
+        self.requests += 1
+        try:
+            async with session_or_new(self.session) as session:
+                async with session.get(WIKIDATA_API_URL, params=params) as response:
+                    response.raise_for_status()
+                    result = await response.json()
+            if "entities" not in result:
+                # An API error, e.g. a malformed id, comes back as a 200 with an "error" object instead
+                logger.error(f"Wikidata returned no entities for IDs {', '.join(ids)}: {result.get('error')}")
+                return
+
+            entities = {}
+            for entity_id, entity in result["entities"].items():
+                entities[entity_id] = entity
+                # A redirected id is answered under the id it redirects to
+                redirect = entity.get("redirects", {}).get("from")
+                if redirect:
+                    entities[redirect] = entity
+            answers = {}
+            for wikidata_id in ids:
+                entity = entities.get(wikidata_id)
+                answers[wikidata_id] = entity_aliases(entity) if entity is not None and "missing" not in entity else None
+            self.fetched_ids += len(ids)
+
+            if self.cache is not None:
+                for wikidata_id, data in answers.items():
+                    self.cache.put(wikidata_id, WIKIDATA_PROVIDER, data, data is not None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Error fetching data for Wikidata IDs {', '.join(ids)}: {e}")
+        except ValueError as e:
+            logger.error(f"Error parsing JSON response for Wikidata IDs {', '.join(ids)}: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error handling Wikidata IDs {', '.join(ids)}: {e!r}")
+        finally:
+            # Whatever happened, nobody may be left waiting on these ids
+            for wikidata_id in ids:
+                future = self._futures.pop(wikidata_id, None)
+                if future is not None and not future.done():
+                    future.set_result(answers.get(wikidata_id) if answers is not None else None)
+
+    async def wait_for_requests(self) -> None:
+        """
+        Wait for the queued and in-flight requests, e.g. background refreshes; call it before closing the shared session.
+        """
+        self._send_queued()
+        while self._requests_in_flight:
+            await asyncio.gather(*list(self._requests_in_flight), return_exceptions=True)
+
+    def print_stats(self):
+        """
+        Print the requests sent, and the ids fetched and answered from the cache.
+        """
+        print(f"Wikidata: {self.requests} requests for {self.fetched_ids} ids, {self.cached_ids} ids from the cache")
@@ -0,0 +1,159 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import tempfile
+from typing import Optional
+
+from message_record import MessageRecord
+
+# Default directory for downloaded media, next to the session directory
+MEDIA_DIR = os.path.join(os.getcwd(), 'telegram_media')
+
+MAX_DOWNLOAD_WORKERS = 4
+MAX_MEDIA_SIZE_BYTES = 20 * 1024 * 1024
+
+class MediaDownloader:
+    """
+    Downloads the photos and documents attached to scraped messages.
+
+    Files are stored under their SHA-256, so media reposted across channels is kept once. An index maps
+    each Telegram photo/document id to its stored file, so re-runs and reposts skip the download entirely.
+    The local path is recorded in the MessageRecord, e.g. to feed OpenAIClient.chat(image_path=...).
+    """
+
+    def __init__(self, client, media_dir: str = MEDIA_DIR, max_workers: int = MAX_DOWNLOAD_WORKERS,
+                 max_size_bytes: Optional[int] = MAX_MEDIA_SIZE_BYTES, media_types: tuple = ('photo', 'document'),
+                 mime_types: Optional[tuple] = None, call_api=None):
+        """
+        :param client: The Telegram client used to download.
+        :param media_dir: Root directory of the content-addressed store.
+        :param max_workers: Maximum number of downloads in flight.
+        :param max_size_bytes: Larger files are skipped. None disables the limit.
+        :param media_types: Which kinds of media to download ('photo' and/or 'document').
+        :param mime_types: Optional MIME type prefixes to allow, e.g. ('image/', 'video/mp4').
+        :param call_api: Runs each download as call_api(channel, func, *args, **kwargs), e.g. TelegramScraper._call_api,
+                         so downloads share the scraper's in-flight limits and FloodWait handling.
+        """
+        self._client = client
+        self._call_api = call_api
+        self.media_dir = media_dir
+        self.max_size_bytes = max_size_bytes
+        self.media_types = media_types
+        self.mime_types = mime_types
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self._index_path = os.path.join(media_dir, 'index.json')
+
+        os.makedirs(media_dir, exist_ok=True)
+        self._index = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                self._index = json.load(f)
+
+        self._in_flight = {}
+
+        self.downloaded = 0
+        self.skipped = 0
+
+    def _media_key(self, message) -> Optional[str]:
+        """Return the Telegram-wide id of the media, or None if it should not be downloaded."""
+        if message.photo is not None and 'photo' in self.media_types:
+            return f"photo:{message.photo.id}"
+        if message.document is not None and 'document' in self.media_types:
+            return f"document:{message.document.id}"
+        return None
+
+    def _accepts(self, message) -> bool:
+        media_file = message.file
+        if media_file is None:
+            return False
+        if self.max_size_bytes is not None and media_file.size and media_file.size > self.max_size_bytes:
+            return False
+        if self.mime_types and not (media_file.mime_type or '').startswith(self.mime_types):
+            return False
+        return True
+
+    @staticmethod
+    def _hash_file(path: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _store(self, tmp_path: str, extension: str) -> str:
+        """Move a downloaded file into the content-addressed store and return its path."""
+        digest = self._hash_file(tmp_path)
+        path = os.path.join(self.media_dir, digest[:2], digest + extension)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return path
+
+    async def _fetch(self, media_key: str, message, record: MessageRecord) -> Optional[str]:
+        async with self._semaphore:
+            fd, tmp_path = tempfile.mkstemp(dir=self.media_dir, suffix='.part')
+            os.close(fd)
+            try:
+                if self._call_api is not None:
+                    await self._call_api(record.channel, self._client.download_media, message, file=tmp_path)
+                else:
+                    await self._client.download_media(message, file=tmp_path)
+                stored_path = await asyncio.to_thread(self._store, tmp_path, message.file.ext or '')
+            except Exception as e:
+                logging.error(f"Error downloading media of message {record.message_id} in {record.channel}: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return None
+
+        self._index[media_key] = stored_path
+        self.downloaded += 1
+        return stored_path
+
+    async def _download(self, record: MessageRecord, message) -> None:
+        media_key = self._media_key(message)
+        if media_key is None or not self._accepts(message):
+            return
+
+        stored_path = self._index.get(media_key)
+        if stored_path and os.path.exists(stored_path):
+            self.skipped += 1
+        else:
+            # The same media reposted in concurrent batches is downloaded once
+            task = self._in_flight.get(media_key)
+            if task is None:
+                task = self._in_flight[media_key] = asyncio.ensure_future(self._fetch(media_key, message, record))
+                task.add_done_callback(lambda _: self._in_flight.pop(media_key, None))
+            else:
+                self.skipped += 1
+            stored_path = await task
+
+        if stored_path:
+            record.set_media_path(stored_path)
+
+    async def download_batch(self, records: list[MessageRecord], messages: list) -> None:
+        """
+        Download the media of a batch concurrently and set the local path on each record.
+        Failed downloads are logged and left without a path, so the next run retries them.
+
+        :param records: The records built from messages, in the same order.
+        :param messages: The Telethon messages.
+        """
+        pairs = [(record, message) for record, message in zip(records, messages) if message.media]
+        if not pairs:
+            return
+
+        await asyncio.gather(*(self._download(record, message) for record, message in pairs))
+        self.save()
+
+    def save(self) -> None:
+        """
+        Write the media index to disk atomically.
+        """
+        tmp_path = f"{self._index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, indent=4)
+        os.replace(tmp_path, self._index_path)
@@ -0,0 +1,120 @@
+import sys
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import pytz
+
+# Timezone for Israel Standard Time (IST)
+ISRAEL_TZ = pytz.timezone('Asia/Jerusalem')
+
+# Format of the 'timestamp' field in the JSON schema (IST wall-clock time)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+@dataclass(slots=True)
+class MessageRecord:
+    """
+    Compact in-memory form of a scraped message.
+
+    Holds the same information as the message JSON schema without the nested dicts: the timestamp is an
+    integer UTC epoch, and the channel name, message type and media types are interned so every record
+    of a channel shares one string. Convert with from_json()/to_json() at the edges.
+    """
+    channel: str
+    message_id: int
+    date: int  # UTC epoch seconds
+    message: str
+    sender_id: Optional[int]
+    message_type: str
+    media: tuple = ()  # (media_type, media_id, local_path) triples; local_path is None until downloaded
+    duplicate_of: Optional[tuple] = None  # (channel, message_id) of the message this one near-duplicates
+
+    @classmethod
+    def from_telethon(cls, channel_username: str, message) -> 'MessageRecord':
+        """
+        Build a record from a Telethon message.
+        """
+        media = ()
+        if message.media:
+            media = ((sys.intern(type(message.media).__name__), message.id, None),)
+
+        return cls(
+            channel=sys.intern(channel_username),
+            message_id=message.id,
+            date=int(message.date.timestamp()),
+            message=message.message or '',
+            sender_id=message.sender_id,
+            message_type=sys.intern(type(message).__name__),
+            media=media
+        )
+
+    @classmethod
+    def from_json(cls, message_json: dict) -> 'MessageRecord':
+        """
+        Build a record from a message in the JSON schema written by the scraper.
+        """
+        local_time = datetime.strptime(message_json['timestamp'], TIMESTAMP_FORMAT)
+        metadata = message_json.get('metadata', {})
+
+        return cls(
+            channel=sys.intern(message_json['channel']),
+            message_id=message_json['message_id'],
+            date=int(ISRAEL_TZ.localize(local_time).timestamp()),
+            message=message_json['message'],
+            sender_id=metadata.get('sender_id'),
+            message_type=sys.intern(metadata.get('message_type', 'Message')),
+            media=tuple((sys.intern(media['media_type']), media['media_id'], media.get('local_path'))
+                        for media in message_json.get('media', [])),
+            duplicate_of=cls._duplicate_of_from_json(message_json.get('duplicate_of'))
+        )
+
+    @staticmethod
+    def _duplicate_of_from_json(duplicate_json: Optional[dict]) -> Optional[tuple]:
+        if duplicate_json is None:
+            return None
+        return sys.intern(duplicate_json['channel']), duplicate_json['message_id']
+
+    @staticmethod
+    def format_timestamp(date: int) -> str:
+        """
+        Format a UTC epoch as IST wall-clock time, as in the JSON schema.
+        """
+        return datetime.fromtimestamp(date, ISRAEL_TZ).strftime(TIMESTAMP_FORMAT)
+
+    @property
+    def timestamp(self) -> str:
+        """The IST wall-clock time, formatted as in the JSON schema."""
+        return self.format_timestamp(self.date)
+
+    def to_json(self) -> dict:
+        """
+        Convert the record back to the JSON schema, e.g. for json.dump or pd.json_normalize.
+        """
+        message_json = {
+            'channel': self.channel,
+            'message_id': self.message_id,
+            'timestamp': self.timestamp,
+            'message': self.message,
+            'metadata': {
+                'sender_id': self.sender_id,
+                'message_type': self.message_type
+            },
+            'media': [self._media_to_json(media_type, media_id, local_path) for media_type, media_id, local_path in self.media]
+        }
+        if self.duplicate_of is not None:
+            channel, message_id = self.duplicate_of
+            message_json['duplicate_of'] = {'channel': channel, 'message_id': message_id}
+        return message_json
+
+    @staticmethod
+    def _media_to_json(media_type: str, media_id: int, local_path: Optional[str]) -> dict:
+        media_json = {'media_type': media_type, 'media_id': media_id}
+        if local_path is not None:
+            media_json['local_path'] = local_path
+        return media_json
+
+    def set_media_path(self, local_path: str) -> None:
+        """
+        Record where the media of this message was stored locally.
+        """
+        self.media = tuple((media_type, media_id, local_path) for media_type, media_id, _ in self.media)
@@ -0,0 +1,103 @@
+import io
+import gzip
+import json
+import logging
+
+from message_record import MessageRecord
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = (None, 'gzip', 'zstd')
+
+def _infer_compression(path: str):
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return None
+
+def _open_text(path: str, mode: str, compression):
+    """Open path as a UTF-8 text stream through the requested compression."""
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression '{compression}'. Use one of {COMPRESSIONS}.")
+
+    if compression == 'gzip':
+        # Appending to a gzip file adds a new member; readers see one continuous stream
+        return gzip.open(path, mode + 't', encoding='utf-8')
+
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstd compression requires the 'zstandard' package.")
+        if mode == 'r':
+            raw = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+        else:
+            # Each append starts a new zstd frame; concatenated frames decode as one stream
+            raw = zstandard.ZstdCompressor().stream_writer(open(path, mode + 'b'), closefd=True)
+        return io.TextIOWrapper(raw, encoding='utf-8')
+
+    return open(path, mode, encoding='utf-8')
+
+class JsonlSink:
+    """Appends message dicts to a compact JSONL file (optionally gzip/zstd-compressed) as batches arrive."""
+
+    def __init__(self, path: str, compression: str = None, append: bool = True):
+        """
+        :param path: Output file. A '.gz' or '.zst' suffix selects compression when none is given.
+        :param compression: None, 'gzip' or 'zstd'.
+        :param append: Append to an existing file instead of truncating it.
+        """
+        self.path = path
+        self.compression = compression or _infer_compression(path)
+        self.total_messages = 0
+        self._file = _open_text(path, 'a' if append else 'w', self.compression)
+
+    def write_batch(self, messages: list) -> None:
+        """
+        Write a batch of messages (MessageRecords or message dicts), one compact JSON object per line,
+        and flush it so readers can tail the file.
+        """
+        if not messages:
+            return
+        self._file.write(''.join(json.dumps(self._to_json(message), ensure_ascii=False, separators=(',', ':')) + '\n'
+                                 for message in messages))
+        self._file.flush()
+        self.total_messages += len(messages)
+
+    @staticmethod
+    def _to_json(message) -> dict:
+        return message.to_json() if isinstance(message, MessageRecord) else message
+
+    def close(self) -> None:
+        self._file.close()
+        logging.info(f"Wrote {self.total_messages} messages to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class MultiSink:
+    """Fans each batch out to several sinks, e.g. a JsonlSink and a MessageStore."""
+
+    def __init__(self, sinks: list):
+        self.sinks = sinks
+
+    def write_batch(self, messages: list) -> None:
+        for sink in self.sinks:
+            sink.write_batch(messages)
+
+def iter_jsonl(path: str, compression: str = None):
+    """
+    Yield the message dicts stored in a JSONL file written by JsonlSink, one at a time.
+
+    :param path: The JSONL file.
+    :param compression: None, 'gzip' or 'zstd'. Inferred from the file suffix when not given.
+    """
+    with _open_text(path, 'r', compression or _infer_compression(path)) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,223 @@
+import os
+import json
+import sqlite3
+import logging
+from datetime import datetime
+from typing import Optional, Union
+
+from message_record import MessageRecord
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Default location of the message database
+MESSAGE_DB = os.path.join(os.getcwd(), 'telegram_messages.db')
+
+# Rows fetched per round trip when exporting
+EXPORT_BATCH_SIZE = 10_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    channel TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    date INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    sender_id INTEGER,
+    message_type TEXT NOT NULL,
+    media TEXT NOT NULL,
+    duplicate_channel TEXT,
+    duplicate_message_id INTEGER,
+    UNIQUE (channel, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_date ON messages (date);
+CREATE INDEX IF NOT EXISTS idx_messages_channel_date ON messages (channel, date);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    message, content='messages', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, message) VALUES (new.rowid, new.message);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', old.rowid, old.message);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE OF message ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', old.rowid, old.message);
+    INSERT INTO messages_fts (rowid, message) VALUES (new.rowid, new.message);
+END;
+"""
+
+_UPSERT = """
+INSERT INTO messages (channel, message_id, date, message, sender_id, message_type, media,
+                      duplicate_channel, duplicate_message_id)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (channel, message_id) DO UPDATE SET
+    date = excluded.date,
+    message = excluded.message,
+    sender_id = excluded.sender_id,
+    message_type = excluded.message_type,
+    media = excluded.media,
+    duplicate_channel = excluded.duplicate_channel,
+    duplicate_message_id = excluded.duplicate_message_id
+"""
+
+_COLUMNS = "channel, message_id, date, message, sender_id, message_type, media, duplicate_channel, duplicate_message_id"
+
+# Columns added after the first schema, with their types, for databases created before them
+_ADDED_COLUMNS = {
+    'duplicate_channel': 'TEXT',
+    'duplicate_message_id': 'INTEGER',
+}
+
+def _to_epoch(value: Union[datetime, int, None]) -> Optional[int]:
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return value
+
+class MessageStore:
+    """
+    SQLite store of scraped messages, upserted on (channel, message_id).
+
+    Indexed on date and (channel, date), with an FTS5 index over the message text, so filtered
+    queries don't need to reload every message. Has the same write_batch() interface as JsonlSink,
+    so the scraper can stream into it directly.
+    """
+
+    def __init__(self, path: str = MESSAGE_DB):
+        """
+        :param path: The SQLite database file. Created with its schema if missing.
+        """
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(messages)")}
+        with self._conn:
+            for column, column_type in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE messages ADD COLUMN {column} {column_type}")
+
+    @staticmethod
+    def _to_row(message) -> tuple:
+        record = message if isinstance(message, MessageRecord) else MessageRecord.from_json(message)
+        media = json.dumps(record.to_json()['media'], ensure_ascii=False, separators=(',', ':'))
+        duplicate_channel, duplicate_message_id = record.duplicate_of or (None, None)
+        return (record.channel, record.message_id, record.date, record.message,
+                record.sender_id, record.message_type, media, duplicate_channel, duplicate_message_id)
+
+    @staticmethod
+    def _to_record(row: tuple) -> MessageRecord:
+        channel, message_id, date, message, sender_id, message_type, media, duplicate_channel, duplicate_message_id = row
+        return MessageRecord(
+            channel=channel,
+            message_id=message_id,
+            date=date,
+            message=message,
+            sender_id=sender_id,
+            message_type=message_type,
+            media=tuple((item['media_type'], item['media_id'], item.get('local_path')) for item in json.loads(media)),
+            duplicate_of=(duplicate_channel, duplicate_message_id) if duplicate_channel is not None else None
+        )
+
+    def write_batch(self, messages: list) -> None:
+        """
+        Upsert a batch of messages (MessageRecords or message dicts) in one transaction.
+        """
+        if not messages:
+            return
+        with self._conn:
+            self._conn.executemany(_UPSERT, [self._to_row(message) for message in messages])
+
+    def query(self, channel: Optional[str] = None, since: Union[datetime, int, None] = None,
+              until: Union[datetime, int, None] = None, text: Optional[str] = None,
+              limit: Optional[int] = None) -> list[MessageRecord]:
+        """
+        Return matching messages, newest first.
+
+        :param channel: Only messages of this channel.
+        :param since: Only messages at or after this time (datetime or UTC epoch).
+        :param until: Only messages before this time (datetime or UTC epoch).
+        :param text: Only messages containing this phrase (full-text match).
+        :param limit: Maximum number of messages to return.
+        """
+        sql = f"SELECT {', '.join('m.' + column for column in _COLUMNS.split(', '))} FROM messages m"
+        conditions = []
+        params = []
+
+        if text:
+            sql += " JOIN messages_fts f ON f.rowid = m.rowid"
+            conditions.append("messages_fts MATCH ?")
+            params.append('"' + text.replace('"', '""') + '"')
+        if channel:
+            conditions.append("m.channel = ?")
+            params.append(channel)
+        if since is not None:
+            conditions.append("m.date >= ?")
+            params.append(_to_epoch(since))
+        if until is not None:
+            conditions.append("m.date < ?")
+            params.append(_to_epoch(until))
+
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY m.date DESC, m.message_id DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        return [self._to_record(row) for row in self._conn.execute(sql, params)]
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def export_parquet(self, path: str) -> int:
+        """
+        Export all messages to a Parquet file in chunks, so memory stays bounded.
+
+        :param path: The Parquet file to write.
+        :return: The number of exported messages.
+        """
+        if pyarrow is None:
+            raise ImportError("Parquet export requires the 'pyarrow' package.")
+
+        schema = pyarrow.schema([
+            ('channel', pyarrow.string()),
+            ('message_id', pyarrow.int64()),
+            ('date', pyarrow.timestamp('s', tz='UTC')),
+            ('message', pyarrow.string()),
+            ('sender_id', pyarrow.int64()),
+            ('message_type', pyarrow.string()),
+            ('media', pyarrow.string()),
+            ('duplicate_channel', pyarrow.string()),
+            ('duplicate_message_id', pyarrow.int64()),
+        ])
+
+        total = 0
+        cursor = self._conn.execute(f"SELECT {_COLUMNS} FROM messages ORDER BY channel, message_id")
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            while rows := cursor.fetchmany(EXPORT_BATCH_SIZE):
+                columns = list(zip(*rows))
+                writer.write_table(pyarrow.table(
+                    [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)],
+                    schema=schema
+                ))
+                total += len(rows)
+
+        logging.info(f"Exported {total} messages to {path}")
+        return total
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
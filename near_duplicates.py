@@ -0,0 +1,217 @@
+import re
+import zlib
+import random
+from collections import OrderedDict
+from typing import Optional
+
+from message_record import MessageRecord
+from translation_cache import normalize_text
+
+# Messages of the last few days are enough to catch reposts
+MAX_INDEX_ITEMS = 50_000
+
+# Stored messages indexed at startup (see NearDuplicateIndex.add_history): only the recent ones are repost candidates,
+# and signing each one again costs about 0.6 ms
+HISTORY_HOURS = 48
+
+# Estimated Jaccard similarity (over word shingles) above which a message is a near-duplicate
+DUPLICATE_THRESHOLD = 0.8
+
+# 16 bands of 4 rows: pairs above ~0.5 similarity share a band with high probability
+NUM_PERMUTATIONS = 64
+NUM_BANDS = 16
+
+SHINGLE_SIZE = 2
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Harakat, Quranic marks, superscript alef and tatweel
+_ARABIC_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_ARABIC_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',  # Alef forms
+    'ى': 'ي', 'ی': 'ي', 'ئ': 'ي',            # Yeh forms (incl. alef maksura and Farsi yeh)
+    'ؤ': 'و',
+    'ة': 'ه',
+})
+_NON_WORD = re.compile(r'[^\w\s]|_')
+_URL = re.compile(r'https?://\S+|t\.me/\S+')
+
+def normalize_arabic(text: str) -> str:
+    """
+    Normalize a message for near-duplicate detection: drop emoji, links, punctuation and Arabic diacritics,
+    and unify the alef and yeh letter forms, so reposts with different decoration compare equal.
+    """
+    text = _URL.sub(' ', text)
+    text = normalize_text(text)
+    text = _ARABIC_DIACRITICS.sub('', text)
+    text = text.translate(_ARABIC_LETTERS)
+    text = _NON_WORD.sub(' ', text.lower())
+    return ' '.join(text.split())
+
+class NearDuplicateIndex:
+    """
+    Incremental MinHash/LSH index of recent messages.
+
+    Each message is checked against the messages added before it: an exact match on the normalized text
+    is a dictionary lookup, and near matches are found through LSH bands and confirmed on the estimated
+    similarity of the MinHash signatures. Only originals are indexed, so duplicate_of always points to
+    the first message of a cluster. The oldest messages are dropped once max_items is reached.
+    """
+
+    def __init__(self, threshold: float = DUPLICATE_THRESHOLD, num_permutations: int = NUM_PERMUTATIONS,
+                 num_bands: int = NUM_BANDS, shingle_size: int = SHINGLE_SIZE,
+                 max_items: int = MAX_INDEX_ITEMS, seed: int = 1):
+        """
+        :param threshold: Minimum estimated similarity for a message to count as a near-duplicate
+        :param num_permutations: Length of the MinHash signatures
+        :param num_bands: Number of LSH bands; num_permutations must be a multiple of it
+        :param shingle_size: Number of consecutive words per shingle
+        :param max_items: Number of most recent originals kept in the index
+        :param seed: Seed of the hash permutations; indexes only agree when it matches
+        """
+        if num_permutations % num_bands:
+            raise ValueError("num_permutations must be a multiple of num_bands.")
+
+        self.threshold = threshold
+        self.num_permutations = num_permutations
+        self.num_bands = num_bands
+        self.rows_per_band = num_permutations // num_bands
+        self.shingle_size = shingle_size
+        self.max_items = max_items
+
+        rng = random.Random(seed)
+        self._permutations = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+                              for _ in range(num_permutations)]
+
+        # key -> (normalized text, signature), oldest first
+        self._items = OrderedDict()
+        self._exact = {}
+        self._buckets = {}
+
+        self.checked = 0
+        self.duplicates = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _shingle_hashes(self, text: str) -> set:
+        words = text.split()
+        size = self.shingle_size
+        if len(words) <= size:
+            return {zlib.crc32(text.encode('utf-8'))}
+        return {zlib.crc32(' '.join(words[i:i + size]).encode('utf-8')) for i in range(len(words) - size + 1)}
+
+    def signature(self, text: str) -> tuple:
+        """
+        Return the MinHash signature of an already normalized text.
+        """
+        hashes = self._shingle_hashes(text)
+        return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) & _MAX_HASH
+                     for a, b in self._permutations)
+
+    def _band_keys(self, signature: tuple):
+        rows = self.rows_per_band
+        for band in range(self.num_bands):
+            yield band, hash(signature[band * rows:(band + 1) * rows])
+
+    def _similarity(self, first: tuple, second: tuple) -> float:
+        return sum(x == y for x, y in zip(first, second)) / self.num_permutations
+
+    def _find(self, signature: tuple):
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(self._buckets.get(band_key, ()))
+
+        best_key, best_similarity = None, self.threshold
+        for candidate in candidates:
+            similarity = self._similarity(signature, self._items[candidate][1])
+            if similarity >= best_similarity:
+                best_key, best_similarity = candidate, similarity
+        return best_key
+
+    def add(self, key: tuple, text: str) -> Optional[tuple]:
+        """
+        Check a message against the index and add it if it is an original.
+
+        :param key: The (channel, message_id) of the message
+        :param text: The raw message text
+        :return: The key of the message it duplicates, or None if it is new (or has no text)
+        """
+        if key in self._items:
+            return None
+        text = normalize_arabic(text)
+        if not text:
+            return None
+        self.checked += 1
+
+        original = self._exact.get(text)
+        if original is None:
+            signature = self.signature(text)
+            original = self._find(signature)
+        if original is not None:
+            self.duplicates += 1
+            return original
+
+        self._items[key] = (text, signature)
+        self._exact[text] = key
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, set()).add(key)
+
+        while len(self._items) > self.max_items:
+            self._remove_oldest()
+        return None
+
+    def _remove_oldest(self) -> None:
+        key, (text, signature) = self._items.popitem(last=False)
+        if self._exact.get(text) == key:
+            del self._exact[text]
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets[band_key]
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[band_key]
+
+    def mark_duplicates(self, records: list[MessageRecord]) -> int:
+        """
+        Set duplicate_of on the records that near-duplicate an earlier message, oldest records first.
+
+        :return: The number of duplicates found in records
+        """
+        found = 0
+        for record in sorted(records, key=lambda record: (record.date, record.message_id)):
+            original = self.add((record.channel, record.message_id), record.message)
+            if original is not None:
+                record.duplicate_of = original
+                found += 1
+        return found
+
+    def add_history(self, records: list[MessageRecord]) -> None:
+        """
+        Index previously stored messages so that new messages are checked against them too.
+        They are not counted in checked/duplicates and their records are left unchanged.
+        """
+        checked, duplicates = self.checked, self.duplicates
+        for record in sorted(records, key=lambda record: (record.date, record.message_id)):
+            self.add((record.channel, record.message_id), record.message)
+        self.checked, self.duplicates = checked, duplicates
+
+    @property
+    def duplicate_ratio(self) -> float:
+        """Share of the checked messages that were duplicates."""
+        return self.duplicates / self.checked if self.checked else 0.0
+
+class DedupSink:
+    """Marks near-duplicates in each batch, then passes the batch on to another sink."""
+
+    def __init__(self, sink, index: Optional[NearDuplicateIndex] = None):
+        """
+        :param sink: The sink receiving the marked batches
+        :param index: The index to check against; a new one when not given
+        """
+        self.sink = sink
+        self.index = index or NearDuplicateIndex()
+
+    def write_batch(self, messages: list[MessageRecord]) -> None:
+        self.index.mark_duplicates(messages)
+        self.sink.write_batch(messages)
@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import logging
+from typing import Optional
+
+import openai
+from dotenv import load_dotenv
+
+from cost_calculator import CostCalculator
+from cost_metrics import CostMetrics
+from gpt_translator import (SYSTEM_MESSAGE, BATCH_TOKEN_BUDGET, MAX_ITEMS_PER_BATCH, COMPLETION_TOKENS_PER_INPUT_TOKEN,
+                            COMPLETION_TOKENS_PER_ITEM, MAX_COMPLETION_TOKENS, BatchTranslationResponse)
+from message_record import MessageRecord
+
+# Load environment variables from a .env file
+load_dotenv()
+
+# Each job keeps its request file, results and state in a directory of its own under this one
+BATCH_DIR = os.path.join(os.getcwd(), 'translation_batches')
+
+POLL_INTERVAL = 60
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+# Batch API limit on the number of requests in one input file
+MAX_REQUESTS_PER_FILE = 50_000
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "BatchTranslationResponse",
+        "schema": BatchTranslationResponse.model_json_schema()
+    }
+}
+
+def message_key(channel: str, message_id: int) -> str:
+    """Key of a message in the request and state files."""
+    return f"{channel}/{message_id}"
+
+def _write_atomic(path: str, text: str) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+class BatchTranslationJob:
+    """
+    Translates messages offline through the OpenAI Batch API, at batch prices.
+
+    The flow is prepare() -> submit() -> wait() -> download() -> results(), or run() for all of them.
+    Every step records its progress in the job's state file, so running the same job again after an
+    interruption picks up where it stopped instead of paying for the requests twice.
+    """
+
+    def __init__(self, name: str, model: str = "gpt-4o-mini-2024-07-18", batch_dir: str = BATCH_DIR,
+                 client: Optional[openai.OpenAI] = None, poll_interval: float = POLL_INTERVAL,
+                 metrics: Optional[CostMetrics] = None):
+        """
+        :param name: Name of the job; reusing a name resumes that job
+        :param model: The model to translate with
+        :param batch_dir: Directory holding the job directories
+        :param client: The OpenAI client; pass one with a base_url to use another server
+        :param poll_interval: Seconds between status checks while the batch runs
+        :param metrics: Sink receiving the cost record of every response, priced at batch prices
+        """
+        self.name = name
+        self.model = model
+        self.poll_interval = poll_interval
+        self.client = client or openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self.cost_calculator = CostCalculator(model, batch=True)
+
+        self.job_dir = os.path.join(batch_dir, name)
+        os.makedirs(self.job_dir, exist_ok=True)
+        self.state_path = os.path.join(self.job_dir, 'state.json')
+        self.requests_path = os.path.join(self.job_dir, 'requests.jsonl')
+        self.results_path = os.path.join(self.job_dir, 'results.jsonl')
+        self.errors_path = os.path.join(self.job_dir, 'errors.jsonl')
+
+        self.state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+            logging.info(f"Resuming batch job '{name}' (status: {self.state.get('status', 'prepared')})")
+
+        # Track total costs, as OpenAIClient does
+        self.metrics = metrics or CostMetrics()
+        self._costs_recorded = False
+
+    @property
+    def total_prompt_cost(self) -> float:
+        return self.metrics.prompt_cost
+
+    @property
+    def total_completion_cost(self) -> float:
+        return self.metrics.completion_cost
+
+    def _save_state(self) -> None:
+        _write_atomic(self.state_path, json.dumps(self.state, ensure_ascii=False, indent=4))
+
+    def _count_tokens(self, text: str) -> int:
+        return self.cost_calculator.token_counter.num_tokens_from_string(text, self.cost_calculator.encoding_model_name)
+
+    def _build_request(self, custom_id: str, messages: list[str], message_tokens: int) -> dict:
+        user_message = "\n".join([f"{i+1}. {msg}" for i, msg in enumerate(messages)])
+        max_completion_tokens = min(MAX_COMPLETION_TOKENS, message_tokens * COMPLETION_TOKENS_PER_INPUT_TOKEN
+                                    + COMPLETION_TOKENS_PER_ITEM * len(messages))
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model,
+                "messages": [
+                    {"role": "system", "content": SYSTEM_MESSAGE},
+                    {"role": "user", "content": user_message}
+                ],
+                "response_format": RESPONSE_FORMAT,
+                "max_completion_tokens": max_completion_tokens
+            }
+        }
+
+    def prepare(self, records: list[MessageRecord]) -> None:
+        """
+        Write the JSONL request file: one numbered batch of messages per request, sized by the same token
+        budget as the online translator. Empty messages are skipped, and near-duplicates (duplicate_of)
+        are not sent but get their original's translation, unless their original isn't among the records.
+        """
+        if 'requests' in self.state:
+            return
+
+        texts = {message_key(record.channel, record.message_id): record.message
+                 for record in records if record.message and record.duplicate_of is None}
+        duplicates = {}
+        for record in records:
+            if record.duplicate_of is None:
+                continue
+            key = message_key(record.channel, record.message_id)
+            original = message_key(*record.duplicate_of)
+            if original in texts:
+                duplicates[key] = original
+            elif record.message:
+                texts[key] = record.message  # Its original isn't translated in this job, so send it
+
+        groups = []
+        current, current_tokens = [], 0
+        for key, text in texts.items():
+            tokens = self._count_tokens(text)
+            if current and (current_tokens + tokens > BATCH_TOKEN_BUDGET or len(current) >= MAX_ITEMS_PER_BATCH):
+                groups.append((current, current_tokens))
+                current, current_tokens = [], 0
+            current.append(key)
+            current_tokens += tokens
+        if current:
+            groups.append((current, current_tokens))
+
+        requests = {}
+        lines = []
+        for number, (keys, tokens) in enumerate(groups):
+            custom_id = f"request-{number}"
+            requests[custom_id] = keys
+            lines.append(self._build_request(custom_id, [texts[key] for key in keys], tokens))
+
+        if len(lines) > MAX_REQUESTS_PER_FILE:
+            raise ValueError(f"{len(lines)} requests exceed the Batch API limit of {MAX_REQUESTS_PER_FILE} per file; "
+                             f"split the messages over several jobs.")
+
+        _write_atomic(self.requests_path, "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines))
+        self.state.update({'model': self.model, 'requests': requests, 'duplicates': duplicates})
+        self._save_state()
+        logging.info(f"Wrote {len(lines)} requests for {len(texts)} messages to {self.requests_path}")
+
+    def submit(self) -> None:
+        """
+        Upload the request file and create the batch. Steps already done by an earlier run are skipped.
+        """
+        if 'requests' not in self.state:
+            raise ValueError("Nothing to submit; call prepare() first.")
+
+        if 'file_id' not in self.state:
+            with open(self.requests_path, 'rb') as f:
+                self.state['file_id'] = self.client.files.create(file=f, purpose="batch").id
+            self._save_state()
+
+        if 'batch_id' not in self.state:
+            batch = self.client.batches.create(input_file_id=self.state['file_id'], endpoint="/v1/chat/completions",
+                                               completion_window="24h", metadata={"job": self.name})
+            self.state.update({'batch_id': batch.id, 'status': batch.status})
+            self._save_state()
+            logging.info(f"Submitted batch {batch.id}")
+
+    def wait(self) -> str:
+        """
+        Poll the batch until it reaches a final status, and return that status.
+        """
+        while self.state.get('status') not in FINAL_STATUSES:
+            batch = self.client.batches.retrieve(self.state['batch_id'])
+            if batch.status != self.state.get('status'):
+                counts = batch.request_counts
+                progress = f" ({counts.completed}/{counts.total} requests)" if counts else ""
+                logging.info(f"Batch {batch.id}: {batch.status}{progress}")
+            self.state.update({'status': batch.status, 'output_file_id': batch.output_file_id,
+                               'error_file_id': batch.error_file_id})
+            self._save_state()
+            if batch.status not in FINAL_STATUSES:
+                time.sleep(self.poll_interval)
+        return self.state['status']
+
+    def download(self) -> None:
+        """
+        Save the output and error files of a finished batch next to the request file.
+        """
+        for file_key, path in (('output_file_id', self.results_path), ('error_file_id', self.errors_path)):
+            if self.state.get(file_key) and not os.path.exists(path):
+                _write_atomic(path, self.client.files.content(self.state[file_key]).text)
+
+    def results(self) -> tuple[dict, list[str]]:
+        """
+        Join the downloaded responses back to the messages. The cost of the responses is recorded in the
+        metrics the first time.
+
+        :return: The translations by message key, and the keys of the messages that got none
+                 (e.g. to send them again in a new job)
+        """
+        translations = {}
+        if os.path.exists(self.results_path):
+            with open(self.results_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        self._collect(json.loads(line), translations)
+            self._costs_recorded = True
+
+        for key, original in self.state.get('duplicates', {}).items():
+            if original in translations:
+                translations[key] = translations[original]
+
+        requested = [key for keys in self.state.get('requests', {}).values() for key in keys]
+        requested += self.state.get('duplicates', {}).keys()
+        missing = [key for key in requested if key not in translations]
+        if missing:
+            logging.warning(f"{len(missing)} of {len(requested)} messages of job '{self.name}' have no translation.")
+        return translations, missing
+
+    def _collect(self, result: dict, translations: dict) -> None:
+        keys = self.state['requests'].get(result.get('custom_id'), [])
+        response = result.get('response') or {}
+        if result.get('error') or response.get('status_code') != 200:
+            logging.error(f"Request {result.get('custom_id')} failed: {result.get('error') or response.get('body')}")
+            return
+
+        body = response['body']
+        if body.get('usage') and not self._costs_recorded:
+            self.metrics.record(self.cost_calculator.cost_from_usage(body['usage']))
+
+        try:
+            parsed = BatchTranslationResponse.model_validate_json(body['choices'][0]['message']['content'] or '')
+        except (ValueError, KeyError, IndexError) as e:
+            logging.error(f"Could not parse the response to {result.get('custom_id')}: {e}")
+            return
+
+        for item in parsed.translations:
+            translation = item.translation
+            if 1 <= item.number <= len(keys) and translation.hebrew.strip() and translation.english.strip():
+                translations.setdefault(keys[item.number - 1], translation)
+
+    def run(self, records: list[MessageRecord]) -> tuple[dict, list[str]]:
+        """
+        Prepare, submit, wait for and collect the job; safe to call again after an interruption.
+        """
+        self.prepare(records)
+        self.submit()
+        status = self.wait()
+        if status != 'completed':
+            logging.error(f"Batch {self.state['batch_id']} ended as '{status}'")
+        self.download()
+        return self.results()
+
+    def print_total_costs(self):
+        """Prints the total accumulated prompt, completion, and overall costs."""
+        total_cost = self.total_prompt_cost + self.total_completion_cost
+        print(f"Total prompt cost (batch): ${self.total_prompt_cost:.6f}")
+        print(f"Total completion cost (batch): ${self.total_completion_cost:.6f}")
+        print(f"Overall total cost (batch): ${total_cost:.6f}")
+
+# Usage example: python openai_batch.py <job name> [messages.json]
+if __name__ == '__main__':
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+
+    job_name = sys.argv[1] if len(sys.argv) > 1 else "backfill"
+    input_file = sys.argv[2] if len(sys.argv) > 2 else "telegram_messages.json"
+
+    with open(input_file, "r", encoding="utf-8") as f:
+        records = [MessageRecord.from_json(message) for message in json.load(f)]
+
+    job = BatchTranslationJob(job_name)
+    translations, missing = job.run(records)
+
+    print(f"Translated {len(translations)} messages, {len(missing)} missing")
+    job.print_total_costs()
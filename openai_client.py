@@ -2,10 +2,16 @@ import base64
 from typing import Optional
 from pydantic import BaseModel
 import os
+import random
+import asyncio
+import logging
+import itertools
 import openai
 from dotenv import load_dotenv
 
 from cost_calculator import CostCalculator
+from cost_metrics import CostMetrics, CostRecord
+from rate_limiter import TokenBucket
 
 # Load environment variables from a .env file
 load_dotenv()
@@ -13,16 +19,63 @@ load_dotenv()
 # Set your OpenAI API key from the environment variable
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+# Queue priorities of AsyncOpenAIClient requests; lower values are sent first
+LIVE_PRIORITY = 0
+BACKFILL_PRIORITY = 10
+
+MAX_CONCURRENT_REQUESTS = 32
+MAX_RETRIES = 5
+
+# Full-jitter exponential backoff: the n-th retry waits up to BACKOFF_BASE * 2**n seconds
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+# Usage tier 1 limits of gpt-4o, used until the x-ratelimit-* headers report the account's own
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 30_000
+
+# The API enforces per-minute limits over shorter periods too, so bursts are capped at this many seconds' worth
+BURST_SECONDS = 10
+
+# Characters per token when estimating a prompt for the rate limiter, as the API's own limiter does
+CHARACTERS_PER_TOKEN = 4
+
+def _prompt_text(messages) -> str:
+    """The text of all messages, including the text parts of multimodal (list) contents."""
+    texts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif content:
+            texts.extend(part.get("text", "") for part in content if part.get("type") == "text")
+    return "".join(texts)
+
+def _count_images(messages) -> int:
+    return sum(1 for message in messages if isinstance(message.get("content"), list)
+               for part in message["content"] if part.get("type") == "image_url")
+
 class OpenAIClient:
     """Helper class to interact with OpenAI API and calculate costs."""
 
-    def __init__(self, model: str = "gpt-4o-2024-08-06"):
+    def __init__(self, model: str = "gpt-4o-2024-08-06", metrics: Optional[CostMetrics] = None):
+        """
+        :param model: The model to use.
+        :param metrics: Sink receiving the cost record of every call; pass one to share it between clients.
+        """
         self.model = model
         self.cost_calculator = CostCalculator(self.model)
         
         # Track total costs across multiple calls
-        self.total_prompt_cost = 0.0
-        self.total_completion_cost = 0.0
+        self.metrics = metrics or CostMetrics()
+
+    @property
+    def total_prompt_cost(self) -> float:
+        return self.metrics.prompt_cost
+
+    @property
+    def total_completion_cost(self) -> float:
+        return self.metrics.completion_cost
 
     def _encode_image(self, image_path: str) -> str:
         """Encode an image from a file path to a base64 string."""
@@ -66,19 +119,44 @@ class OpenAIClient:
         
         return api_payload
 
-    def _calculate_cost(self, messages, response):
-        """Calculate and accumulate the cost of the prompt and completion."""
-        # Calculate prompt cost
-        full_prompt = "".join([msg['content'] for msg in messages if 'content' in msg])
-        has_image = any("image_url" in msg['content'] for msg in messages)
-        prompt_cost = self.cost_calculator.calculate_prompt_cost(full_prompt, has_image=has_image)
-        self.total_prompt_cost += prompt_cost
-        
-        # Calculate completion cost if response is available
-        if response and response.choices:
-            completion_text = response.choices[0].message.content
-            completion_cost = self.cost_calculator.calculate_completion_cost(completion_text)
-            self.total_completion_cost += completion_cost
+    def _calculate_cost(self, messages, response) -> float:
+        """
+        Record the cost of a call in the metrics and return it. The usage reported with the response is used
+        when present; the tokens are only counted locally when it is missing. Failed calls aren't billed.
+        """
+        if response is None:
+            return 0.0
+
+        image_count = _count_images(messages)
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            cost = self.cost_calculator.cost_from_usage(usage, image_count)
+        else:
+            cost = self._estimate_cost(messages, response, image_count)
+
+        self.metrics.record(cost)
+        return cost.total_cost
+
+    def _estimate_cost(self, messages, response, image_count: int) -> CostRecord:
+        """Count the prompt and completion tokens locally, for responses without usage."""
+        token_counter = self.cost_calculator.token_counter
+        encoding_model = self.cost_calculator.encoding_model_name
+        prompt_tokens = (token_counter.num_tokens_from_string(_prompt_text(messages), encoding_model)
+                         + image_count * self.cost_calculator.estimate_image_tokens())
+
+        completion_tokens = 0
+        if response.choices and response.choices[0].message.content:
+            completion_tokens = token_counter.num_tokens_from_string(response.choices[0].message.content, encoding_model)
+
+        return CostRecord(
+            model=self.model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            prompt_cost=self.cost_calculator.calculate_token_cost(prompt_tokens, 0),
+            completion_cost=self.cost_calculator.calculate_token_cost(0, completion_tokens),
+            image_count=image_count,
+            source='estimate'
+        )
 
     def _handle_response(self, response):
         """Handle the response from the API, checking for parsed or refusal states."""
@@ -129,3 +207,203 @@ class OpenAIClient:
         print(f"Total prompt cost: ${self.total_prompt_cost:.6f}")
         print(f"Total completion cost: ${self.total_completion_cost:.6f}")
         print(f"Overall total cost: ${total_cost:.6f}")
+
+
+class AsyncOpenAIClient(OpenAIClient):
+    """
+    OpenAIClient whose chat() is a coroutine, so many requests can be in flight at once.
+
+    Requests wait in a priority queue and are sent by a fixed pool of workers sharing one connection pool.
+    Before each request, a worker takes from request and token buckets kept in line with the x-ratelimit-*
+    response headers. 429 and 5xx responses and connection errors are retried with jittered exponential
+    backoff; a request that still fails comes back as None, as with OpenAIClient.
+    """
+
+    def __init__(self, model: str = "gpt-4o-2024-08-06", max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS,
+                 max_retries: int = MAX_RETRIES, requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE, base_url: Optional[str] = None,
+                 metrics: Optional[CostMetrics] = None):
+        """
+        :param model: The model to use.
+        :param max_concurrent_requests: Number of workers, i.e. the maximum requests in flight.
+        :param max_retries: Retries of a request after a 429, a 5xx or a connection error.
+        :param requests_per_minute: Request limit until the response headers report the real one.
+        :param tokens_per_minute: Token limit until the response headers report the real one.
+        :param base_url: Another server to send the requests to, e.g. benchmarks.fake_openai.
+        :param metrics: Sink receiving the cost record of every call.
+        """
+        super().__init__(model, metrics)
+        self.base_url = base_url
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_retries = max_retries
+
+        self._request_bucket = TokenBucket(requests_per_minute / 60, requests_per_minute * BURST_SECONDS / 60)
+        self._token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute * BURST_SECONDS / 60)
+
+        # The queue, workers and client are created in the event loop that first uses them
+        self.client = None
+        self._loop = None
+        self._queue = None
+        self._workers = []
+        self._sequence = itertools.count()
+
+        # Load counters
+        self.retries = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def _start_workers(self) -> None:
+        """Create the queue, the workers and the pooled API client for the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+
+        # A new loop (e.g. another asyncio.run) can't reuse the queue, workers or connections of the old one;
+        # the buckets carry over with the limits learned so far
+        # The client is built first: if it raises (e.g. no API key), the loop isn't marked as started and
+        # the error reaches the caller instead of leaving requests queued with no worker to send them
+        client = openai.AsyncOpenAI(api_key=openai.api_key, base_url=self.base_url, max_retries=0)
+        self.client = client
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [loop.create_task(self._worker()) for _ in range(self.max_concurrent_requests)]
+        self._loop = loop
+
+    async def _worker(self):
+        while True:
+            # Wait for room under the request limit before taking a request, so that the request taken
+            # is the most urgent one at the moment it can actually be sent
+            await self._request_bucket.acquire()
+            _, _, api_payload, future = await self._queue.get()
+            try:
+                if not future.cancelled():
+                    response = await self._send_with_retries(api_payload)
+                    if not future.cancelled():
+                        future.set_result(response)
+            except asyncio.CancelledError:
+                # Closing the client: the caller of the request in progress must not wait forever
+                if not future.done():
+                    future.set_exception(RuntimeError("Client closed"))
+                raise
+            finally:
+                self._queue.task_done()
+
+    def _estimate_tokens(self, api_payload) -> int:
+        """
+        Tokens the rate limiter counts for a request: the prompt, estimated from its characters (and images)
+        without tokenizing it, plus max_completion_tokens.
+        """
+        messages = api_payload["messages"]
+        prompt_tokens = (len(_prompt_text(messages)) // CHARACTERS_PER_TOKEN
+                         + _count_images(messages) * self.cost_calculator.estimate_image_tokens())
+        return prompt_tokens + (api_payload.get("max_completion_tokens") or 0)
+
+    def _update_limits(self, headers) -> None:
+        """Align the buckets with the x-ratelimit-* headers of a response."""
+        if headers is None:
+            return
+        for bucket, kind in ((self._request_bucket, "requests"), (self._token_bucket, "tokens")):
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if limit and remaining:
+                try:
+                    bucket.update(float(remaining), float(limit) * BURST_SECONDS / 60, float(limit) / 60)
+                except ValueError:
+                    pass
+
+    def _retry_delay(self, attempt: int, headers) -> float:
+        """
+        Seconds to wait before retrying: what the server asks for in retry-after, plus a little jitter,
+        otherwise full-jitter exponential backoff. Rate limits need no more than that, since the buckets
+        already hold the next request back until the headers say there is room.
+        """
+        if headers is not None:
+            try:
+                if headers.get("retry-after-ms"):
+                    return min(BACKOFF_MAX, float(headers["retry-after-ms"]) / 1000) + random.uniform(0, BACKOFF_BASE)
+                if headers.get("retry-after"):
+                    return min(BACKOFF_MAX, float(headers["retry-after"])) + random.uniform(0, BACKOFF_BASE)
+            except ValueError:
+                pass  # retry-after may also be an HTTP date
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    async def _send_with_retries(self, api_payload):
+        tokens = self._estimate_tokens(api_payload)
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await self._request_bucket.acquire()
+            await self._token_bucket.acquire(tokens)
+            try:
+                raw_response = await self.client.beta.chat.completions.with_raw_response.parse(**api_payload)
+                self._update_limits(raw_response.headers)
+                return raw_response.parse()
+            except openai.APIStatusError as e:
+                self._update_limits(e.response.headers)
+                retryable = e.status_code >= 500 or (e.status_code == 429 and e.code != "insufficient_quota")
+                if not retryable:
+                    print(f"Error calling OpenAI API: {e}")
+                    self.failed += 1
+                    return None
+                if e.status_code == 429:
+                    self.rate_limited += 1
+                error, delay = e, self._retry_delay(attempt, e.response.headers)
+            except openai.APIConnectionError as e:
+                error, delay = e, self._retry_delay(attempt, None)
+            except Exception as e:
+                print(f"Error calling OpenAI API: {e}")
+                self.failed += 1
+                return None
+
+            if attempt < self.max_retries:
+                self.retries += 1
+                logging.warning(f"OpenAI API error ({error}); retrying in {delay:.1f}s "
+                                f"(attempt {attempt + 1} of {self.max_retries})")
+                await asyncio.sleep(delay)
+
+        print(f"Error calling OpenAI API after {self.max_retries + 1} attempts: {error}")
+        self.failed += 1
+        return None
+
+    async def _make_api_call(self, api_payload, priority: int = LIVE_PRIORITY):
+        """Queue the API call at the given priority and return the response, or None if it failed."""
+        self._start_workers()
+        future = self._loop.create_future()
+        await self._queue.put((priority, next(self._sequence), api_payload, future))
+        return await future
+
+    async def complete(self, system_message: str, user_message: str, image_path: Optional[str] = None,
+                       response_format: Optional[BaseModel] = None, max_completion_tokens: Optional[int] = 300,
+                       priority: int = LIVE_PRIORITY):
+        """Same as chat(), but returns the cost of this call along with the result."""
+        messages = self._prepare_messages(system_message, user_message, image_path)
+        api_payload = self._build_api_payload(messages, response_format, max_completion_tokens)
+        response = await self._make_api_call(api_payload, priority)
+        response_result = self._handle_response(response)
+        cost = self._calculate_cost(messages, response)
+        return response_result, cost
+
+    async def chat(self, system_message: str, user_message: str, image_path: Optional[str] = None,
+                   response_format: Optional[BaseModel] = None, max_completion_tokens: Optional[int] = 300,
+                   priority: int = LIVE_PRIORITY):
+        """
+        Send a chat request to OpenAI with optional image input.
+
+        :param priority: Queue priority; LIVE_PRIORITY requests are sent before BACKFILL_PRIORITY ones.
+        """
+        response_result, _ = await self.complete(system_message, user_message, image_path,
+                                                 response_format, max_completion_tokens, priority)
+        return response_result
+
+    async def close(self):
+        """Stop the workers and close the connection pool. Requests still queued fail with a RuntimeError."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        while self._queue is not None and not self._queue.empty():
+            _, _, _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Client closed"))
+        self._loop = None
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
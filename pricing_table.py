@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+import requests
+
+# LiteLLM's model pricing and context window data
+PRICING_URL = "https://raw.githubusercontent.com/BerriAI/litellm/refs/heads/main/model_prices_and_context_window.json"
+
+# Local copy of the pricing data with its ETag/Last-Modified, refreshed when older than PRICING_TTL_SECONDS
+PRICING_CACHE_FILE = "model_prices_cache.json"
+PRICING_TTL_SECONDS = 24 * 3600
+
+# After a failed refresh, wait this long before trying again, so offline hosts don't retry on every start
+PRICING_RETRY_SECONDS = 3600
+PRICING_REQUEST_TIMEOUT = 5
+
+# Prices of the OpenAI models shipped with the code, used when nothing better is available
+PRICING_SNAPSHOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_prices_snapshot.json")
+
+class PricingTable:
+    """
+    Model pricing data with a substring index, to find the pricing of dated or prefixed model names.
+    """
+
+    def __init__(self, data: dict, source: str):
+        """
+        :param data: LiteLLM pricing data, by model name
+        :param source: Where the data came from ('network', 'cache', 'stale cache' or 'snapshot')
+        """
+        self.data = data
+        self.source = source
+        self._max_name_length = max((len(model) for model in data), default=0)
+        self._closest = {}
+
+    def __contains__(self, model_name: str) -> bool:
+        return model_name in self.data
+
+    def __getitem__(self, model_name: str) -> dict:
+        return self.data[model_name]
+
+    def closest(self, model_name: str) -> Optional[str]:
+        """
+        Find the longest model name of the table contained in model_name, e.g. 'gpt-4o-mini' for
+        'openai-gpt-4o-mini-2024-07-18'. Each substring of model_name is looked up instead of scanning the table.
+
+        :param model_name: The input model name.
+        :return: The matching model name, or None if no model name of the table is part of it.
+        """
+        if model_name not in self._closest:
+            self._closest[model_name] = self._find_closest(model_name)
+        return self._closest[model_name]
+
+    def _find_closest(self, model_name: str) -> Optional[str]:
+        for length in range(min(len(model_name), self._max_name_length), 0, -1):
+            for start in range(len(model_name) - length + 1):
+                candidate = model_name[start:start + length]
+                if candidate in self.data:
+                    return candidate
+        return None
+
+# Pricing table of the process, shared by every CostCalculator
+_pricing_table = None
+_pricing_lock = threading.Lock()
+
+def get_pricing_table() -> PricingTable:
+    """
+    Return the pricing table, loading it on first use in the process.
+    """
+    global _pricing_table
+    if _pricing_table is None:
+        with _pricing_lock:
+            if _pricing_table is None:
+                _pricing_table = load_pricing_table()
+    return _pricing_table
+
+def load_pricing_table(cache_file: str = PRICING_CACHE_FILE, ttl_seconds: float = PRICING_TTL_SECONDS) -> PricingTable:
+    """
+    Load the pricing data from the local cache while it is fresh, otherwise revalidate it with a conditional request.
+    When the request fails, fall back to the stale cache, then to the vendored snapshot.
+
+    :param cache_file: Path of the local cache
+    :param ttl_seconds: Age after which the cache is revalidated
+    :return: The pricing table
+    """
+    cache = _read_cache(cache_file)
+    data = cache.get('data')
+    now = time.time()
+    if data and now - cache.get('checked_at', 0) < ttl_seconds:
+        return PricingTable(data, 'cache')
+    if now - cache.get('failed_at', 0) < PRICING_RETRY_SECONDS:
+        return PricingTable(data, 'stale cache') if data else _load_snapshot()
+
+    headers = {}
+    if data and cache.get('etag'):
+        headers['If-None-Match'] = cache['etag']
+    if data and cache.get('last_modified'):
+        headers['If-Modified-Since'] = cache['last_modified']
+
+    try:
+        response = requests.get(PRICING_URL, headers=headers, timeout=PRICING_REQUEST_TIMEOUT)
+        if response.status_code == 304 and data:
+            cache['checked_at'] = now
+            cache.pop('failed_at', None)
+            _write_cache(cache_file, cache)
+            return PricingTable(data, 'cache')
+        if response.status_code != 200:
+            raise ValueError(f"Failed to fetch pricing data. Status code: {response.status_code}")
+
+        cache = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'checked_at': now,
+            'data': response.json()
+        }
+        _write_cache(cache_file, cache)
+        return PricingTable(cache['data'], 'network')
+    except (requests.RequestException, ValueError) as e:
+        logging.warning(f"Could not refresh the pricing data: {e}")
+
+    # Remember the failure, so the next starts don't wait for the network again
+    cache['failed_at'] = now
+    _write_cache(cache_file, cache)
+    return PricingTable(data, 'stale cache') if data else _load_snapshot()
+
+def _load_snapshot() -> PricingTable:
+    with open(PRICING_SNAPSHOT_FILE, 'r', encoding='utf-8') as f:
+        return PricingTable(json.load(f), 'snapshot')
+
+def _read_cache(cache_file: str) -> dict:
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def _write_cache(cache_file: str, cache: dict) -> None:
+    """Write the cache atomically, so a concurrent start never reads half a file."""
+    tmp_path = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, cache_file)
+    except OSError as e:
+        logging.warning(f"Could not write the pricing cache {cache_file}: {e}")
+
+# Refresh the vendored snapshot with the current OpenAI prices
+if __name__ == "__main__":
+    response = requests.get(PRICING_URL, timeout=PRICING_REQUEST_TIMEOUT)
+    response.raise_for_status()
+    snapshot = {model: pricing for model, pricing in response.json().items()
+                if isinstance(pricing, dict) and pricing.get('litellm_provider') == 'openai'}
+    with open(PRICING_SNAPSHOT_FILE, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print(f"Wrote {len(snapshot)} models to {PRICING_SNAPSHOT_FILE}")
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+class TokenBucket:
+    """
+    Async token bucket: holds up to `capacity` tokens and refills at `rate` tokens per second.
+    Waiters are served in arrival order. The bucket may be used from one event loop after another
+    (e.g. successive asyncio.run calls); its tokens carry over.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: Tokens added per second.
+        :param capacity: Maximum number of tokens, i.e. the largest burst.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = None
+        self._lock_loop = None
+
+    def _loop_lock(self) -> asyncio.Lock:
+        # An asyncio.Lock is bound to the loop it is used in, so each event loop gets its own
+        loop = asyncio.get_running_loop()
+        if self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        """
+        Wait until `amount` tokens are available and take them. Amounts above the capacity take a full bucket.
+        """
+        amount = min(amount, self.capacity)
+        async with self._loop_lock():
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+    def update(self, remaining: float, capacity: float, rate: float) -> None:
+        """
+        Adopt the limits and the remaining tokens reported by a server. The local count is only lowered,
+        since the server may not have seen the requests still in flight.
+        """
+        self._refill()
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = min(self._tokens, remaining, capacity)
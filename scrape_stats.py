@@ -0,0 +1,74 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+@dataclass
+class ChannelStats:
+    """Counters for one channel in a sweep, updated as batches arrive."""
+    channel: str
+    total_messages: int = 0
+    batches_fetched: int = 0
+    oldest_message_date: Optional[int] = None  # UTC epoch seconds
+    newest_message_date: Optional[int] = None  # UTC epoch seconds
+    gaps_found: int = 0
+    history_exhausted: bool = False  # The channel ran out of messages before the threshold was reached
+    elapsed_seconds: float = 0.0
+    error: Optional[Exception] = None
+
+    def add_batch(self, records: list) -> None:
+        """
+        Account for a batch of MessageRecords.
+        """
+        self.batches_fetched += 1
+        if not records:
+            return
+
+        self.total_messages += len(records)
+        batch_oldest = min(record.date for record in records)
+        batch_newest = max(record.date for record in records)
+        if self.oldest_message_date is None or batch_oldest < self.oldest_message_date:
+            self.oldest_message_date = batch_oldest
+        if self.newest_message_date is None or batch_newest > self.newest_message_date:
+            self.newest_message_date = batch_newest
+
+@dataclass
+class FetchStats:
+    """Result summary of a multi-channel sweep."""
+    threshold_time: datetime
+    current_time: datetime
+    channels: dict = field(default_factory=dict)  # channel -> ChannelStats
+    elapsed_seconds: float = 0.0
+
+    def channel(self, channel: str) -> ChannelStats:
+        """
+        Return the stats of a channel, creating them on first use.
+        """
+        if channel not in self.channels:
+            self.channels[channel] = ChannelStats(channel)
+        return self.channels[channel]
+
+    @property
+    def total_messages(self) -> int:
+        return sum(stats.total_messages for stats in self.channels.values())
+
+    @property
+    def batches_fetched(self) -> int:
+        return sum(stats.batches_fetched for stats in self.channels.values())
+
+    @property
+    def gaps_found(self) -> int:
+        return sum(stats.gaps_found for stats in self.channels.values())
+
+    @property
+    def failed_channels(self) -> list:
+        return [stats.channel for stats in self.channels.values() if stats.error is not None]
+
+    @property
+    def oldest_message_date(self) -> Optional[int]:
+        dates = [stats.oldest_message_date for stats in self.channels.values() if stats.oldest_message_date is not None]
+        return min(dates) if dates else None
+
+    @property
+    def newest_message_date(self) -> Optional[int]:
+        dates = [stats.newest_message_date for stats in self.channels.values() if stats.newest_message_date is not None]
+        return max(dates) if dates else None
@@ -0,0 +1,160 @@
+import os
+import json
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import pytz
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+
+from checkpoint_store import CheckpointStore
+from message_record import MessageRecord
+from scrape_stats import ChannelStats, FetchStats
+from telegram_service import TelegramScraper, session_dir
+
+# Default file listing the accounts of the pool
+ACCOUNTS_FILE = os.path.join(session_dir, 'accounts.json')
+
+# Channels a single session reads at the same time
+CHANNELS_PER_SESSION = 4
+
+# How many times a channel is handed to another session after its session failed on it
+MAX_CHANNEL_ATTEMPTS = 3
+
+def load_account_configs(path: str = ACCOUNTS_FILE) -> list[dict]:
+    """
+    Load the pool accounts from a JSON list. Each entry has 'session', 'api_id' and 'api_hash',
+    plus either 'phone_number' or 'bot_token'.
+
+    :param path: The JSON file listing the accounts.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+class SessionPool:
+    """
+    Spreads channels across several Telegram accounts so each account's flood limits only cover its share.
+
+    Every session pulls channels from a shared queue, so faster sessions take more of the work. A session
+    under FloodWait stops taking channels until its wait is over, leaving them to the others. A session that
+    drops is retired, and the channel it was reading goes back on the queue for the remaining sessions.
+    """
+
+    def __init__(self, scrapers: list[TelegramScraper], channels_per_session: int = CHANNELS_PER_SESSION,
+                 max_channel_attempts: int = MAX_CHANNEL_ATTEMPTS):
+        """
+        :param scrapers: One started TelegramScraper per account.
+        :param channels_per_session: Channels a single session reads at the same time.
+        :param max_channel_attempts: Sessions a channel is tried on before it is given up.
+        """
+        self.scrapers = scrapers
+        self.channels_per_session = channels_per_session
+        self.max_channel_attempts = max_channel_attempts
+        self.dropped = set()  # Indexes of retired sessions
+        self.last_stats = None
+
+    @classmethod
+    async def from_configs(cls, configs: list[dict], **kwargs) -> 'SessionPool':
+        """
+        Build and sign in one scraper per account config (see load_account_configs).
+        Accounts that fail to start are left out of the pool.
+        """
+        scrapers = []
+        for config in configs:
+            session_name = os.path.join(session_dir, config['session'])
+            scraper = TelegramScraper(client=TelegramClient(session_name, config['api_id'], config['api_hash']))
+            try:
+                await scraper.start(phone_number=config.get('phone_number'), bot_token=config.get('bot_token'))
+                scrapers.append(scraper)
+            except Exception as e:
+                logging.error(f"Session {config['session']} could not start and is left out of the pool: {e}")
+
+        if not scrapers:
+            raise ValueError("No session in the pool could be started.")
+
+        return cls(scrapers, **kwargs)
+
+    async def disconnect(self):
+        await asyncio.gather(*(scraper.disconnect() for scraper in self.scrapers))
+
+    def _is_dropped(self, scraper: TelegramScraper, error: Optional[Exception]) -> bool:
+        return isinstance(error, (ConnectionError, OSError)) or not scraper._client.is_connected()
+
+    async def _session_worker(self, index: int, queue: asyncio.Queue, stats: FetchStats, results: dict,
+                              attempts: dict, checkpoint_store: Optional[CheckpointStore]):
+        scraper = self.scrapers[index]
+
+        while index not in self.dropped:
+            # A flooded session sits out until its wait is over instead of taking more channels
+            if (delay := scraper.flood_wait_remaining()) > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            channel = await queue.get()
+            # The session may have dropped while this worker waited: hand the channel back untried
+            if index in self.dropped:
+                queue.put_nowait(channel)
+                queue.task_done()
+                return
+
+            attempts[channel] = attempts.get(channel, 0) + 1
+            channel_stats = stats.channels[channel] = ChannelStats(channel)
+            channel_messages = await scraper._fetch_channel(channel, stats.threshold_time, channel_stats, checkpoint_store)
+
+            if channel_stats.error is None:
+                results[channel] = channel_messages
+            else:
+                if self._is_dropped(scraper, channel_stats.error):
+                    logging.warning(f"Session {index} dropped; rebalancing its channels to the other sessions.")
+                    self.dropped.add(index)
+                if isinstance(channel_stats.error, FloodWaitError) or index in self.dropped:
+                    if attempts[channel] < self.max_channel_attempts:
+                        logging.info(f"Requeueing {channel} for another session.")
+                        queue.put_nowait(channel)
+                    else:
+                        logging.error(f"Giving up on {channel} after {attempts[channel]} attempts: {channel_stats.error}")
+
+            queue.task_done()
+
+    async def fetch_messages(self, channels: list, time_window_minutes: int,
+                             checkpoint_store: Optional[CheckpointStore] = None) -> list[MessageRecord]:
+        """
+        Same as TelegramScraper.fetch_messages, with the channels spread over the sessions of the pool.
+        Counters are left in self.last_stats. Messages are returned in the order of channels.
+        """
+        current_time = datetime.utcnow().replace(tzinfo=pytz.UTC)
+        stats = FetchStats(threshold_time=current_time - timedelta(minutes=time_window_minutes), current_time=current_time)
+        start_time = time.perf_counter()
+
+        queue = asyncio.Queue()
+        for channel in channels:
+            queue.put_nowait(channel)
+
+        results = {}
+        attempts = {}
+        workers = {
+            asyncio.create_task(self._session_worker(index, queue, stats, results, attempts, checkpoint_store))
+            for index in range(len(self.scrapers)) if index not in self.dropped
+            for _ in range(self.channels_per_session)
+        }
+        all_done = asyncio.create_task(queue.join())
+
+        # Workers only return once their session dropped, so stop when every channel is done or no session is left
+        pending = workers | {all_done}
+        while all_done in pending and pending - {all_done}:
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        stats.elapsed_seconds = time.perf_counter() - start_time
+        self.last_stats = stats
+        self.scrapers[0]._log_stats(stats)
+
+        if not queue.empty():
+            logging.error(f"{queue.qsize()} channels were not fetched: every session dropped.")
+
+        return [record for channel in channels for record in results.get(channel, [])]
@@ -1,12 +1,23 @@
 import os
 import asyncio
+import random
+import time
 from datetime import datetime, timedelta
 import pytz
-from telethon import TelegramClient
+from telethon import TelegramClient, events, utils
+from telethon.errors import FloodWaitError
 from dotenv import load_dotenv
 from telethon.tl.patched import Message
-import json
 import logging
+from typing import Optional
+
+from checkpoint_store import CheckpointStore
+from message_sink import JsonlSink, MultiSink
+from near_duplicates import HISTORY_HOURS, MAX_INDEX_ITEMS, DedupSink
+from message_store import MessageStore
+from message_record import MessageRecord
+from scrape_stats import ChannelStats, FetchStats
+from media_downloader import MediaDownloader
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -26,27 +37,75 @@ os.makedirs(session_dir, exist_ok=True)
 # Set the session file path
 SESSION_NAME = os.path.join(session_dir, 'my_session.session')
 
-# Timezone for Israel Standard Time (IST)
-ISRAEL_TZ = pytz.timezone('Asia/Jerusalem')
+# Concurrency limits for API calls made through a single client
+MAX_CONCURRENT_REQUESTS = 8
+MAX_REQUESTS_PER_CHANNEL = 4
+MAX_FLOOD_RETRIES = 3
+
+# Messages per backfill page: the most Telegram returns for one history request. get_messages splits larger
+# limits into such requests itself, so a bigger page is not a bigger request, only more requests per call.
+HISTORY_PAGE_SIZE = 100
+
+# Times stream mode resumes a channel that failed mid-read, from below the last message it wrote
+MAX_STREAM_RESUMES = 2
+
+# Seconds to wait before reconnecting a dropped listener, doubled after each failed attempt up to MAX_RECONNECT_DELAY
+RECONNECT_DELAY = 5
+MAX_RECONNECT_DELAY = 300
 
 class TelegramScraper:
-    def __init__(self):
+    def __init__(self, client: TelegramClient = None, max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS,
+                 max_requests_per_channel: int = MAX_REQUESTS_PER_CHANNEL, max_flood_retries: int = MAX_FLOOD_RETRIES,
+                 media_options: Optional[dict] = None):
+        """
+        :param client: An already constructed client (e.g. a fake one for benchmarks). Defaults to the session client.
+        :param max_concurrent_requests: Maximum number of API calls in flight across all channels.
+        :param max_requests_per_channel: Maximum number of API calls in flight for a single channel.
+        :param max_flood_retries: How many times a call is retried after a FloodWait before giving up.
+        :param media_options: If given, photos and documents are downloaded as messages are read, using
+                              these keyword arguments for MediaDownloader (an empty dict uses the defaults).
+        """
         try:
-            self._client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
+            self._client = client or TelegramClient(SESSION_NAME, API_ID, API_HASH)
         except Exception as e:
             logging.error(f"Error initializing Telegram client: {e}")
             raise
 
-    async def start(self):
+        self.max_requests_per_channel = max_requests_per_channel
+        self.max_flood_retries = max_flood_retries
+        self._request_semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self._channel_semaphores = {}
+
+        # Flood limits apply to the whole account, so a FloodWait pauses every channel
+        self._flood_wait_until = 0.0
+        self.flood_waits = 0
+
+        # Counters of the most recent fetch_messages/stream_messages sweep
+        self.last_stats = None
+
+        self.media_downloader = (MediaDownloader(self._client, call_api=self._call_api, **media_options)
+                                 if media_options is not None else None)
+
+    async def start(self, phone_number: Optional[str] = None, bot_token: Optional[str] = None):
+        """
+        Connect and sign in, as a bot if a bot token is given, otherwise as the user of phone_number.
+
+        :param phone_number: Defaults to PHONE_NUMBER from the environment.
+        :param bot_token: Bot token to sign in with instead of a phone number.
+        """
+        phone_number = phone_number or PHONE_NUMBER
+        if bot_token is None and phone_number.startswith('123456:'):
+            bot_token = phone_number
+
         try:
             await self._client.connect()
             if not await self._client.is_user_authorized():
-                if PHONE_NUMBER.startswith('123456:'):
-                    await self._client.start(bot_token=PHONE_NUMBER)
+                if bot_token:
+                    await self._client.start(bot_token=bot_token)
                 else:
-                    await self._client.send_code_request(PHONE_NUMBER)
+                    await self._client.send_code_request(phone_number)
                     code = input('Enter the code you received: ')
-                    await self._client.sign_in(PHONE_NUMBER, code)
+                    await self._client.sign_in(phone_number, code)
         except Exception as e:
             logging.error(f"Error starting Telegram client: {e}")
             raise
@@ -54,128 +113,508 @@ class TelegramScraper:
     async def disconnect(self):
         await self._client.disconnect()
 
-    async def read_messages_from_channel(self, channel_username: str, threshold_time: datetime) -> list[dict]:
+    def flood_wait_remaining(self) -> float:
+        """
+        Seconds until this account may make requests again after a FloodWait (0 if it is not limited).
+        """
+        return max(0.0, self._flood_wait_until - asyncio.get_running_loop().time())
+
+    async def _wait_for_flood(self):
+        loop = asyncio.get_running_loop()
+        while (delay := self._flood_wait_until - loop.time()) > 0:
+            await asyncio.sleep(delay)
+
+    async def _call_api(self, channel_username: str, func, *args, **kwargs):
+        """
+        Run a client call under the per-channel and global in-flight limits, sleeping out FloodWait errors.
+
+        :param channel_username: The channel the call is made for.
+        :param func: The client coroutine function to call.
+        :return: Whatever the client call returns.
+        """
+        channel_semaphore = self._channel_semaphores.get(channel_username)
+        if channel_semaphore is None:
+            channel_semaphore = self._channel_semaphores[channel_username] = asyncio.Semaphore(self.max_requests_per_channel)
+
+        attempt = 0
+        while True:
+            async with channel_semaphore:
+                await self._wait_for_flood()
+                async with self._request_semaphore:
+                    try:
+                        return await func(*args, **kwargs)
+                    except FloodWaitError as e:
+                        if attempt >= self.max_flood_retries:
+                            raise
+                        attempt += 1
+                        self.flood_waits += 1
+                        wait_seconds = e.seconds + random.uniform(0, 1)
+                        logging.warning(f"FloodWait of {e.seconds}s on {channel_username}. "
+                                        f"Pausing all requests (retry {attempt}/{self.max_flood_retries}).")
+                        loop = asyncio.get_running_loop()
+                        self._flood_wait_until = max(self._flood_wait_until, loop.time() + wait_seconds)
+
+    async def _build_records(self, channel_username: str, messages: list) -> list[MessageRecord]:
+        records = [MessageRecord.from_telethon(channel_username, message) for message in messages]
+        if self.media_downloader:
+            await self.media_downloader.download_batch(records, messages)
+        return records
+
+    async def iter_messages_from_channel(self, channel_username: str, threshold_time: Optional[datetime],
+                                         min_id: int = 0, stats: Optional[ChannelStats] = None, offset_id: int = 0):
+        """
+        Async generator yielding the messages of a channel as MessageRecord batches, newest first,
+        down to threshold_time and/or min_id. Only one batch is held in memory at a time.
+
+        :param channel_username: The channel to read.
+        :param threshold_time: Messages older than this are skipped. None disables the time bound.
+        :param min_id: Only messages with a greater id are fetched (0 fetches everything).
+        :param stats: Optional ChannelStats updated as batches arrive; its error is set if reading fails.
+        :param offset_id: Only messages with a smaller id are fetched (0 starts from the newest message).
+        """
+        stats = ChannelStats(channel_username) if stats is None else stats
+
         try:
-            channel = await self._client.get_entity(channel_username)
-            result = []
-            total_messages = 0
-            
-            offset_id = 0
-            oldest_message_date = None
-            newest_message_date = None
+            channel = await self._call_api(channel_username, self._client.get_entity, channel_username)
 
             while True:
-                logging.info(f"Fetching batch of messages from {channel_username} (offset_id: {offset_id})")
-                messages = await self._client.get_messages(channel, limit=200, offset_id=offset_id)
-                
+                logging.info(f"Fetching batch of messages from {channel_username} (offset_id: {offset_id}, min_id: {min_id})")
+                messages = await self._call_api(channel_username, self._client.get_messages, channel, limit=200,
+                                                offset_id=offset_id, min_id=min_id)
+
                 if not messages:
                     logging.info(f"No more messages to fetch from {channel_username}")
+                    stats.history_exhausted = True
                     break
 
-                batch_oldest = messages[-1].date
-                batch_newest = messages[0].date
-                
-                logging.info(f"Batch time range: {batch_oldest} to {batch_newest}")
-
-                if oldest_message_date is None or batch_oldest < oldest_message_date:
-                    oldest_message_date = batch_oldest
-                if newest_message_date is None or batch_newest > newest_message_date:
-                    newest_message_date = batch_newest
+                logging.info(f"Batch time range: {messages[-1].date} to {messages[0].date}")
 
+                in_window = []
                 for message in messages:
-                    if message.date and message.date >= threshold_time:
-                        ist_time = message.date.astimezone(ISRAEL_TZ)
-                        message_json = {
-                            'channel': channel_username,
-                            'message_id': message.id,
-                            'timestamp': ist_time.strftime('%Y-%m-%d %H:%M:%S'),
-                            'message': message.message or '',
-                            'metadata': {
-                                'sender_id': message.sender_id,
-                                'message_type': type(message).__name__
-                            },
-                            'media': []
-                        }
-
-                        if message.media:
-                            media_type = type(message.media).__name__
-                            message_json['media'].append({
-                                'media_type': media_type,
-                                'media_id': message.id
-                            })
-
-                        result.append(message_json)
-                        total_messages += 1
+                    if message.date and (threshold_time is None or message.date >= threshold_time):
+                        in_window.append(message)
                     elif message.date < threshold_time:
                         logging.info(f"Reached messages older than threshold. Stopping.")
                         break
 
-                if messages[-1].date < threshold_time:
+                batch = await self._build_records(channel_username, in_window)
+
+                stats.add_batch(batch)
+                if batch:
+                    yield batch
+
+                if threshold_time is not None and messages[-1].date < threshold_time:
                     break
 
                 offset_id = messages[-1].id
 
-            logging.info(f"Total messages fetched from {channel_username}: {total_messages}")
-            logging.info(f"Time range of fetched messages: {oldest_message_date} to {newest_message_date}")
-
-            return result, oldest_message_date
+            logging.info(f"Total messages fetched from {channel_username}: {stats.total_messages}")
 
         except Exception as e:
             logging.error(f"Error reading messages from channel {channel_username}: {e}")
-            return [], None
+            stats.error = e
 
-    async def fetch_messages(self, channels: list, time_window_minutes: int) -> list:
-        messages = []
+    async def read_messages_from_channel(self, channel_username: str, threshold_time: Optional[datetime],
+                                         min_id: int = 0) -> tuple[list[MessageRecord], ChannelStats]:
+        """
+        Read messages from a channel, newest first, down to threshold_time and/or min_id.
+
+        :param channel_username: The channel to read.
+        :param threshold_time: Messages older than this are skipped. None disables the time bound.
+        :param min_id: Only messages with a greater id are fetched (0 fetches everything).
+        :return: The messages, or [] on error, and the channel stats.
+        """
+        result = []
+        stats = ChannelStats(channel_username)
+        async for batch in self.iter_messages_from_channel(channel_username, threshold_time, min_id, stats):
+            result.extend(batch)
+
+        return ([] if stats.error else result), stats
+
+    async def _iter_channel(self, channel: str, threshold_time: datetime, stats: ChannelStats,
+                            checkpoint_store: Optional[CheckpointStore] = None, offset_id: int = 0):
+        start_time = time.perf_counter()
+        last_message_id = checkpoint_store.get(channel) if checkpoint_store else None
+
+        if last_message_id:
+            # Since-last-run mode: only fetch what was posted after the checkpoint, however old it is
+            logging.info(f"Fetching messages from {channel} newer than checkpoint {last_message_id}")
+            batches = self.iter_messages_from_channel(channel, None, min_id=last_message_id, stats=stats,
+                                                      offset_id=offset_id)
+        else:
+            batches = self.iter_messages_from_channel(channel, threshold_time, stats=stats, offset_id=offset_id)
+
+        newest_message_id = 0
+        async for batch in batches:
+            newest_message_id = max(newest_message_id, max(record.message_id for record in batch))
+            yield batch
+
+        if stats.error:
+            stats.elapsed_seconds = time.perf_counter() - start_time
+            return
+
+        # The history ended inside the window: make sure nothing older was skipped
+        if not last_message_id and stats.history_exhausted and stats.total_messages:
+            if await self._check_missing_messages(channel, threshold_time):
+                stats.gaps_found += 1
+
+        if checkpoint_store and newest_message_id:
+            checkpoint_store.update(channel, newest_message_id)
+
+        stats.elapsed_seconds = time.perf_counter() - start_time
+
+    async def _fetch_channel(self, channel: str, threshold_time: datetime, stats: ChannelStats,
+                             checkpoint_store: Optional[CheckpointStore] = None) -> list[MessageRecord]:
+        channel_messages = []
+        async for batch in self._iter_channel(channel, threshold_time, stats, checkpoint_store):
+            channel_messages.extend(batch)
+
+        # A partially read channel is dropped, as before, so its checkpoint is never advanced past a gap
+        return [] if stats.error else channel_messages
+
+    async def _check_missing_messages(self, channel: str, threshold_time: datetime) -> bool:
+        logging.warning(f"The oldest message in {channel} is newer than the threshold time. Checking for missing messages...")
+        # Check if there are any messages in the missing time range
+        missing_messages = await self._call_api(channel, self._client.get_messages, channel, offset_date=threshold_time, limit=1)
+        if not missing_messages:
+            logging.info("No messages found in the missing time range. The channel might not have had any messages during that period.")
+            return False
+
+        logging.warning(f"Found a message in the missing time range. Oldest message: {missing_messages[0].date}")
+        return True
+
+    def _new_stats(self, time_window_minutes: int) -> FetchStats:
         current_time = datetime.utcnow().replace(tzinfo=pytz.UTC)
         threshold_time = current_time - timedelta(minutes=time_window_minutes)
+        self.last_stats = FetchStats(threshold_time=threshold_time, current_time=current_time)
+        return self.last_stats
+
+    def _log_stats(self, stats: FetchStats):
+        oldest = MessageRecord.format_timestamp(stats.oldest_message_date) if stats.oldest_message_date else None
+        newest = MessageRecord.format_timestamp(stats.newest_message_date) if stats.newest_message_date else None
+        logging.info(f"Fetched {stats.total_messages} messages from {len(stats.channels)} channels in "
+                     f"{stats.batches_fetched} batches ({stats.elapsed_seconds:.2f}s), range {oldest} to {newest}, "
+                     f"{stats.gaps_found} gaps, {len(stats.failed_channels)} failed channels")
+
+    async def fetch_messages(self, channels: list, time_window_minutes: int,
+                             checkpoint_store: Optional[CheckpointStore] = None) -> list[MessageRecord]:
+        """
+        Fetch messages from all channels concurrently. Use MessageRecord.to_json() to get the JSON schema.
+        Per-channel and overall counters of the sweep are left in self.last_stats.
+
+        :param channels: Channel usernames to read.
+        :param time_window_minutes: How far back to read channels that have no checkpoint yet.
+        :param checkpoint_store: If given, channels with a checkpoint are read only past their last seen
+                                 message_id, and the store is advanced in memory. The caller saves it once
+                                 the messages are persisted, so a failed write never skips messages.
+        """
+        messages = []
+        stats = self._new_stats(time_window_minutes)
+        start_time = time.perf_counter()
 
         async with self._client:
-            for channel in channels:
-                channel_messages, oldest_message_date = await self.read_messages_from_channel(channel, threshold_time)
-                messages.extend(channel_messages)
-
-                if oldest_message_date and oldest_message_date > threshold_time:
-                    logging.warning("The oldest message is newer than the threshold time. Checking for missing messages...")
-                    # Check if there are any messages in the missing time range
-                    missing_messages = await self._client.get_messages(channel, offset_date=threshold_time, limit=1)
-                    if not missing_messages:
-                        logging.info("No messages found in the missing time range. The channel might not have had any messages during that period.")
-                    else:
-                        logging.warning(f"Found a message in the missing time range. Oldest message: {missing_messages[0].date}")
-
-        # Final check
-        if messages:
-            oldest_message = min(messages, key=lambda x: datetime.strptime(x['timestamp'], '%Y-%m-%d %H:%M:%S'))
-            newest_message = max(messages, key=lambda x: datetime.strptime(x['timestamp'], '%Y-%m-%d %H:%M:%S'))
-            
-            logging.info(f"Overall time range of fetched messages:")
-            logging.info(f"Oldest: {oldest_message['timestamp']}")
-            logging.info(f"Newest: {newest_message['timestamp']}")
-            logging.info(f"Expected range: {threshold_time} to {current_time}")
+            # Channels are fetched concurrently; _call_api keeps the number of in-flight requests bounded
+            results = await asyncio.gather(*(
+                self._fetch_channel(channel, stats.threshold_time, stats.channel(channel), checkpoint_store)
+                for channel in channels
+            ))
+
+        for channel_messages in results:
+            messages.extend(channel_messages)
+
+        stats.elapsed_seconds = time.perf_counter() - start_time
+        self._log_stats(stats)
 
         return messages
 
-async def scrape_telegram_messages(channels: list, time_window_minutes: int):
+    async def stream_messages(self, channels: list, time_window_minutes: int, sink,
+                              checkpoint_store: Optional[CheckpointStore] = None) -> FetchStats:
+        """
+        Fetch messages from all channels concurrently, writing each batch to the sink as it arrives
+        instead of collecting everything in memory. A channel that fails mid-read is resumed from below the
+        last message written, up to MAX_STREAM_RESUMES times, so no batch is written twice.
+
+        :param channels: Channel usernames to read.
+        :param time_window_minutes: How far back to read channels that have no checkpoint yet.
+        :param sink: Where batches are written: a JsonlSink, a MessageStore or anything with write_batch().
+        :param checkpoint_store: Same as in fetch_messages.
+        :return: Per-channel and overall counters of the sweep (also left in self.last_stats).
+        """
+        stats = self._new_stats(time_window_minutes)
+        start_time = time.perf_counter()
+
+        async def stream_channel(channel):
+            channel_stats = stats.channel(channel)
+            channel_start = time.perf_counter()
+            newest_written = oldest_written = 0
+
+            for attempt in range(MAX_STREAM_RESUMES + 1):
+                if attempt:
+                    logging.warning(f"Resuming {channel} below message {oldest_written} after: {channel_stats.error}")
+                    channel_stats.error = None
+                async for batch in self._iter_channel(channel, stats.threshold_time, channel_stats, checkpoint_store,
+                                                      offset_id=oldest_written):
+                    sink.write_batch(batch)
+                    message_ids = [record.message_id for record in batch]
+                    newest_written = max(newest_written, *message_ids)
+                    oldest_written = min(message_ids)
+                if channel_stats.error is None:
+                    break
+
+            # A resumed read only saw older messages, so advance the checkpoint to the newest of the whole read
+            if checkpoint_store and channel_stats.error is None and newest_written:
+                checkpoint_store.update(channel, newest_written)
+            channel_stats.elapsed_seconds = time.perf_counter() - channel_start
+
+        async with self._client:
+            await asyncio.gather(*(stream_channel(channel) for channel in channels))
+
+        stats.elapsed_seconds = time.perf_counter() - start_time
+        self._log_stats(stats)
+
+        return stats
+
+    async def _fetch_shard(self, channel_username: str, entity, low_id: int, high_id: int, threshold_time: datetime,
+                           stats: ChannelStats) -> list[MessageRecord]:
+        """
+        Fetch the messages with low_id < message_id <= high_id, newest first, one history request per page.
+        """
+        records = []
+        offset_id = high_id + 1
+
+        while True:
+            messages = await self._call_api(channel_username, self._client.get_messages, entity,
+                                            limit=HISTORY_PAGE_SIZE, offset_id=offset_id, min_id=low_id)
+
+            if not messages:
+                break
+
+            batch = await self._build_records(channel_username, [message for message in messages
+                                                                 if message.date and message.date >= threshold_time])
+            stats.add_batch(batch)
+            records.extend(batch)
+
+            if messages[-1].date < threshold_time:
+                break
+
+            offset_id = messages[-1].id
+
+        return records
+
+    async def backfill_channel(self, channel_username: str, threshold_time: datetime, shards: Optional[int] = None,
+                               stats: Optional[ChannelStats] = None) -> list[MessageRecord]:
+        """
+        Fetch a deep history window by splitting the message id range covering [threshold_time, now] into
+        shards that are paginated concurrently, each from its own offset, then merged in message_id order.
+
+        :param channel_username: The channel to read.
+        :param threshold_time: Messages older than this are skipped.
+        :param shards: Number of id ranges fetched at once. Defaults to max_requests_per_channel.
+        :param stats: Optional ChannelStats updated as pages arrive.
+        :return: The messages, newest first, or [] on error.
+        """
+        stats = ChannelStats(channel_username) if stats is None else stats
+        shards = shards or self.max_requests_per_channel
+        start_time = time.perf_counter()
+
+        try:
+            entity = await self._call_api(channel_username, self._client.get_entity, channel_username)
+
+            # The newest message bounds the range from above, the first message before the threshold from below
+            newest = await self._call_api(channel_username, self._client.get_messages, entity, limit=1)
+            if not newest:
+                return []
+            before_threshold = await self._call_api(channel_username, self._client.get_messages, entity,
+                                                    limit=1, offset_date=threshold_time)
+            high_id = newest[0].id
+            low_id = before_threshold[0].id if before_threshold else 0
+            if high_id <= low_id:
+                return []
+
+            shard_size = -(-(high_id - low_id) // shards)
+            bounds = [(shard_low, min(shard_low + shard_size, high_id))
+                      for shard_low in range(low_id, high_id, shard_size)]
+            logging.info(f"Backfilling {channel_username} ids {low_id + 1}..{high_id} in {len(bounds)} shards")
+
+            results = await asyncio.gather(*(
+                self._fetch_shard(channel_username, entity, shard_low, shard_high, threshold_time, stats)
+                for shard_low, shard_high in bounds
+            ))
+
+            # Shards are disjoint, but dedupe anyway in case ids shifted between calls
+            merged = {record.message_id: record for shard_records in results for record in shard_records}
+            return [merged[message_id] for message_id in sorted(merged, reverse=True)]
+
+        except Exception as e:
+            logging.error(f"Error backfilling channel {channel_username}: {e}")
+            stats.error = e
+            return []
+        finally:
+            stats.elapsed_seconds = time.perf_counter() - start_time
+
+    async def backfill_messages(self, channels: list, time_window_minutes: int, shards: Optional[int] = None,
+                                checkpoint_store: Optional[CheckpointStore] = None) -> list[MessageRecord]:
+        """
+        Backfill mode of fetch_messages for long windows: every channel is fetched in concurrent id shards,
+        so several history requests per channel are in flight at once. Counters are left in self.last_stats.
+
+        :param channels: Channel usernames to read.
+        :param time_window_minutes: How far back to read.
+        :param shards: Number of id ranges fetched at once per channel. Defaults to max_requests_per_channel.
+        :param checkpoint_store: If given, advanced to the newest message of every channel read successfully.
+        """
+        messages = []
+        stats = self._new_stats(time_window_minutes)
+        start_time = time.perf_counter()
+
+        async with self._client:
+            results = await asyncio.gather(*(
+                self.backfill_channel(channel, stats.threshold_time, shards, stats.channel(channel))
+                for channel in channels
+            ))
+
+        for channel, channel_messages in zip(channels, results):
+            if checkpoint_store and channel_messages:
+                checkpoint_store.update(channel, channel_messages[0].message_id)
+            messages.extend(channel_messages)
+
+        stats.elapsed_seconds = time.perf_counter() - start_time
+        self._log_stats(stats)
+
+        return messages
+
+    async def listen(self, channels: list, output, checkpoint_store: Optional[CheckpointStore] = None,
+                     reconnect_delay: float = RECONNECT_DELAY):
+        """
+        Long-running listener that pushes every new message of the channels to output as soon as it is posted,
+        normalized into the message JSON schema. Runs until cancelled.
+
+        Messages posted while the listener was down (before it started, or during a disconnect) are caught up
+        from the last seen message_id, taken from the checkpoint store on start.
+
+        :param channels: Channel usernames to listen to.
+        :param output: An asyncio.Queue receiving one message dict at a time, or a sink with write_batch().
+        :param checkpoint_store: Provides the ids to catch up from and is advanced as messages are pushed.
+        :param reconnect_delay: Seconds to wait before reconnecting after the client disconnects; doubled after
+                                each failed attempt, up to MAX_RECONNECT_DELAY.
+        """
+        last_seen = {channel: checkpoint_store.get(channel) if checkpoint_store else None for channel in channels}
+        # Serializes catch-up and live events per channel, so messages are pushed once and in order
+        channel_locks = {channel: asyncio.Lock() for channel in channels}
+        channels_by_peer_id = {}
+
+        async def push(channel, records):
+            new_records = [record for record in records
+                           if last_seen[channel] is None or record.message_id > last_seen[channel]]
+            if not new_records:
+                return
+
+            if isinstance(output, asyncio.Queue):
+                for record in new_records:
+                    await output.put(record.to_json())
+            else:
+                output.write_batch(new_records)
+
+            last_seen[channel] = new_records[-1].message_id
+            if checkpoint_store:
+                checkpoint_store.update(channel, last_seen[channel])
+
+        async def catch_up(channel):
+            async with channel_locks[channel]:
+                if last_seen[channel] is None:
+                    return
+                missed = []
+                async for batch in self.iter_messages_from_channel(channel, None, min_id=last_seen[channel]):
+                    missed.extend(batch)
+                if missed:
+                    logging.info(f"Caught up {len(missed)} messages from {channel} since message {last_seen[channel]}")
+                    await push(channel, sorted(missed, key=lambda record: record.message_id))
+
+        async def on_new_message(event):
+            channel = channels_by_peer_id.get(event.chat_id)
+            if channel is None:
+                return
+            async with channel_locks[channel]:
+                await push(channel, await self._build_records(channel, [event.message]))
+
+        for channel in channels:
+            entity = await self._call_api(channel, self._client.get_entity, channel)
+            channels_by_peer_id[utils.get_peer_id(entity)] = channel
+
+        self._client.add_event_handler(on_new_message, events.NewMessage(chats=list(channels_by_peer_id)))
+        logging.info(f"Listening for new messages in {len(channels)} channels")
+
+        try:
+            while True:
+                await asyncio.gather(*(catch_up(channel) for channel in channels))
+                if checkpoint_store:
+                    checkpoint_store.save()
+
+                await self._client.run_until_disconnected()
+
+                delay = reconnect_delay
+                while True:
+                    logging.warning(f"Telegram client disconnected. Reconnecting in {delay}s...")
+                    await asyncio.sleep(delay)
+                    try:
+                        await self._client.connect()
+                        break
+                    except (ConnectionError, OSError) as e:
+                        logging.error(f"Reconnecting failed: {e}")
+                        delay = min(MAX_RECONNECT_DELAY, delay * 2)
+        finally:
+            self._client.remove_event_handler(on_new_message)
+            if checkpoint_store:
+                checkpoint_store.save()
+
+async def scrape_telegram_messages(channels: list, time_window_minutes: int, checkpoint_store: Optional[CheckpointStore] = None):
     scraper = TelegramScraper()
     await scraper.start()
-    result = await scraper.fetch_messages(channels, time_window_minutes)
+    result = await scraper.fetch_messages(channels, time_window_minutes, checkpoint_store)
     await scraper.disconnect()
     return result
 
+async def stream_telegram_messages(channels: list, time_window_minutes: int, sink,
+                                   checkpoint_store: Optional[CheckpointStore] = None):
+    scraper = TelegramScraper()
+    await scraper.start()
+    stats = await scraper.stream_messages(channels, time_window_minutes, sink, checkpoint_store)
+    await scraper.disconnect()
+    return stats
+
+async def listen_telegram_messages(channels: list, output, checkpoint_store: Optional[CheckpointStore] = None):
+    scraper = TelegramScraper()
+    await scraper.start()
+    try:
+        await scraper.listen(channels, output, checkpoint_store)
+    finally:
+        await scraper.disconnect()
+
 if __name__ == '__main__':
     channels = ["From_hebron"]  # Add more channels as needed
     time_window_minutes = 5000  # Fetch messages from the last 60 minutes
+    since_last_run = True  # Only fetch messages newer than the last run, appending them to the output file
+
+    # Compact JSONL, one message per line; use a '.gz' or '.zst' suffix to compress
+    output_file = "telegram_messages.jsonl"
+    checkpoint_store = CheckpointStore() if since_last_run else None
 
     try:
-        result = asyncio.run(scrape_telegram_messages(channels, time_window_minutes))
+        # Messages go both to the JSONL file and to the indexed SQLite store, with reposts marked
+        # by duplicate_of so translation and geocoding can reuse the original's results
+        with JsonlSink(output_file, append=since_last_run) as jsonl_sink, MessageStore() as message_store:
+            sink = DedupSink(MultiSink([jsonl_sink, message_store]))
+            since = datetime.now(pytz.UTC) - timedelta(hours=HISTORY_HOURS)
+            sink.index.add_history(message_store.query(since=since, limit=MAX_INDEX_ITEMS))
+            stats = asyncio.run(stream_telegram_messages(channels, time_window_minutes, sink, checkpoint_store))
 
         # Print the number of messages loaded
-        print(f"Number of messages loaded: {len(result)}")
+        print(f"Number of messages loaded: {stats.total_messages}")
+        print(f"Near-duplicates: {sink.index.duplicates} of {sink.index.checked} messages with text")
+        logging.info(f"Messages saved to {output_file}")
+
+        # Checkpoints are only saved once the messages are on disk
+        if checkpoint_store:
+            checkpoint_store.save()
     except Exception as e:
         logging.error(f"Error running the main event loop: {e}")
-    
-    output_file = "telegram_messages.json"
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(result, f, ensure_ascii=False, indent=4)
-
-    logging.info(f"Messages saved to {output_file}")
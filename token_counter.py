@@ -1,6 +1,26 @@
 import json
+import threading
 import tiktoken
 
+# Encodings loaded so far, shared by every TokenCounter in the process
+_ENCODINGS = {}
+_ENCODINGS_LOCK = threading.Lock()
+
+# Threads used by encode_batch in count_batch
+DEFAULT_NUM_THREADS = 8
+
+def get_encoding(encoding_name: str) -> tiktoken.Encoding:
+    """
+    Return the tiktoken encoding with this name, loading it only once per process.
+    """
+    encoding = _ENCODINGS.get(encoding_name)
+    if encoding is None:
+        with _ENCODINGS_LOCK:
+            encoding = _ENCODINGS.get(encoding_name)
+            if encoding is None:
+                encoding = _ENCODINGS[encoding_name] = tiktoken.get_encoding(encoding_name)
+    return encoding
+
 class TokenCounter:
     def __init__(self, default_encoding: str = "o200k_base"):
         """
@@ -26,6 +46,37 @@ class TokenCounter:
 
         self.default_encoding = default_encoding  # Set the default encoding to use if no match is found
 
+        # Encoding of every model name resolved so far, so each name is matched (and reported) only once
+        self._resolved_encodings = {}
+
+    def encoding_for_model(self, model_name: str) -> tiktoken.Encoding:
+        """
+        Return the encoding of a model, resolving the model name on first use.
+
+        :param model_name: The name of the model.
+        :return: The tiktoken encoding.
+        """
+        encoding = self._resolved_encodings.get(model_name)
+        if encoding is None:
+            encoding = self._resolved_encodings[model_name] = get_encoding(self._resolve_encoding_name(model_name))
+        return encoding
+
+    def _resolve_encoding_name(self, model_name: str) -> str:
+        # Try to get the exact model name first
+        encoding_name = self.model_encoding_map.get(model_name)
+        if encoding_name:
+            return encoding_name
+
+        # If not found, check for partial matches
+        matching_model = self._find_closest_model(model_name)
+        if matching_model:
+            print(f"Using closest match for encoding: '{matching_model}' for input model '{model_name}'")
+            return self.model_encoding_map[matching_model]
+
+        # Default to "o200k_base" if no closest match is found
+        print(f"No close match found. Using default encoding: '{self.default_encoding}' for input model '{model_name}'")
+        return self.default_encoding
+
     def num_tokens_from_string(self, string: str, model_name: str) -> int:
         """
         Returns the number of tokens in a text string for a specified model.
@@ -34,26 +85,19 @@ class TokenCounter:
         :param model_name: The name of the model.
         :return: The number of tokens in the text.
         """
-        # Try to get the exact model name first
-        encoding_name = self.model_encoding_map.get(model_name)
+        return len(self.encoding_for_model(model_name).encode(string))
 
-        # If not found, check for partial matches
-        if not encoding_name:
-            matching_model = self._find_closest_model(model_name)
-            if matching_model:
-                encoding_name = self.model_encoding_map[matching_model]
-                print(f"Using closest match for encoding: '{matching_model}' for input model '{model_name}'")
-            else:
-                # Default to "o200k_base" if no closest match is found
-                encoding_name = self.default_encoding
-                print(f"No close match found. Using default encoding: '{self.default_encoding}' for input model '{model_name}'")
+    def count_batch(self, texts: list[str], model_name: str, num_threads: int = DEFAULT_NUM_THREADS) -> list[int]:
+        """
+        Returns the number of tokens of each text, encoding them in parallel threads.
 
-        # Get encoding based on the encoding name
-        encoding = tiktoken.get_encoding(encoding_name)
-        
-        # Count the tokens
-        num_tokens = len(encoding.encode(string))
-        return num_tokens
+        :param texts: The input texts.
+        :param model_name: The name of the model.
+        :param num_threads: Number of threads tiktoken encodes with.
+        :return: The number of tokens of each text, aligned with texts.
+        """
+        encoded = self.encoding_for_model(model_name).encode_batch(texts, num_threads=num_threads)
+        return [len(tokens) for tokens in encoded]
 
     def _find_closest_model(self, input_model: str) -> str:
         """
@@ -0,0 +1,201 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+# Default location of the cache database
+TRANSLATION_CACHE_DB = os.path.join(os.getcwd(), 'translation_cache.db')
+
+MAX_MEMORY_ITEMS = 10_000
+MAX_DISK_ITEMS = 1_000_000
+TTL_SECONDS = 30 * 24 * 3600
+
+# Disk eviction runs once every this many writes
+EVICT_EVERY_PUTS = 1000
+
+# Hits update last_used_at on disk in batches of this many entries
+TOUCH_BATCH_SIZE = 500
+
+_WHITESPACE = re.compile(r'\s+')
+
+# Variation selectors and joiners that glue emoji sequences together
+_EMOJI_JOINERS = {'\u200d', '\ufe0e', '\ufe0f', '\u20e3'}
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a message for cache lookups: drop emoji and other symbols (e.g. the 🛑/📍 prefixes channels
+    add when forwarding), then collapse whitespace. Letters, digits and punctuation are kept as is.
+    """
+    text = unicodedata.normalize('NFC', text)
+    text = ''.join(char for char in text
+                   if char not in _EMOJI_JOINERS and unicodedata.category(char) not in ('So', 'Sk', 'Cs'))
+    return _WHITESPACE.sub(' ', text).strip()
+
+class CachedTranslation(NamedTuple):
+    translation: str
+    cost: float  # What the translation cost when it was first paid for
+
+class TranslationCache:
+    """
+    Translation cache shared by the Google and GPT translators, keyed on
+    (normalized source text, source language, target language, engine/model).
+
+    A SQLite file keeps entries across runs, with an in-memory LRU in front of it. Entries expire after
+    ttl_seconds, and the least recently used ones are evicted past max_disk_items. Hits and the dollars
+    they saved are counted. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = TRANSLATION_CACHE_DB, max_memory_items: int = MAX_MEMORY_ITEMS,
+                 max_disk_items: int = MAX_DISK_ITEMS, ttl_seconds: Optional[float] = TTL_SECONDS):
+        """
+        :param path: The SQLite database file.
+        :param max_memory_items: Size of the in-memory LRU.
+        :param max_disk_items: Maximum number of entries kept on disk.
+        :param ttl_seconds: Age after which an entry is no longer served. None keeps entries forever.
+        """
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (CachedTranslation, created_at)
+        self._touched = {}  # key -> time of its last hit, not yet written to last_used_at
+        self._puts = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                key TEXT PRIMARY KEY,
+                translation TEXT NOT NULL,
+                cost REAL NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_translations_last_used ON translations (last_used_at)")
+        self._conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_cost = 0.0
+
+    @staticmethod
+    def key(text: str, source_lang: str, target_lang: str, engine: str) -> str:
+        """
+        Return the cache key of a translation request.
+        """
+        raw = '\x1f'.join((engine, source_lang or '', target_lang, normalize_text(text)))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def _remember(self, key: str, entry: CachedTranslation, created_at: float) -> None:
+        self._memory[key] = (entry, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, text: str, source_lang: str, target_lang: str, engine: str) -> Optional[CachedTranslation]:
+        """
+        Look up a translation. A hit adds the entry's cost to saved_cost.
+        """
+        key = self.key(text, source_lang, target_lang, engine)
+        with self._lock:
+            entry = None
+            cached = self._memory.get(key)
+            if cached is not None:
+                entry, created_at = cached
+                self._memory.move_to_end(key)
+            else:
+                row = self._conn.execute(
+                    "SELECT translation, cost, created_at FROM translations WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry, created_at = CachedTranslation(row[0], row[1]), row[2]
+
+            if entry is not None and self._is_expired(created_at):
+                self._memory.pop(key, None)
+                self._touched.pop(key, None)
+                self._conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+                self._conn.commit()
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if cached is None:
+                self._remember(key, entry, created_at)
+
+            # Memory hits count as uses too, or disk eviction would drop the hottest entries first
+            self._touched[key] = time.time()
+            if len(self._touched) >= TOUCH_BATCH_SIZE:
+                self._flush_touched()
+
+            self.hits += 1
+            self.saved_cost += entry.cost
+            return entry
+
+    def put(self, text: str, source_lang: str, target_lang: str, engine: str, translation: str, cost: float) -> None:
+        """
+        Store a translation along with what it cost.
+        """
+        key = self.key(text, source_lang, target_lang, engine)
+        now = time.time()
+        entry = CachedTranslation(translation, cost)
+        with self._lock:
+            self._remember(key, entry, now)
+            self._touched.pop(key, None)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations (key, translation, cost, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, translation, cost, now, now)
+            )
+            self._conn.commit()
+
+            self._puts += 1
+            if self._puts % EVICT_EVERY_PUTS == 0:
+                self._evict()
+
+    def _flush_touched(self) -> None:
+        if not self._touched:
+            return
+        self._conn.executemany("UPDATE translations SET last_used_at = ? WHERE key = ?",
+                               [(used_at, key) for key, used_at in self._touched.items()])
+        self._conn.commit()
+        self._touched.clear()
+
+    def _evict(self) -> None:
+        self._flush_touched()
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM translations WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        self._conn.execute("""
+            DELETE FROM translations WHERE key IN (
+                SELECT key FROM translations ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_disk_items,))
+        self._conn.commit()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def print_stats(self):
+        """
+        Print the hit rate and the dollars saved by cache hits.
+        """
+        print(f"Translation cache: {self.hits} hits, {self.misses} misses ({self.hit_rate:.1%} hit rate)")
+        print(f"Saved by the cache: ${self.saved_cost:.6f}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_touched()
+            self._conn.close()